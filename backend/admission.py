@@ -0,0 +1,78 @@
+"""Admission control for checkout: per-client rate limits and a concurrency cap.
+
+Two cheap gates run before any Square call:
+- `RateLimiter`: a token bucket per client (refills `rate` tokens/second up to `burst`).
+  Buckets live in a bounded LRU so a scan from many addresses can't grow memory.
+- `ConcurrencyLimiter`: at most `limit` checkouts talk to Square at once. Extra callers
+  wait up to `queue_timeout` seconds for a slot, then are turned away.
+
+Both answer with a `retry_after` hint (seconds) so the API can send 429/503 with a
+`Retry-After` header instead of letting requests pile up behind a slow upstream. Limits are
+per process: with N gunicorn workers the host admits up to N x `limit` checkouts.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float, max_clients: int = 50_000):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.max_clients = max_clients
+        # client -> [tokens, last refill (monotonic)]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, client: str) -> Tuple[bool, int]:
+        """Take one token for `client`. Returns (allowed, retry_after seconds)."""
+        if not self.enabled:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            b = self._buckets.get(client)
+            if b is None:
+                b = [self.burst, now]
+                self._buckets[client] = b
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+                b[1] = now
+                self._buckets.move_to_end(client)
+            if b[0] >= 1.0:
+                b[0] -= 1.0
+                return True, 0
+            return False, max(1, math.ceil((1.0 - b[0]) / self.rate))
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: int, queue_timeout: float = 0.0):
+        self.limit = int(limit)
+        self.queue_timeout = max(0.0, float(queue_timeout))
+        self._sem = threading.BoundedSemaphore(self.limit) if self.limit > 0 else None
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    @contextmanager
+    def slot(self) -> Iterator[bool]:
+        """Yield True while holding a slot, or False if none freed up within `queue_timeout`."""
+        if self._sem is None:
+            yield True
+            return
+        if not self._sem.acquire(timeout=self.queue_timeout):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self._sem.release()
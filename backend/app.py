@@ -1,27 +1,38 @@
-import os, uuid, requests
-from flask import Flask, request, jsonify
+import hashlib, json, os, threading, time, uuid, requests
+from flask import Flask, Response, g, request, jsonify, send_file
 from dotenv import load_dotenv
 
+import config
+import metrics
+from admission import ConcurrencyLimiter, RateLimiter
+from cart import CartError, quote, validate_cart
+from catalog_index import CatalogIndex, accepted_encodings, pick_encoding
+from catalog_sync import SIGNATURE_HEADER, CatalogSync, DerivedOutputs, verify_signature
+from idempotency import CheckoutDedupe, KeyConflict
+from inventory import InventoryCache, InventoryUnavailable, add_counts
+from journal import CheckoutJournal, Reconciler, redact_payment
+from square_client import SquareClient, get_client, reset_clients
+from static_files import StaticFiles
+
 load_dotenv()
 
-app = Flask(__name__)
+# Parse and validate all settings once; a bad config fails worker boot (config.ConfigError).
+config.get()
+config.install_sighup_reload()
+
+# No Flask static folder: /static/ is served by static_asset() below.
+app = Flask(__name__, static_folder=None)
 
 def square_env_from_request(payload=None):
-    # Fail-closed: require an explicit, valid configured env to avoid accidentally
-    # hitting production because of a missing/misspelled variable.
-    configured = (os.getenv("SQUARE_ENV", "") or "").strip().lower()
-    allow_override = (os.getenv("SQUARE_ALLOW_ENV_OVERRIDE", "0").strip() == "1")
-
-    if not configured:
-        raise ValueError("SQUARE_ENV is missing; set SQUARE_ENV=sandbox or SQUARE_ENV=production")
-    if configured not in ("production", "sandbox"):
-        raise ValueError(f"Invalid SQUARE_ENV={configured!r}; expected 'sandbox' or 'production'")
-
-    requested = ""
-    if allow_override:
-        requested = (request.args.get("env", "") or request.args.get("mode", "")).strip().lower()
-        if isinstance(payload, dict):
-            requested = (str(payload.get("env") or payload.get("mode") or requested)).strip().lower()
+    # SQUARE_ENV was validated at startup (fail-closed); only overrides need per-request checks.
+    cfg = config.get()
+    configured = cfg.square_env
+    if not cfg.allow_env_override:
+        return configured
+
+    requested = (request.args.get("env", "") or request.args.get("mode", "")).strip().lower()
+    if isinstance(payload, dict):
+        requested = (str(payload.get("env") or payload.get("mode") or requested)).strip().lower()
 
     env = requested or configured
     if env not in ("production", "sandbox"):
@@ -30,80 +41,438 @@ def square_env_from_request(payload=None):
 
 
 def square_creds(env: str):
-    if env == "sandbox":
-        return {
-            "env": "sandbox",
-            "base": "https://connect.squareupsandbox.com",
-            "access_token": os.getenv("SQUARE_ACCESS_TOKEN_SANDBOX", ""),
-            "application_id": os.getenv("SQUARE_APP_ID_SANDBOX", ""),
-            "location_id": os.getenv("SQUARE_LOCATION_ID_SANDBOX", ""),
-        }
-
-    return {
-        "env": "production",
-        "base": "https://connect.squareup.com",
-        "access_token": os.getenv("SQUARE_ACCESS_TOKEN", ""),
-        "application_id": os.getenv("SQUARE_APP_ID", ""),
-        "location_id": os.getenv("SQUARE_LOCATION_ID", ""),
-    }
+    return config.get().creds["sandbox" if env == "sandbox" else "production"].as_dict()
 
 
 def require_square_creds(env: str):
-    c = square_creds(env)
-    missing = [k for k in ("access_token", "application_id", "location_id") if not (c.get(k) or "").strip()]
+    c = config.get().creds["sandbox" if env == "sandbox" else "production"]
+    missing = c.missing()
     if missing:
         raise RuntimeError(f"Missing Square creds for env={env}: {', '.join(missing)}")
-    return {k: (v.strip() if isinstance(v, str) else v) for k, v in c.items()}
+    return c.as_dict()
 
 
 def sq_headers(env: str):
-    creds = require_square_creds(env)
-    return {
-        "Authorization": f"Bearer {creds['access_token']}",
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        # Pin a Square-Version. Update intentionally.
-        "Square-Version": os.getenv("SQUARE_VERSION", "2025-01-16"),
-    }
+    require_square_creds(env)
+    return config.get().square_headers(env)
+
+
+def square_client(env: str) -> SquareClient:
+    # One pooled keep-alive client per env; creds/headers are resolved once on first use.
+    def build():
+        cfg = config.get()
+        return SquareClient(
+            require_square_creds(env)["base"],
+            sq_headers(env),
+            connect_timeout=cfg.square_connect_timeout,
+            read_timeout=cfg.square_read_timeout,
+            max_retries=cfg.square_max_retries,
+            backoff=cfg.square_retry_backoff,
+            pool_maxsize=cfg.square_pool_maxsize,
+        )
+    return get_client(env, build)
 
 
 def money(amount_cents: int, currency: str):
     return {"amount": int(amount_cents), "currency": currency}
 
 def allowed_origins():
-    # Preferred: comma-separated ALLOWED_ORIGINS.
-    raw = os.getenv("ALLOWED_ORIGINS", "").strip()
-    if raw:
-        return {o.strip() for o in raw.split(",") if o.strip()}
-    # Backward compatibility with older single-origin variable.
-    single = os.getenv("ALLOWED_ORIGIN", "").strip()
-    return {single} if single else set()
+    # ALLOWED_ORIGINS (or legacy ALLOWED_ORIGIN), parsed once in config.
+    return config.get().allowed_origins
+
+
+def precomputed_response(pre: config.Precomputed, cache_control: str):
+    resp = Response(status=200, mimetype="application/json")
+    resp.set_etag(pre.etag)
+    resp.headers["Cache-Control"] = cache_control
+    if request.if_none_match.contains_weak(pre.etag):
+        resp.status_code = 304
+        return resp
+    resp.set_data(pre.body)
+    return resp
+
+# ---- Metrics (Prometheus text on /api/metrics) ----
+HTTP_SECONDS = "avstore_http_request_duration_seconds"
+HTTP_RESPONSES = "avstore_http_responses_total"
+HTTP_IN_FLIGHT = "avstore_http_in_flight_requests"
+CHECKOUT_STAGE = "avstore_checkout_stage_seconds"
+SQUARE_RESPONSES = "avstore_square_responses_total"
+CHECKOUT_REPLAYS = "avstore_checkout_replays_total"
+CHECKOUT_REJECTED = "avstore_checkout_rejected_total"
+CHECKOUT_RECONCILED = "avstore_checkout_reconciled_total"
+INVENTORY_LOOKUPS = "avstore_inventory_lookups_total"
+WEBHOOK_EVENTS = "avstore_webhook_events_total"
+CATALOG_PATCHED = "avstore_catalog_patched_products_total"
+metrics.describe(HTTP_SECONDS, "histogram", "Request latency by endpoint.")
+metrics.describe(HTTP_RESPONSES, "counter", "Responses by endpoint and status code.")
+metrics.describe(HTTP_IN_FLIGHT, "gauge", "Requests currently being handled.")
+metrics.describe(CHECKOUT_STAGE, "histogram", "Checkout latency by stage (parse, validate, create_order, create_payment).")
+metrics.describe(SQUARE_RESPONSES, "counter", "Square API responses by operation and status ('error' = transport failure).")
+metrics.describe(CHECKOUT_REPLAYS, "counter", "Checkouts answered from the idempotency cache or a concurrent twin.")
+metrics.describe(CHECKOUT_REJECTED, "counter", "Checkouts turned away by admission control (rate_limited, saturated).")
+metrics.describe(CHECKOUT_RECONCILED, "counter", "Journal transitions recorded by the background reconciler, by outcome.")
+metrics.describe(INVENTORY_LOOKUPS, "counter", "Inventory ids by cache result (hit, miss, coalesced, stale).")
+metrics.describe(WEBHOOK_EVENTS, "counter", "Square webhook deliveries by event type and outcome.")
+metrics.describe(CATALOG_PATCHED, "counter", "Products changed by webhook-driven catalog syncs.")
+
+
+@app.before_request
+def metrics_begin():
+    g.metrics_t0 = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or "unmatched"
+    metrics.gauge_add(HTTP_IN_FLIGHT, 1, endpoint=g.metrics_endpoint)
+
+
+@app.after_request
+def metrics_record(resp):
+    ep = g.get("metrics_endpoint", "unmatched")
+    metrics.observe(HTTP_SECONDS, time.perf_counter() - g.get("metrics_t0", time.perf_counter()), endpoint=ep)
+    metrics.inc(HTTP_RESPONSES, endpoint=ep, status=str(resp.status_code))
+    return resp
+
+
+@app.teardown_request
+def metrics_end(exc=None):
+    ep = g.pop("metrics_endpoint", None)
+    if ep is not None:
+        metrics.gauge_add(HTTP_IN_FLIGHT, -1, endpoint=ep)
+
+
+def square_post(client: SquareClient, op: str, path: str, body: dict) -> requests.Response:
+    # Times the upstream round trip and counts the Square status (or transport error).
+    t0 = time.perf_counter()
+    try:
+        r = client.post(path, json=body)
+    except requests.RequestException:
+        metrics.inc(SQUARE_RESPONSES, op=op, status="error")
+        raise
+    finally:
+        metrics.observe(CHECKOUT_STAGE, time.perf_counter() - t0, stage=op)
+    metrics.inc(SQUARE_RESPONSES, op=op, status=str(r.status_code))
+    return r
 
 # ---- CORS (allow ONLY your storefront origin) ----
 @app.after_request
 def add_cors(resp):
-    allowed = allowed_origins()
     origin = request.headers.get("Origin", "")
-    if origin and origin in allowed:
-        resp.headers["Access-Control-Allow-Origin"] = origin
-        resp.headers["Vary"] = "Origin"
-        resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
-        resp.headers["Access-Control-Allow-Methods"] = "GET,POST,OPTIONS"
+    headers = config.get().cors_headers.get(origin) if origin else None
+    if headers:
+        for k, v in headers:
+            resp.headers[k] = v
+        resp.vary.add("Origin")
     return resp
 
 @app.route("/api/square/checkout", methods=["OPTIONS"])
 def preflight_checkout():
     return ("", 204)
 
-@app.get("/api/health")
-def health():
-    # Keep this endpoint safe for public probes: no secrets, just runtime signals.
+@app.route("/api/square/quote", methods=["OPTIONS"])
+def preflight_quote():
+    return ("", 204)
+
+# ---- Catalog (in-memory index of square_products_latest.json) ----
+catalog = CatalogIndex(config.get().catalog_path, check_interval=config.get().catalog_check_interval)
+
+
+def checkout_catalog():
+    # None disables catalog checks (qty/structure are still validated).
+    if not config.get().checkout_validate_catalog:
+        return None
+    return catalog.snapshot()
+
+
+def _apply_reloaded_config(old, new):
+    global catalog
+    # Credentials/timeouts may have changed: rebuild Square pools lazily on next use.
+    reset_clients()
+    if old is None or old.catalog_path != new.catalog_path or old.catalog_check_interval != new.catalog_check_interval:
+        catalog = CatalogIndex(new.catalog_path, check_interval=new.catalog_check_interval)
+
+
+config.on_reload(_apply_reloaded_config)
+
+
+@app.get("/api/catalog")
+def catalog_json():
+    snap = catalog.snapshot()
+    if snap is None:
+        return jsonify({"ok": False, "error": "Catalog not available"}), 503
+
+    ids = [i.strip() for i in request.args.get("id", "").split(",") if i.strip()]
+    return encoded_json(snap.body(request.args.get("category", ""), ids))
+
+
+def encoded_json(body):
+    # Strong ETag per body and encoding; If-None-Match also matches the identity ETag.
+    enc = pick_encoding(request.headers.get("Accept-Encoding", ""))
+    etag = body.etag if enc == "identity" else f"{body.etag}-{enc}"
+
+    resp = Response(status=200, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.vary.add("Accept-Encoding")
+    resp.headers["Cache-Control"] = config.get().catalog_cache_control
+    inm = request.if_none_match
+    if inm and (inm.contains_weak(etag) or inm.contains_weak(body.etag)):
+        resp.status_code = 304
+        return resp
+    resp.set_data(body.encoded(enc))
+    if enc != "identity":
+        resp.headers["Content-Encoding"] = enc
+    return resp
+
+
+SEARCH_DEFAULT_LIMIT = 24
+SEARCH_MAX_LIMIT = 100
+
+
+@app.get("/api/search")
+def catalog_search():
+    snap = catalog.snapshot()
+    if snap is None:
+        return jsonify({"ok": False, "error": "Catalog not available"}), 503
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+        limit = min(SEARCH_MAX_LIMIT, max(1, int(request.args.get("limit", SEARCH_DEFAULT_LIMIT))))
+    except ValueError:
+        return jsonify({"ok": False, "error": "offset and limit must be integers"}), 400
+    q = request.args.get("q", "")[:200]
+    return encoded_json(snap.search_body(q, request.args.get("category", ""), offset, limit))
+
+
+# ---- Inventory (TTL cache over Square BatchRetrieveInventoryCounts, per env) ----
+def fetch_inventory(env: str, ids):
+    # IN_STOCK counts at the configured location; read-only, so the client may retry it.
+    client = square_client(env)
+    body = {
+        "catalog_object_ids": list(ids),
+        "location_ids": [require_square_creds(env)["location_id"]],
+        "states": ["IN_STOCK"],
+    }
+    counts = {vid: None for vid in ids}
+    while True:
+        try:
+            r = client.post("/v2/inventory/counts/batch-retrieve", json=body, replayable=True)
+        except requests.RequestException:
+            metrics.inc(SQUARE_RESPONSES, op="inventory", status="error")
+            raise
+        metrics.inc(SQUARE_RESPONSES, op="inventory", status=str(r.status_code))
+        if r.status_code >= 300:
+            raise RuntimeError(f"BatchRetrieveInventoryCounts failed: HTTP {r.status_code}")
+        page = r.json()
+        add_counts(counts, page)
+        if not page.get("cursor"):
+            return counts
+        body["cursor"] = page["cursor"]
+
+
+def _build_inventory(cfg):
     return {
-        "ok": True,
-        "debug": bool(app.debug),
-        "squareEnv": (os.getenv("SQUARE_ENV", "") or "").strip().lower(),
-        "allowSquareEnvOverride": (os.getenv("SQUARE_ALLOW_ENV_OVERRIDE", "0").strip() == "1"),
+        env: InventoryCache(
+            lambda ids, env=env: fetch_inventory(env, ids),
+            ttl=cfg.inventory_ttl,
+            batch_size=cfg.inventory_batch_size,
+            stale_if_error=cfg.inventory_stale_if_error,
+            on_lookup=lambda result, n: metrics.inc(INVENTORY_LOOKUPS, n, result=result),
+        )
+        for env in config.SQUARE_ENVS
     }
+
+
+inventory_caches = _build_inventory(config.get())
+
+
+def _reload_inventory(old, new):
+    global inventory_caches
+    fields = ("creds", "inventory_ttl", "inventory_batch_size", "inventory_stale_if_error")
+    if old is None or any(getattr(old, f) != getattr(new, f) for f in fields):
+        inventory_caches = _build_inventory(new)
+
+
+config.on_reload(_reload_inventory)
+
+
+def _quantity(q):
+    return int(q) if q is not None and q == int(q) else q
+
+
+@app.get("/api/inventory")
+def inventory():
+    cfg = config.get()
+    ids = list(dict.fromkeys(i.strip() for i in request.args.get("ids", "").split(",") if i.strip()))
+    if not ids:
+        return jsonify({"ok": False, "error": "ids is required (comma-separated variation ids)"}), 400
+    if len(ids) > cfg.inventory_max_ids:
+        return jsonify({"ok": False, "error": f"Too many ids (max {cfg.inventory_max_ids})"}), 400
+    try:
+        env = square_env_from_request()
+        require_square_creds(env)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": "Invalid configuration", "details": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"ok": False, "error": "Square credentials not configured", "details": str(e)}), 500
+
+    # Only variations we sell reach Square; stray ids would spend quota for nothing.
+    snap = checkout_catalog()
+    unknown = [] if snap is None else [i for i in ids if snap.variation(i) is None]
+    try:
+        counts = inventory_caches[env].get(i for i in ids if i not in unknown)
+    except InventoryUnavailable as e:
+        return jsonify({"ok": False, "error": "Inventory lookup failed", "details": str(e)}), 502
+    resp = jsonify({"ok": True, "counts": {vid: _quantity(q) for vid, q in counts.items()}, "unknown": unknown})
+    resp.headers["Cache-Control"] = f"public, max-age={int(cfg.inventory_ttl)}"
+    return resp
+
+
+# ---- Square webhooks (incremental catalog patches + inventory counts, applied off-request) ----
+def _webhook_counts(counts):
+    # IN_STOCK at our location replaces this worker's cached count; other workers expire by TTL.
+    cfg = config.get()
+    env = cfg.square_env
+    location_id = cfg.creds[env].location_id
+    mine = [c for c in counts if c.get("state") == "IN_STOCK" and c.get("location_id") == location_id
+            and c.get("catalog_object_id")]
+    if mine:
+        inventory_caches[env].put(add_counts({c["catalog_object_id"]: None for c in mine}, {"counts": mine}))
+
+
+def _build_derived(cfg):
+    # convert_catalog.py normally sits next to the catalog (repo root) or one level above backend/.
+    dirs = (os.path.dirname(os.path.abspath(cfg.catalog_path)), os.path.dirname(config.BASE_DIR))
+    return DerivedOutputs(cfg.catalog_merged_path, cfg.catalog_artifacts_dir, dirs)
+
+
+catalog_derived = _build_derived(config.get())
+
+
+def _reload_derived(old, new):
+    global catalog_derived
+    fields = ("catalog_path", "catalog_merged_path", "catalog_artifacts_dir")
+    if old is None or any(getattr(old, f) != getattr(new, f) for f in fields):
+        catalog_derived = _build_derived(new)
+
+
+config.on_reload(_reload_derived)
+
+
+def _catalog_patched(path, doc, changed, before, after):
+    if os.path.abspath(path) == os.path.abspath(catalog.path):
+        catalog.apply_patch(doc, changed, before, after)
+    if os.path.abspath(path) == os.path.abspath(config.get().catalog_path):
+        # The storefront loads the merged file / hashed artifacts, not the raw catalog.
+        catalog_derived.rebuild(doc)
+
+
+def _sync_paths():
+    cfg = config.get()
+    # The merged file is rebuilt from the raw catalog, never patched on its own.
+    merged = os.path.abspath(cfg.catalog_merged_path) if cfg.catalog_merged_path else ""
+    return (cfg.catalog_path,) + tuple(p for p in cfg.catalog_sync_paths if os.path.abspath(p) != merged)
+
+
+catalog_sync = CatalogSync(
+    lambda: square_client(config.get().square_env),
+    _sync_paths,
+    on_counts=_webhook_counts,
+    on_patched=_catalog_patched,
+    on_synced=lambda changed: metrics.inc(CATALOG_PATCHED, len(changed)),
+)
+
+
+def _start_catalog_sync(old, new):
+    if new.webhook_signature_key:
+        catalog_sync.start()
+
+
+_start_catalog_sync(None, config.get())
+config.on_reload(_start_catalog_sync)
+
+
+@app.post("/api/square/webhook")
+def square_webhook():
+    cfg = config.get()
+    if not cfg.webhook_signature_key:
+        return jsonify({"ok": False, "error": "Webhooks not configured"}), 404
+    body = request.get_data()
+    # Square signs the notification URL as registered; behind a proxy request.url may differ.
+    url = cfg.webhook_url or request.url
+    if not verify_signature(cfg.webhook_signature_key, url, body, request.headers.get(SIGNATURE_HEADER, "")):
+        metrics.inc(WEBHOOK_EVENTS, type="unknown", outcome="bad_signature")
+        return jsonify({"ok": False, "error": "Invalid signature"}), 403
+    try:
+        event = json.loads(body)
+    except ValueError:
+        event = None
+    if not isinstance(event, dict):
+        return jsonify({"ok": False, "error": "Body must be a JSON object"}), 400
+
+    outcome = catalog_sync.submit(event)
+    metrics.inc(WEBHOOK_EVENTS, type=str(event.get("type") or ""), outcome=outcome)
+    if outcome == "full":
+        resp = jsonify({"ok": False, "error": "Webhook queue is full, retry later"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = "30"
+        return resp
+    return jsonify({"ok": True, "outcome": outcome})
+
+
+# ---- Static storefront assets (img/, catalog/, square_products_*.json) ----
+STATIC_IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _build_static(cfg):
+    if not cfg.static_root:
+        return None
+    files = StaticFiles(cfg.static_root, cfg.static_patterns, check_interval=cfg.catalog_check_interval)
+    # Hash everything once per worker up front; requests then only re-stat.
+    threading.Thread(target=files.warm, name="static-warm", daemon=True).start()
+    return files
+
+
+static_files = _build_static(config.get())
+
+
+def _reload_static(old, new):
+    global static_files
+    if old is None or (old.static_root, old.static_patterns) != (new.static_root, new.static_patterns):
+        static_files = _build_static(new)
+
+
+config.on_reload(_reload_static)
+
+
+@app.get("/static/<path:relpath>")
+def static_asset(relpath):
+    files = static_files
+    entry = files.entry(relpath) if files is not None else None
+    if entry is None:
+        return jsonify({"ok": False, "error": "Not found"}), 404
+
+    offered = accepted_encodings(request.headers.get("Accept-Encoding", ""))
+    enc = next((e for e in ("br", "gzip") if e in entry.encoded and offered.get(e, 0) > 0), "identity")
+    path, etag = (entry.path, entry.etag) if enc == "identity" else entry.encoded[enc]
+    # Conditional + Range handling by werkzeug; the open file goes to the server's
+    # wsgi.file_wrapper (sendfile under gunicorn).
+    resp = send_file(path, mimetype=entry.mimetype, conditional=True, etag=etag,
+                     last_modified=entry.mtime, max_age=None)
+    resp.headers["Cache-Control"] = STATIC_IMMUTABLE if entry.immutable else config.get().static_cache_control
+    if entry.encoded:
+        resp.vary.add("Accept-Encoding")
+    if enc != "identity":
+        resp.headers["Content-Encoding"] = enc
+    return resp
+
+@app.get("/api/metrics")
+def metrics_scrape():
+    # Optional bearer token so the scrape endpoint can stay private behind a public proxy.
+    token = config.get().metrics_token
+    if token and request.headers.get("Authorization", "") != f"Bearer {token}":
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.get("/api/health")
+def health():
+    # Keep this endpoint safe for public probes: no secrets, just runtime signals (precomputed).
+    return precomputed_response(config.get().health[bool(app.debug)], "no-store")
 
 @app.route("/api/square/bootstrap", methods=["GET", "HEAD"])
 def square_bootstrap():
@@ -114,24 +483,171 @@ def square_bootstrap():
         env = square_env_from_request()
     except ValueError as e:
         return jsonify({"ok": False, "error": "Invalid configuration", "details": str(e)}), 400
-    try:
-        creds = require_square_creds(env)
-    except Exception as e:
-        return jsonify({"ok": False, "error": "Square credentials not configured", "details": str(e)}), 500
+    cfg = config.get()
+    pre = cfg.bootstrap.get(env)
+    if pre is None:
+        try:
+            require_square_creds(env)
+        except Exception as e:
+            return jsonify({"ok": False, "error": "Square credentials not configured", "details": str(e)}), 500
+
+    # Public, non-secret payload: let browsers/CDNs cache it (Vary: Origin comes from CORS).
+    return precomputed_response(pre, cfg.bootstrap_cache_control)
+
+@app.post("/api/square/quote")
+def square_quote():
+    # Instant cart totals from the catalog index; never calls Square.
+    payload = request.get_json(force=True, silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"ok": False, "error": "Request body must be a JSON object"}), 400
+    snap = catalog.snapshot()
+    if snap is None:
+        return jsonify({"ok": False, "error": "Catalog not available"}), 503
+    try:
+        lines = validate_cart(payload.get("cart") or [], snap, config.get().checkout_max_qty)
+    except CartError as e:
+        return jsonify({"ok": False, "error": str(e), "problems": e.problems}), 400
+    currency = payload.get("currency") or config.get().currency
+    return jsonify(quote(lines, config.get().flat_shipping_cents, currency))
+
+# ---- Checkout idempotency (client-supplied checkout key) ----
+checkout_dedupe = CheckoutDedupe(
+    max_entries=config.get().idempotency_max,
+    ttl=config.get().idempotency_ttl,
+    db_path=config.get().idempotency_db,
+)
+CHECKOUT_KEY_NS = uuid.UUID("6f1c1f2e-9d1a-4c55-9a55-6b0e6f3f2a10")
+
+# ---- Checkout journal (durable state transitions) + background reconciler ----
+checkout_journal = CheckoutJournal(config.get().journal_db) if config.get().journal_db else None
+if checkout_journal is not None:
+    reconciler = Reconciler(
+        checkout_journal,
+        square_client,
+        grace=config.get().reconcile_grace,
+        interval=config.get().reconcile_interval,
+        max_attempts=config.get().reconcile_max_attempts,
+        retention=config.get().journal_retention_days * 86400,
+        on_outcome=lambda state: metrics.inc(CHECKOUT_RECONCILED, outcome=state),
+    )
+    reconciler.start()
+
+
+def journal(checkout_id: str, state: str, env: str, order_id: str = "", **data):
+    if checkout_journal is not None:
+        checkout_journal.record(checkout_id, state, env, order_id, **data)
+
+
+def checkout_canceled(checkout_id: str) -> bool:
+    """Whether the journal already settled this checkout by canceling its order."""
+    last = checkout_journal.latest(checkout_id) if checkout_journal is not None else None
+    return last is not None and last.state == "canceled"
+
+
+def canceled_response(checkout_id: str):
+    return jsonify({"ok": False, "error": "This checkout was canceled; please start a new checkout",
+                    "checkout_id": checkout_id}), 409
+
+
+def checkout_fingerprint(payload: dict) -> str:
+    # The payment token is excluded: a retry may carry a freshly tokenized card.
+    body = {k: v for k, v in payload.items() if k not in ("payment_token", "checkout_key")}
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+# ---- Checkout admission control (per-client token bucket + upstream concurrency cap) ----
+def _build_limiters(cfg):
+    # Without a client IP header every shopper behind the tunnel/proxy shares one socket
+    # address, so a per-client bucket would throttle the whole store: leave it off.
+    rate = cfg.checkout_rate_per_min / 60.0 if cfg.checkout_client_header else 0.0
+    return (
+        RateLimiter(rate, cfg.checkout_rate_burst),
+        ConcurrencyLimiter(cfg.checkout_max_concurrent, cfg.checkout_queue_timeout),
+    )
+
+
+checkout_rate, checkout_slots = _build_limiters(config.get())
+
+
+def _reload_limiters(old, new):
+    global checkout_rate, checkout_slots
+    fields = ("checkout_rate_per_min", "checkout_rate_burst", "checkout_client_header", "checkout_max_concurrent",
+              "checkout_queue_timeout")
+    if old is None or any(getattr(old, f) != getattr(new, f) for f in fields):
+        checkout_rate, checkout_slots = _build_limiters(new)
+
+
+config.on_reload(_reload_limiters)
+
+
+def checkout_client_id() -> str:
+    # Behind Cloudflare/a reverse proxy every request comes from the proxy; the rate limit is
+    # keyed by its client IP header (CHECKOUT_CLIENT_IP_HEADER, e.g. CF-Connecting-IP).
+    header = config.get().checkout_client_header
+    if header:
+        forwarded = (request.headers.get(header) or "").split(",")[0].strip()
+        if forwarded:
+            return forwarded
+    return request.remote_addr or "unknown"
+
+
+def rejected(reason: str, status: int, retry_after: int, error: str):
+    metrics.inc(CHECKOUT_REJECTED, reason=reason)
+    resp = jsonify({"ok": False, "error": error, "retry_after": retry_after})
+    resp.status_code = status
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+
+def admitted_checkout(payload: dict, checkout_key: str):
+    # Charged here, past the idempotency lookup: replays and key conflicts cost no tokens.
+    allowed, retry_after = checkout_rate.acquire(checkout_client_id())
+    if not allowed:
+        return rejected("rate_limited", 429, retry_after, "Too many checkout attempts, please retry shortly")
+
+    # Hold an upstream slot for the whole order+payment; fail fast when Square is saturated.
+    slots = checkout_slots
+    with slots.slot() as admitted:
+        if not admitted:
+            return rejected("saturated", 503, slots.retry_after, "Checkout is busy, please retry shortly")
+        return run_checkout(payload, checkout_key)
 
-    return {
-        "env": env,
-        "applicationId": creds["application_id"],
-        "locationId": creds["location_id"],
-        "currency": os.getenv("CHECKOUT_CURRENCY", "USD"),
-        "flatShippingCents": int(os.getenv("SQUARE_FLAT_SHIPPING_CENTS", "0")),
-    }
 
 @app.post("/api/square/checkout")
-def square_checkout():
-    payload = request.get_json(force=True)
-
-    try:
+def square_checkout():
+    t0 = time.perf_counter()
+    payload = request.get_json(force=True, silent=True)
+    metrics.observe(CHECKOUT_STAGE, time.perf_counter() - t0, stage="parse")
+    if not isinstance(payload, dict):
+        return jsonify({"ok": False, "error": "Request body must be a JSON object"}), 400
+
+    key = (request.headers.get("Idempotency-Key") or str(payload.get("checkout_key") or "")).strip()
+    if not key:
+        return admitted_checkout(payload, "")
+    if len(key) > 128:
+        return jsonify({"ok": False, "error": "checkout_key too long (max 128)"}), 400
+
+    def once():
+        resp = app.make_response(admitted_checkout(payload, key))
+        return resp.status_code, resp.get_data(), resp.mimetype
+
+    try:
+        (status, body, mimetype), replayed = checkout_dedupe.run(key, checkout_fingerprint(payload), once)
+    except KeyConflict:
+        return jsonify({"ok": False, "error": "checkout_key was already used for a different checkout"}), 409
+    resp = Response(body, status=status, mimetype=mimetype)
+    if status in (429, 503):
+        # Only admission control answers 429/503 here; keep its hint across the dedupe wrapper.
+        resp.headers["Retry-After"] = str(json.loads(body).get("retry_after") or 1)
+    if replayed:
+        metrics.inc(CHECKOUT_REPLAYS)
+        resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+
+def run_checkout(payload: dict, checkout_key: str):
+    t_validate = time.perf_counter()
+    try:
         env = square_env_from_request(payload)
     except ValueError as e:
         return jsonify({"ok": False, "error": "Invalid configuration", "details": str(e)}), 400
@@ -140,13 +656,16 @@ def square_checkout():
     except Exception as e:
         return jsonify({"ok": False, "error": "Square credentials not configured", "details": str(e)}), 500
 
-    currency = payload.get("currency") or os.getenv("CHECKOUT_CURRENCY", "USD")
+    cfg = config.get()
+    currency = payload.get("currency") or cfg.currency
     location_id = creds["location_id"]
-    flat_ship = int(os.getenv("SQUARE_FLAT_SHIPPING_CENTS", "0"))
+    flat_ship = cfg.flat_shipping_cents
 
     cart = payload.get("cart") or []
     buyer = payload.get("buyer") or {}
     shipping = payload.get("shipping") or {}
+    if not isinstance(buyer, dict) or not isinstance(shipping, dict):
+        return jsonify({"ok": False, "error": "buyer and shipping must be objects"}), 400
     addr = (shipping.get("address") or {})
 
     payment_token = payload.get("payment_token")
@@ -155,17 +674,14 @@ def square_checkout():
     if not cart:
         return jsonify({"ok": False, "error": "Cart is empty"}), 400
 
+    # Validate against the local catalog index so stale/bogus carts never reach Square.
+    try:
+        lines = validate_cart(cart, checkout_catalog(), cfg.checkout_max_qty)
+    except CartError as e:
+        return jsonify({"ok": False, "error": str(e), "problems": e.problems}), 400
+
     # Line items use Square variation IDs as catalog_object_id
-    line_items = []
-    for item in cart:
-        var_id = item.get("variation_id")
-        qty = item.get("qty", 1)
-        if not var_id:
-            return jsonify({"ok": False, "error": "Missing variation_id in cart"}), 400
-        line_items.append({
-            "catalog_object_id": var_id,
-            "quantity": str(int(qty)),
-        })
+    line_items = [{"catalog_object_id": l.variation_id, "quantity": str(l.qty)} for l in lines]
 
     # Flat shipping as service charge (simple and predictable)
     service_charges = []
@@ -192,7 +708,9 @@ def square_checkout():
         }
     }]
 
-    order_idempotency = str(uuid.uuid4())
+    # With a client checkout key, Square idempotency keys are derived from it so retries that
+    # land on another worker (or after a restart) still dedupe at Square.
+    order_idempotency = str(uuid.uuid5(CHECKOUT_KEY_NS, f"{checkout_key}:order")) if checkout_key else str(uuid.uuid4())
     order_body = {
         "idempotency_key": order_idempotency,
         "order": {
@@ -205,21 +723,42 @@ def square_checkout():
         }
     }
 
+    metrics.observe(CHECKOUT_STAGE, time.perf_counter() - t_validate, stage="validate")
+
+    # Every transition is journaled under the order idempotency key; the reconciler settles
+    # orders left without a payment outcome, so failures below only need to report.
+    checkout_id = order_idempotency
+    if checkout_key and checkout_canceled(checkout_id):
+        # The same key would get the canceled order back from Square; never pay against it.
+        return canceled_response(checkout_id)
+    journal(checkout_id, "started", env)
+
     # 1) Create Order
-    base = creds["base"]
-    r = requests.post(f"{base}/v2/orders", headers=sq_headers(env), json=order_body, timeout=60)
-    if r.status_code >= 300:
-        return jsonify({"ok": False, "error": "CreateOrder failed", "details": r.text}), 502
-    order = r.json().get("order", {})
-    order_id = order.get("id")
-    total_money = (order.get("total_money") or {})
-    amount_cents = int(total_money.get("amount", 0))
-
-    if not order_id or amount_cents <= 0:
-        return jsonify({"ok": False, "error": "Invalid order total", "order": order}), 500
+    client = square_client(env)
+    try:
+        r = square_post(client, "create_order", "/v2/orders", order_body)
+    except requests.RequestException as e:
+        journal(checkout_id, "order_failed", env, details=str(e))
+        return jsonify({"ok": False, "error": "CreateOrder failed", "details": str(e)}), 502
+    if r.status_code >= 300:
+        journal(checkout_id, "order_failed", env, status=r.status_code)
+        return jsonify({"ok": False, "error": "CreateOrder failed", "details": r.text}), 502
+    order = r.json().get("order", {})
+    order_id = order.get("id")
+    total_money = (order.get("total_money") or {})
+    amount_cents = int(total_money.get("amount", 0))
+
+    if not order_id or amount_cents <= 0:
+        journal(checkout_id, "order_failed", env, order_id or "", details="Invalid order total")
+        return jsonify({"ok": False, "error": "Invalid order total", "order": order}), 500
+    if order.get("state") == "CANCELED":
+        journal(checkout_id, "canceled", env, order_id, source="square")
+        return canceled_response(checkout_id)
 
     # 2) Charge immediately
-    pay_idempotency = str(uuid.uuid4())
+    pay_idempotency = (
+        str(uuid.uuid5(CHECKOUT_KEY_NS, f"{checkout_key}:payment:{payment_token}")) if checkout_key else str(uuid.uuid4())
+    )
     payment_body = {
         "idempotency_key": pay_idempotency,
         "source_id": payment_token,
@@ -228,12 +767,24 @@ def square_checkout():
         "location_id": location_id,
         "buyer_email_address": buyer.get("email", ""),
         "note": payload.get("note", "")
-    }
-    rp = requests.post(f"{base}/v2/payments", headers=sq_headers(env), json=payment_body, timeout=60)
+    }
+    journal(checkout_id, "order_created", env, order_id, payment=redact_payment(payment_body))
+    try:
+        rp = square_post(client, "create_payment", "/v2/payments", payment_body)
+    except requests.RequestException as e:
+        journal(checkout_id, "payment_unknown", env, order_id, details=str(e))
+        return jsonify({"ok": False, "error": "CreatePayment failed", "details": str(e), "order_id": order_id,
+                        "checkout_id": checkout_id}), 502
     if rp.status_code >= 300:
-        return jsonify({"ok": False, "error": "CreatePayment failed", "details": rp.text, "order_id": order_id}), 502
+        # 4xx is a definitive rejection (order gets canceled); 429/5xx leave the outcome unknown (payment retried).
+        definitive = 400 <= rp.status_code < 500 and rp.status_code != 429
+        journal(checkout_id, "payment_declined" if definitive else "payment_unknown", env, order_id,
+                status=rp.status_code)
+        return jsonify({"ok": False, "error": "CreatePayment failed", "details": rp.text, "order_id": order_id,
+                        "checkout_id": checkout_id}), 502
 
     payment = rp.json().get("payment", {})
+    journal(checkout_id, "paid", env, order_id, payment_id=payment.get("id"))
     return jsonify({
         "ok": True,
         "order_id": order_id,
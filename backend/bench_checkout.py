@@ -0,0 +1,201 @@
+"""Load-test harness for the store API.
+
+Drives a running API (usually pointed at `fake_square.py`) at a fixed concurrency and
+reports latency percentiles and throughput per endpoint:
+
+    python fake_square.py --port 8099 --latency-ms 120 &
+    SQUARE_ENV=sandbox SQUARE_API_BASE_SANDBOX=http://127.0.0.1:8099 \\
+      SQUARE_ACCESS_TOKEN_SANDBOX=x SQUARE_APP_ID_SANDBOX=x SQUARE_LOCATION_ID_SANDBOX=x \\
+      CHECKOUT_RATE_PER_MIN=0 gunicorn -c gunicorn.conf.py app:app &
+    python bench_checkout.py --base http://127.0.0.1:8088 --concurrency 64 --duration 15
+
+`--save-baseline FILE` stores the results; `--baseline FILE` compares against them and
+exits non-zero when an endpoint's p95 or throughput regresses past `--max-regression`.
+All load comes from one address, so disable the per-client checkout rate limit
+(`CHECKOUT_RATE_PER_MIN=0`) unless the limiter itself is under test.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+ENDPOINTS = ("checkout", "quote", "bootstrap", "health", "inventory")
+
+
+def _percentile(sorted_xs: List[float], p: float) -> float:
+    if not sorted_xs:
+        return 0.0
+    k = max(0, min(len(sorted_xs) - 1, int(round(p / 100.0 * (len(sorted_xs) - 1)))))
+    return sorted_xs[k]
+
+
+def _checkout_body(args) -> Dict[str, Any]:
+    return {
+        "payment_token": "cnon:card-nonce-ok",
+        "cart": [{"variation_id": v, "qty": 1} for v in args.variation_id],
+        "buyer": {"name": "Bench Buyer", "email": "bench@example.com"},
+        "shipping": {"address": {"address_line_1": "1 Test St", "locality": "Boise",
+                                 "administrative_district_level_1": "ID", "postal_code": "83702",
+                                 "country": "US"}},
+        "reference_id": f"bench-{uuid.uuid4().hex[:8]}",
+    }
+
+
+def _request_fn(name: str, args) -> Callable[[requests.Session], requests.Response]:
+    base = args.base.rstrip("/")
+    if name == "checkout":
+        return lambda s: s.post(f"{base}/api/square/checkout", json=_checkout_body(args), timeout=args.timeout)
+    if name == "quote":
+        return lambda s: s.post(f"{base}/api/square/quote", json=_checkout_body(args), timeout=args.timeout)
+    if name == "bootstrap":
+        return lambda s: s.get(f"{base}/api/square/bootstrap", timeout=args.timeout)
+    if name == "health":
+        return lambda s: s.get(f"{base}/api/health", timeout=args.timeout)
+    if name == "inventory":
+        ids = ",".join(args.variation_id)
+        return lambda s: s.get(f"{base}/api/inventory", params={"ids": ids}, timeout=args.timeout)
+    raise ValueError(f"Unknown endpoint {name!r}; expected one of {', '.join(ENDPOINTS)}")
+
+
+def run_endpoint(name: str, args) -> Dict[str, Any]:
+    fn = _request_fn(name, args)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    remaining = [args.requests] if args.requests else None
+
+    def take() -> bool:
+        if remaining is None:
+            return time.perf_counter() < deadline
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker():
+        nonlocal errors
+        s = requests.Session()
+        local_lat, local_status, local_err = [], {}, 0
+        while take():
+            t0 = time.perf_counter()
+            try:
+                r = fn(s)
+                key = str(r.status_code)
+                if r.status_code >= 400:
+                    local_err += 1
+            except requests.RequestException as e:
+                key = type(e).__name__
+                local_err += 1
+            local_lat.append(time.perf_counter() - t0)
+            local_status[key] = local_status.get(key, 0) + 1
+        with lock:
+            latencies.extend(local_lat)
+            errors += local_err
+            for k, v in local_status.items():
+                statuses[k] = statuses.get(k, 0) + v
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        for f in [ex.submit(worker) for _ in range(args.concurrency)]:
+            f.result()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000.0, 2)
+    return {
+        "endpoint": name,
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": ms(_percentile(latencies, 50)),
+        "p95_ms": ms(_percentile(latencies, 95)),
+        "p99_ms": ms(_percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else 0.0,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    problems = []
+    base_by_ep = {r["endpoint"]: r for r in baseline.get("results", [])}
+    for r in results:
+        b = base_by_ep.get(r["endpoint"])
+        if not b:
+            continue
+        if b.get("p95_ms") and r["p95_ms"] > b["p95_ms"] * (1 + max_regression):
+            problems.append(f"{r['endpoint']}: p95 {r['p95_ms']}ms vs baseline {b['p95_ms']}ms")
+        if b.get("rps") and r["rps"] < b["rps"] * (1 - max_regression):
+            problems.append(f"{r['endpoint']}: {r['rps']} req/s vs baseline {b['rps']} req/s")
+    return problems
+
+
+def _print_table(results: List[Dict[str, Any]]) -> None:
+    cols = ("endpoint", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    print("  ".join(f"{c:>10}" for c in cols))
+    for r in results:
+        print("  ".join(f"{r[c]:>10}" for c in cols))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark the store API endpoints.")
+    ap.add_argument("--base", default="http://127.0.0.1:8088", help="API base URL")
+    ap.add_argument("--endpoints", default="checkout,bootstrap",
+                    help=f"comma-separated, from: {', '.join(ENDPOINTS)}")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint")
+    ap.add_argument("--requests", type=int, default=0, help="fixed request count per endpoint (overrides --duration)")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--variation-id", action="append", default=None,
+                    help="variation id to put in the checkout cart (repeatable)")
+    ap.add_argument("--catalog", default="",
+                    help="take the cart's variation id from this catalog JSON (passes local cart validation)")
+    ap.add_argument("--json", dest="json_out", default="", help="write results to this file")
+    ap.add_argument("--baseline", default="", help="compare against a previous --json/--save-baseline file")
+    ap.add_argument("--save-baseline", default="", help="write results as the new baseline")
+    ap.add_argument("--max-regression", type=float, default=0.2, help="allowed fractional regression")
+    args = ap.parse_args(argv)
+    if not args.variation_id and args.catalog:
+        with open(args.catalog, "r", encoding="utf-8") as f:
+            products = json.load(f).get("products") or []
+        args.variation_id = [v["variation_id"] for p in products for v in p.get("variants") or []
+                             if v.get("variation_id")][:1]
+    args.variation_id = args.variation_id or ["FAKE_VARIATION_ID"]
+
+    names = [n.strip() for n in args.endpoints.split(",") if n.strip()]
+    results = []
+    for name in names:
+        r = run_endpoint(name, args)
+        results.append(r)
+    _print_table(results)
+
+    doc = {"base": args.base, "concurrency": args.concurrency, "results": results}
+    for path in (args.json_out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(doc, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.max_regression)
+        if problems:
+            print("REGRESSION:", file=sys.stderr)
+            for p in problems:
+                print(f"  {p}", file=sys.stderr)
+            return 1
+        print(f"No regressions beyond {args.max_regression:.0%} vs {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
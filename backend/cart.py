@@ -0,0 +1,109 @@
+"""Local cart validation and pricing against the catalog index.
+
+Runs before any Square call: unknown or hidden variations and bad quantities are
+rejected here instead of costing a CreateOrder round trip. Quotes are estimates from the
+converted catalog (no taxes/discounts); Square still computes the charged total.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from catalog_index import CatalogSnapshot
+
+
+class CartError(ValueError):
+    def __init__(self, message: str, problems: Optional[List[Dict[str, Any]]] = None):
+        super().__init__(message)
+        self.problems = problems or []
+
+
+class CartLine(NamedTuple):
+    variation_id: str
+    qty: int
+    product_id: str = ""
+    name: str = ""
+    size: str = ""
+    unit_cents: int = 0
+
+
+def _qty(value: Any) -> int:
+    """Whole-number quantity (ints, integral floats like 2.0, digit strings); 0 if invalid."""
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def validate_cart(cart: Any, snap: Optional[CatalogSnapshot], max_qty: int = 99) -> List[CartLine]:
+    """Return normalized cart lines or raise CartError listing every bad line.
+
+    With `snap=None` (catalog unavailable) only structure and quantities are checked.
+    Repeated variation ids are merged into one line.
+    """
+    if not isinstance(cart, list) or not cart:
+        raise CartError("Cart is empty")
+
+    merged: Dict[str, int] = {}
+    problems: List[Dict[str, Any]] = []
+    for i, item in enumerate(cart):
+        if not isinstance(item, dict):
+            problems.append({"index": i, "error": "Invalid cart line"})
+            continue
+        var_id = str(item.get("variation_id") or "").strip()
+        if not var_id:
+            raise CartError("Missing variation_id in cart")
+        qty = _qty(item.get("qty", 1))
+        if qty < 1 or qty > max_qty:
+            problems.append({"index": i, "variation_id": var_id, "error": f"Quantity must be 1-{max_qty}"})
+            continue
+        if snap is not None:
+            v = snap.variation(var_id)
+            if v is None:
+                problems.append({"index": i, "variation_id": var_id, "error": "Unknown variation"})
+                continue
+            if not v.orderable:
+                problems.append({"index": i, "variation_id": var_id, "error": "Item is not available"})
+                continue
+        merged[var_id] = merged.get(var_id, 0) + qty
+
+    for var_id, qty in merged.items():
+        if qty > max_qty:
+            problems.append({"variation_id": var_id, "error": f"Quantity must be 1-{max_qty}"})
+    if problems:
+        raise CartError("Invalid cart", problems)
+
+    lines = []
+    for var_id, qty in merged.items():
+        v = snap.variation(var_id) if snap is not None else None
+        if v is None:
+            lines.append(CartLine(var_id, qty))
+        else:
+            lines.append(CartLine(var_id, qty, v.product_id, v.name, v.size, v.price_cents))
+    return lines
+
+
+def quote(lines: List[CartLine], shipping_cents: int, currency: str) -> Dict[str, Any]:
+    subtotal = sum(l.unit_cents * l.qty for l in lines)
+    shipping = max(0, int(shipping_cents))
+    return {
+        "ok": True,
+        "currency": currency,
+        "lines": [
+            {
+                "variation_id": l.variation_id,
+                "product_id": l.product_id,
+                "name": l.name,
+                "size": l.size,
+                "qty": l.qty,
+                "unit_cents": l.unit_cents,
+                "total_cents": l.unit_cents * l.qty,
+            }
+            for l in lines
+        ],
+        "subtotal_cents": subtotal,
+        "shipping_cents": shipping,
+        "total_cents": subtotal + shipping,
+        "estimate": True,
+    }
@@ -0,0 +1,272 @@
+"""In-memory, indexed view of the converted Square catalog JSON.
+
+The catalog file (`square_products_latest.json` as written by `convert_catalog.py`) is
+parsed once into an immutable `CatalogSnapshot` with lookups by product id, variation id
+and category. Every product is also pre-serialized to compact JSON bytes, so filtered
+responses are assembled by joining fragments instead of re-serializing the document.
+`CatalogIndex` re-stats the file at most every `check_interval` seconds and swaps in a
+new snapshot when its mtime/size change; a bad file keeps the previous snapshot. The
+search index (`search_index.SearchIndex`) is built per snapshot on the first search.
+`CatalogIndex.apply_patch` installs a snapshot of a file this process just patched (see
+`catalog_sync.py`), re-serializing only the changed products.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from search_index import SearchIndex
+
+try:
+    import brotli  # optional: enables `Content-Encoding: br`
+except ImportError:  # pragma: no cover - depends on deployment
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+
+def _dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+HIDDEN_VISIBILITY = frozenset({"hidden", "unavailable", "private"})
+
+
+class Variation(NamedTuple):
+    """Precomputed checkout view of one sellable variation."""
+
+    product_id: str
+    name: str
+    size: str
+    price_cents: int
+    visibility: str
+
+    @property
+    def orderable(self) -> bool:
+        return self.visibility not in HIDDEN_VISIBILITY
+
+
+def _price_cents(v: Any) -> int:
+    try:
+        return int(round(float(v or 0) * 100))
+    except (TypeError, ValueError):
+        return 0
+
+
+class EncodedBody:
+    """One response body with a strong ETag and lazily cached compressed variants."""
+
+    __slots__ = ("raw", "etag", "_gzip", "_br")
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self.etag = hashlib.sha256(raw).hexdigest()[:32]
+        self._gzip: Optional[bytes] = None
+        self._br: Optional[bytes] = None
+
+    def encoded(self, encoding: str) -> bytes:
+        if encoding == "br":
+            if self._br is None:
+                self._br = brotli.compress(self.raw, quality=5)
+            return self._br
+        if encoding == "gzip":
+            if self._gzip is None:
+                self._gzip = gzip.compress(self.raw, compresslevel=6, mtime=0)
+            return self._gzip
+        return self.raw
+
+
+class CatalogSnapshot:
+    def __init__(self, doc: Dict[str, Any], mtime_ns: int, size: int,
+                 base: Optional["CatalogSnapshot"] = None, changed: Iterable[str] = ()):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.meta = {k: v for k, v in doc.items() if k not in ("count", "products")}
+        self.products: List[Dict[str, Any]] = [p for p in (doc.get("products") or []) if isinstance(p, dict)]
+
+        self.by_id: Dict[str, int] = {}
+        self.variations: Dict[str, Variation] = {}
+        self.by_category: Dict[str, List[int]] = {}
+        self.category_of: List[str] = []
+        for i, p in enumerate(self.products):
+            pid = str(p.get("id") or "")
+            if pid:
+                self.by_id.setdefault(pid, i)
+            cat = str(p.get("category") or "").strip().lower()
+            self.category_of.append(cat)
+            self.by_category.setdefault(cat, []).append(i)
+            visibility = str(p.get("visibility") or "visible").strip().lower()
+            for v in p.get("variants") or []:
+                vid = str((v or {}).get("variation_id") or "").strip()
+                if vid and vid not in self.variations:
+                    self.variations[vid] = Variation(
+                        product_id=pid,
+                        name=str(p.get("name") or pid),
+                        size=str(v.get("size") or ""),
+                        price_cents=_price_cents(v.get("price") if v.get("price") else p.get("price")),
+                        visibility=visibility,
+                    )
+
+        # Unchanged products keep the previous snapshot's bytes (only when ids are unique there).
+        reuse = base._fragments_by_id() if base is not None else {}
+        changed = set(changed)
+        self._fragments = [
+            reuse[pid] if pid in reuse and pid not in changed else _dumps(p)
+            for p, pid in ((p, str(p.get("id") or "")) for p in self.products)
+        ]
+        self._meta_prefix = _dumps(self.meta)[:-1]  # '{...' without the closing brace
+        self._bodies: "OrderedDict[Tuple, EncodedBody]" = OrderedDict()
+        self._bodies_lock = threading.Lock()
+        self._search: Optional[SearchIndex] = None
+        self._search_lock = threading.Lock()
+
+    def _fragments_by_id(self) -> Dict[str, bytes]:
+        if len(self.by_id) != len(self.products):
+            return {}
+        return {pid: self._fragments[i] for pid, i in self.by_id.items()}
+
+    def search_index(self) -> SearchIndex:
+        if self._search is None:
+            with self._search_lock:
+                if self._search is None:
+                    self._search = SearchIndex(self.products)
+        return self._search
+
+    def search_body(self, query: str, category: str = "", offset: int = 0, limit: int = 24) -> EncodedBody:
+        """One page of ranked search hits: {q, total, offset, limit, count, products}."""
+        hits = self.search_index().search(query)
+        if category:
+            cat = category.strip().lower()
+            hits = [i for i in hits if self.category_of[i] == cat]
+        page = hits[offset:offset + limit]
+        head = _dumps({"q": query, "total": len(hits), "offset": offset, "limit": limit, "count": len(page)})
+        return EncodedBody(b"".join((head[:-1], b',"products":[', b",".join(self._fragments[i] for i in page), b"]}")))
+
+    def product(self, product_id: str) -> Optional[Dict[str, Any]]:
+        i = self.by_id.get(product_id)
+        return None if i is None else self.products[i]
+
+    def variation(self, variation_id: str) -> Optional[Variation]:
+        return self.variations.get(variation_id)
+
+    def select(self, category: str = "", ids: Iterable[str] = ()) -> List[int]:
+        ids = [i for i in ids if i]
+        if ids:
+            idx = sorted({self.by_id[i] for i in ids if i in self.by_id})
+        elif category:
+            idx = self.by_category.get(category.strip().lower(), [])
+        else:
+            idx = list(range(len(self.products)))
+        if ids and category:
+            cat = category.strip().lower()
+            idx = [i for i in idx if str(self.products[i].get("category") or "").strip().lower() == cat]
+        return idx
+
+    def body(self, category: str = "", ids: Iterable[str] = (), max_cached: int = 256) -> EncodedBody:
+        ids = tuple(sorted({i for i in ids if i}))
+        key = (category.strip().lower(), ids)
+        with self._bodies_lock:
+            hit = self._bodies.get(key)
+            if hit is not None:
+                self._bodies.move_to_end(key)
+                return hit
+        idx = self.select(category, ids)
+        sep = b"," if self.meta else b""
+        raw = b"".join((
+            self._meta_prefix, sep, b'"count":', str(len(idx)).encode(), b',"products":[',
+            b",".join(self._fragments[i] for i in idx), b"]}",
+        ))
+        eb = EncodedBody(raw)
+        with self._bodies_lock:
+            self._bodies[key] = eb
+            while len(self._bodies) > max_cached:
+                self._bodies.popitem(last=False)
+        return eb
+
+
+class CatalogIndex:
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snap: Optional[CatalogSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self, sig: Tuple[int, int]) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            if not isinstance(doc, dict):
+                raise ValueError("catalog root must be an object")
+        except (OSError, ValueError) as e:
+            log.warning("Catalog reload failed for %s: %s (keeping previous snapshot)", self.path, e)
+            return
+        self._snap = CatalogSnapshot(doc, sig[0], sig[1])
+        log.info("Loaded catalog %s (%d products)", self.path, len(self._snap.products))
+
+    def apply_patch(self, doc: Dict[str, Any], changed: Iterable[str], before: Tuple[int, int],
+                    after: Tuple[int, int]) -> None:
+        """Install `doc`, just written over the file whose signature was `before`."""
+        with self._lock:
+            cur = self._snap
+            # Reuse fragments only if our snapshot is exactly the file that was patched.
+            base = cur if cur is not None and (cur.mtime_ns, cur.size) == before else None
+            self._snap = CatalogSnapshot(doc, after[0], after[1], base=base, changed=changed)
+            self._checked_at = time.monotonic()
+        log.info("Patched catalog %s (%d products changed)", self.path, len(set(changed)))
+
+    def snapshot(self, force: bool = False) -> Optional[CatalogSnapshot]:
+        now = time.monotonic()
+        if not force and self._snap is not None and now - self._checked_at < self.check_interval:
+            return self._snap
+        with self._lock:
+            if not force and self._snap is not None and now - self._checked_at < self.check_interval:
+                return self._snap
+            self._checked_at = now
+            sig = self._stat()
+            cur = self._snap
+            if sig is not None and (force or cur is None or (cur.mtime_ns, cur.size) != sig):
+                self._load(sig)
+            return self._snap
+
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """Accept-Encoding header -> {coding: q}."""
+    offered = {}
+    for part in (accept_encoding or "").split(","):
+        bits = part.strip().split(";")
+        name = bits[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for b in bits[1:]:
+            b = b.strip()
+            if b.startswith("q="):
+                try:
+                    q = float(b[2:])
+                except ValueError:
+                    q = 0.0
+        offered[name] = q
+    return offered
+
+
+def pick_encoding(accept_encoding: str) -> str:
+    """Choose br > gzip > identity from an Accept-Encoding header (honours q=0)."""
+    offered = accepted_encodings(accept_encoding)
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return "identity"
@@ -0,0 +1,466 @@
+"""Incremental catalog refresh from Square webhooks.
+
+`verify_signature` checks Square's `x-square-hmacsha256-signature` (HMAC-SHA256 over the
+notification URL + raw body). Verified events go to `CatalogSync.submit`, which queues them
+for a daemon thread (duplicates by `event_id` are dropped):
+- `inventory.count.updated` carries the new counts; they are handed to `on_counts`.
+- `catalog.version.updated` carries no objects, so queued catalog events collapse into one
+  SearchCatalogObjects call for items/variations changed since the last sync (deleted ones
+  included). The sync point is the file's `square_synced_at`, else its `generated_at`.
+
+Changes are patched into each catalog file by variation id (`patch_products`): price, SKU
+and size per variation; name/color, description and visibility per item. Deleted
+variations are dropped, and products left without variants are removed. New items become
+products keyed by their Square item id. Categories of existing products are left alone:
+storefront categories come from the classification rules on the next full conversion.
+Each file is rewritten under an advisory lock via tmp file + `os.replace`, like
+`convert_catalog.py`, and `on_patched` lets the API swap in a snapshot that reuses the
+unchanged products. `DerivedOutputs` then re-derives what the storefront actually loads
+(`square_products_merged.json` and the hashed `catalog/` artifacts) from the patched raw
+catalog with the converter's own merge and artifact code.
+"""
+import base64
+import hashlib
+import hmac
+import importlib
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "x-square-hmacsha256-signature"
+CATALOG_EVENT = "catalog.version.updated"
+INVENTORY_EVENT = "inventory.count.updated"
+ECOM_VISIBILITY = {"VISIBLE": "visible", "UNINDEXED": "visible", "HIDDEN": "hidden", "UNAVAILABLE": "unavailable"}
+
+
+def verify_signature(key: str, notification_url: str, body: bytes, signature: str) -> bool:
+    digest = hmac.new(key.encode("utf-8"), notification_url.encode("utf-8") + body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), (signature or "").strip().encode("ascii", "replace"))
+
+
+# ---- Patching (pure: catalog products + changed Square objects -> patched products) ----
+def _strip_html(s: str) -> str:
+    # Same cheap stripper convert_catalog uses for export descriptions.
+    return re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", s or "")).strip()
+
+
+def _name_and_color(item_name: str) -> Tuple[str, str]:
+    m = re.match(r"^(.*)\(([^)]+)\)\s*$", (item_name or "").strip())
+    return (m.group(1).strip(), m.group(2).strip()) if m else ((item_name or "").strip(), "")
+
+
+def _price(data: Dict[str, Any]) -> Optional[float]:
+    money = data.get("price_money")
+    return int(money.get("amount") or 0) / 100.0 if isinstance(money, dict) else None
+
+
+class CatalogChanges(NamedTuple):
+    items: Dict[str, Dict[str, Any]]
+    variations: Dict[str, Dict[str, Any]]
+    deleted: Set[str]  # item and variation ids
+    categories: Dict[str, str]  # category id -> name
+
+    @classmethod
+    def from_objects(cls, objects: Sequence[Dict[str, Any]], related: Sequence[Dict[str, Any]] = ()) -> "CatalogChanges":
+        ch = cls({}, {}, set(), {})
+        for o in list(objects) + list(related):
+            if o.get("type") == "CATEGORY":
+                ch.categories[o["id"]] = str((o.get("category_data") or {}).get("name") or "")
+        for o in objects:
+            kind, oid = o.get("type"), o.get("id")
+            if kind not in ("ITEM", "ITEM_VARIATION") or not oid:
+                continue
+            if o.get("is_deleted"):
+                ch.deleted.add(oid)
+            elif kind == "ITEM":
+                ch.items[oid] = o
+            else:
+                ch.variations[oid] = o
+            # Items embed their variations; those are changes too.
+            for v in (o.get("item_data") or {}).get("variations") or []:
+                if v.get("id"):
+                    if o.get("is_deleted") or v.get("is_deleted"):
+                        ch.deleted.add(v["id"])
+                    else:
+                        ch.variations.setdefault(v["id"], v)
+        return ch
+
+    def __bool__(self) -> bool:
+        return bool(self.items or self.variations or self.deleted)
+
+
+def _new_product(item: Dict[str, Any], categories: Dict[str, str]) -> Dict[str, Any]:
+    data = item.get("item_data") or {}
+    name, color = _name_and_color(data.get("name") or "")
+    html = data.get("description_html") or (f"<p>{data['description']}</p>" if data.get("description") else "")
+    cat_id = ((data.get("reporting_category") or {}).get("id") or data.get("category_id")
+              or next((c.get("id") for c in data.get("categories") or []), ""))
+    return {
+        "id": item["id"],
+        "name": name or item["id"],
+        "color": color,
+        "category": categories.get(cat_id or "", ""),
+        "price": 0.0,
+        "visibility": "visible",
+        "shipping_enabled": "",
+        "description_text": _strip_html(html),
+        "description_html": html,
+        "variants": [],
+    }
+
+
+def _apply_item(p: Dict[str, Any], item: Dict[str, Any], item_vids: Set[str]) -> None:
+    data = item.get("item_data") or {}
+    if data.get("is_archived"):
+        p["visibility"] = "hidden"
+    elif data.get("ecom_visibility") in ECOM_VISIBILITY:
+        p["visibility"] = ECOM_VISIBILITY[data["ecom_visibility"]]
+    if "description_html" in data or "description" in data:
+        html = data.get("description_html") or (f"<p>{data['description']}</p>" if data.get("description") else "")
+        p["description_html"], p["description_text"] = html, _strip_html(html)
+    if data.get("name"):
+        name, color = _name_and_color(data["name"])
+        variants = p.get("variants") or []
+        # Merged products (variants tagged with color) may fold several Square items together.
+        for v in variants:
+            if "color" in v and v.get("variation_id") in item_vids:
+                v["color"] = color
+        if all(v.get("variation_id") in item_vids for v in variants):
+            p["name"] = name
+            if not any("color" in v for v in variants):
+                p["color"] = color
+        if any("color" in v for v in variants):
+            colors = {v["color"] for v in variants}
+            p["color"] = colors.pop() if len(colors) == 1 else ""
+
+
+def patch_products(products: List[Dict[str, Any]], ch: CatalogChanges) -> Tuple[List[Dict[str, Any]], Set[str]]:
+    """Apply `ch` in place where possible; returns (products, ids of changed or removed products)."""
+    where: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+    for p in products:
+        for v in p.get("variants") or []:
+            if v.get("variation_id"):
+                where.setdefault(v["variation_id"], (p, v))
+    # id(product) -> (product, canonical JSON before patching)
+    touched: Dict[int, Tuple[Dict[str, Any], str]] = {}
+
+    def touch(p: Dict[str, Any]) -> None:
+        if id(p) not in touched:
+            touched[id(p)] = (p, json.dumps(p, sort_keys=True))
+
+    for vid in ch.deleted:
+        hit = where.pop(vid, None)
+        if hit is not None:
+            touch(hit[0])
+            hit[0]["variants"] = [v for v in hit[0]["variants"] if v is not hit[1]]
+
+    item_vids: Dict[str, Set[str]] = {}
+    for vid, o in ch.variations.items():
+        item_id = (o.get("item_variation_data") or {}).get("item_id") or ""
+        item_vids.setdefault(item_id, set()).add(vid)
+    for item_id, item in ch.items.items():
+        item_vids.setdefault(item_id, set()).update(
+            v["id"] for v in (item.get("item_data") or {}).get("variations") or [] if v.get("id"))
+
+    added: List[Dict[str, Any]] = []
+    for vid, o in ch.variations.items():
+        if vid in ch.deleted:
+            continue
+        data = o.get("item_variation_data") or {}
+        hit = where.get(vid)
+        if hit is None:
+            item_id = data.get("item_id") or ""
+            sibling = next((where[s] for s in item_vids.get(item_id, ()) if s in where), None)
+            if sibling is not None:
+                p = sibling[0]
+                touch(p)
+            elif item_id in ch.items:
+                p = _new_product(ch.items[item_id], ch.categories)
+                added.append(p)
+            else:
+                log.info("Catalog sync: variation %s of unknown item %s skipped", vid, item_id)
+                continue
+            v: Dict[str, Any] = {"size": "", "sku": "", "price": 0.0, "variation_id": vid}
+            if any("color" in x for x in p["variants"]):
+                v = {"color": p.get("color", ""), **v}
+            p["variants"].append(v)
+            hit = where[vid] = (p, v)
+        p, v = hit
+        touch(p)
+        v["size"] = str(data.get("name") or v.get("size") or "One Size")
+        v["sku"] = str(data.get("sku") or "")
+        price = _price(data)
+        if price is not None:
+            v["price"] = price
+
+    for item_id, item in ch.items.items():
+        vids = item_vids.get(item_id, set())
+        for p in {id(where[vid][0]): where[vid][0] for vid in vids if vid in where}.values():
+            touch(p)
+            _apply_item(p, item, vids)
+
+    changed = {str(p.get("id") or "") for p in added}
+    for p, before in touched.values():
+        # Same rule as the converter: the first non-zero variant price.
+        p["price"] = next((float(v["price"]) for v in p["variants"] if v.get("price")), p.get("price", 0.0))
+        if not p["variants"] or json.dumps(p, sort_keys=True) != before:
+            changed.add(str(p.get("id") or ""))
+    products = [p for p in products if p.get("variants") or id(p) not in touched] + added
+    if added:
+        products.sort(key=lambda p: p.get("id", ""))
+    return products, changed
+
+
+def catalog_hash(products: Sequence[Dict[str, Any]]) -> str:
+    # Same as convert_catalog.catalog_hash(product_hash(p) ...), so the next conversion agrees.
+    hashes = sorted(
+        (str(p.get("id", "")),
+         hashlib.sha256(json.dumps(p, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+                        .encode("utf-8")).hexdigest()[:16])
+        for p in products
+    )
+    return hashlib.sha256("\n".join(f"{pid}:{h}" for pid, h in hashes).encode("utf-8")).hexdigest()[:16]
+
+
+# ---- Files ----
+def _write_atomic(path: str, text: str) -> None:
+    # Write atomically to prevent corrupting outputs on a partial write.
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def _sig(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    # Serializes read-modify-write of one catalog file across gunicorn workers.
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+class DerivedOutputs:
+    """Rebuilds the merged catalog and `catalog/` artifacts from a patched raw catalog.
+
+    Needs `convert_catalog.py` (looked up in `converter_dirs`, normally the repo root next
+    to the catalog); without it the derived files are left as they are, with a warning.
+    """
+
+    def __init__(self, merged_path: str, artifacts_dir: str, converter_dirs: Sequence[str]):
+        self.merged_path = merged_path
+        self.artifacts_dir = artifacts_dir
+        self.converter_dirs = tuple(converter_dirs)
+        self._converter: Any = None
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.merged_path or self.artifacts_dir)
+
+    def converter(self) -> Any:
+        if self._converter is None:
+            for d in self.converter_dirs:
+                if os.path.isfile(os.path.join(d, "convert_catalog.py")):
+                    if d not in sys.path:
+                        sys.path.append(d)  # also resolves its `scripts.normalize_categories` import
+                    self._converter = importlib.import_module("convert_catalog")
+                    break
+        return self._converter
+
+    def rebuild(self, doc: Dict[str, Any]) -> bool:
+        if not self:
+            return False
+        converter = self.converter()
+        if converter is None:
+            log.warning("Catalog sync: convert_catalog.py not found in %s; %s not rebuilt",
+                        ", ".join(self.converter_dirs), self.merged_path or self.artifacts_dir)
+            return False
+        lock_path = self.merged_path or os.path.join(self.artifacts_dir, "manifest.json")
+        with self._lock, _file_lock(lock_path):
+            merged = converter.rebuild_derived(doc, self.merged_path, self.artifacts_dir)
+        log.info("Catalog sync: rebuilt %s (%d merged products)",
+                 " and ".join(p for p in (self.merged_path, self.artifacts_dir) if p), len(merged))
+        return True
+
+
+# ---- Event queue ----
+class CatalogSync:
+    """Applies queued webhook events off the request path (one daemon thread per process).
+
+    `client_for()` returns a Square client (see square_client.SquareClient); `paths()` the
+    catalog files to patch. `on_counts(counts)` receives Square InventoryCount dicts;
+    `on_patched(path, doc, changed_ids, sig_before, sig_after)` runs after each file write,
+    and `on_synced(changed_ids)` once per sync with the products changed in any file.
+    """
+
+    def __init__(self, client_for: Callable[[], Any], paths: Callable[[], Sequence[str]],
+                 on_counts: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                 on_patched: Optional[Callable[..., None]] = None,
+                 on_synced: Optional[Callable[[Set[str]], None]] = None,
+                 max_queue: int = 1000, max_seen: int = 10_000, retry_interval: float = 30.0):
+        self.client_for = client_for
+        self.paths = paths
+        self.on_counts = on_counts or (lambda counts: None)
+        self.on_patched = on_patched or (lambda *a: None)
+        self.on_synced = on_synced or (lambda changed: None)
+        self.max_seen = max_seen
+        self.retry_interval = retry_interval
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._seen_lock = threading.Lock()
+        self._synced_at: Dict[str, str] = {}
+        self._retry = False
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, event: Dict[str, Any]) -> str:
+        """Queue one verified event. Returns queued, duplicate, ignored or full."""
+        if event.get("type") not in (CATALOG_EVENT, INVENTORY_EVENT):
+            return "ignored"
+        event_id = str(event.get("event_id") or "")
+        with self._seen_lock:
+            if event_id and event_id in self._seen:
+                return "duplicate"
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                return "full"
+            if event_id:
+                self._seen[event_id] = None
+                while len(self._seen) > self.max_seen:
+                    self._seen.popitem(last=False)
+        return "queued"
+
+    def _drain(self, first: Dict[str, Any]) -> List[Dict[str, Any]]:
+        events = [first]
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def process(self, events: Sequence[Dict[str, Any]]) -> None:
+        counts = [c for e in events if e.get("type") == INVENTORY_EVENT
+                  for c in (((e.get("data") or {}).get("object") or {}).get("inventory_counts") or [])]
+        if counts:
+            self.on_counts(counts)
+        if any(e.get("type") == CATALOG_EVENT for e in events):
+            self.sync_catalog()
+
+    def _search(self, begin_time: str) -> Tuple[CatalogChanges, str]:
+        client = self.client_for()
+        body: Dict[str, Any] = {"object_types": ["ITEM", "ITEM_VARIATION"], "include_deleted_objects": True,
+                                "include_related_objects": True}
+        if begin_time:
+            body["begin_time"] = begin_time
+        objects: List[Dict[str, Any]] = []
+        related: List[Dict[str, Any]] = []
+        latest = begin_time
+        while True:
+            r = client.post("/v2/catalog/search", json=body, replayable=True)
+            if r.status_code >= 300:
+                raise RuntimeError(f"SearchCatalogObjects failed: HTTP {r.status_code}")
+            page = r.json()
+            objects += page.get("objects") or []
+            related += page.get("related_objects") or []
+            latest = max([latest, page.get("latest_time") or ""] + [o.get("updated_at") or "" for o in page.get("objects") or []])
+            if not page.get("cursor"):
+                return CatalogChanges.from_objects(objects, related), latest
+            body["cursor"] = page["cursor"]
+
+    def sync_catalog(self) -> Dict[str, int]:
+        """Fetch changes since the oldest file's sync point and patch every file."""
+        docs = {}
+        for path in self.paths():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    doc = json.load(f)
+            except (OSError, ValueError) as e:
+                log.warning("Catalog sync: cannot read %s: %s", path, e)
+                continue
+            docs[path] = max(self._synced_at.get(path, ""), str(doc.get("square_synced_at") or doc.get("generated_at") or ""))
+        if not docs:
+            return {}
+        # Patches only set values, so files already past the oldest sync point are unaffected.
+        changes, latest = self._search(min(docs.values()))
+        patched = {}
+        changed: Set[str] = set()
+        for path in docs:
+            ids = self._patch_file(path, changes, latest) if changes else set()
+            patched[path] = len(ids)
+            changed |= ids
+            self._synced_at[path] = latest
+        if changed:
+            self.on_synced(changed)
+        return patched
+
+    def _patch_file(self, path: str, changes: CatalogChanges, synced_at: str) -> Set[str]:
+        with _file_lock(path):
+            before = _sig(path)
+            with open(path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            products, changed = patch_products([p for p in doc.get("products") or [] if isinstance(p, dict)], changes)
+            if not changed:
+                return set()
+            doc["products"] = products
+            for key in ("count", "count_merged"):
+                if key in doc:
+                    doc[key] = len(products)
+            if "content_hash" in doc:
+                doc["content_hash"] = catalog_hash(products)
+            doc["square_synced_at"] = synced_at
+            _write_atomic(path, json.dumps(doc, indent=2, ensure_ascii=False) + "\n")
+            after = _sig(path)
+        log.info("Catalog sync: patched %d products in %s", len(changed), path)
+        self.on_patched(path, doc, changed, before, after)
+        return changed
+
+    def _loop(self) -> None:
+        # A failed catalog sync is retried every `retry_interval` seconds; the sync point only
+        # advances after a successful search, so no change is skipped meanwhile.
+        while True:
+            try:
+                events = self._drain(self._queue.get(timeout=self.retry_interval if self._retry else None))
+            except queue.Empty:
+                events = [{"type": CATALOG_EVENT}]
+            try:
+                self.process(events)
+                self._retry = False
+            except Exception:
+                self._retry = self._retry or any(e.get("type") == CATALOG_EVENT for e in events)
+                log.exception("Catalog sync failed for %d webhook events", len(events))
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="catalog-sync", daemon=True)
+            self._thread.start()
@@ -0,0 +1,385 @@
+"""Immutable, validated runtime configuration for the store API.
+
+Environment variables are parsed once into a frozen `Settings` (at import of `app`, and
+again on explicit reload). Anything invalid raises `ConfigError` listing every problem, so
+a misconfigured worker fails at boot instead of on the first checkout. Settings also carry
+precomputed response bodies (health, bootstrap per env) and CORS header sets per origin,
+which keeps the probe endpoints and the CORS hook free of per-request parsing.
+
+Reload: `SIGHUP` to the gunicorn master restarts workers with fresh settings; `SIGHUP` to
+a worker (or the dev server) re-reads `.env` and swaps settings in place via `reload()`.
+"""
+import hashlib
+import json
+import logging
+import os
+import signal
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from dotenv import load_dotenv
+
+log = logging.getLogger(__name__)
+
+SQUARE_ENVS = ("production", "sandbox")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class SquareCreds:
+    env: str
+    base: str
+    access_token: str
+    application_id: str
+    location_id: str
+
+    def missing(self) -> List[str]:
+        return [k for k in ("access_token", "application_id", "location_id") if not getattr(self, k)]
+
+    def as_dict(self) -> Dict[str, str]:
+        return {"env": self.env, "base": self.base, "access_token": self.access_token,
+                "application_id": self.application_id, "location_id": self.location_id}
+
+
+@dataclass(frozen=True)
+class Precomputed:
+    """Response bytes + strong ETag, built once per Settings."""
+
+    body: bytes
+    etag: str
+
+    @classmethod
+    def of(cls, obj) -> "Precomputed":
+        body = (json.dumps(obj, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+        return cls(body, hashlib.sha256(body).hexdigest()[:32])
+
+
+@dataclass(frozen=True)
+class Settings:
+    square_env: str
+    allow_env_override: bool
+    square_version: str
+    creds: Mapping[str, SquareCreds]
+
+    currency: str
+    flat_shipping_cents: int
+
+    allowed_origins: frozenset
+    cors_headers: Mapping[str, Tuple[Tuple[str, str], ...]]
+
+    square_connect_timeout: float
+    square_read_timeout: float
+    square_max_retries: int
+    square_retry_backoff: float
+    square_pool_maxsize: int
+
+    catalog_path: str
+    catalog_check_interval: float
+    catalog_cache_control: str
+
+    checkout_validate_catalog: bool
+    checkout_max_qty: int
+    idempotency_max: int
+    idempotency_ttl: float
+    idempotency_db: str
+
+    journal_db: str
+    reconcile_grace: float
+    reconcile_interval: float
+    reconcile_max_attempts: int
+    journal_retention_days: float
+
+    checkout_rate_per_min: float
+    checkout_rate_burst: int
+    checkout_client_header: str
+    checkout_max_concurrent: int
+    checkout_queue_timeout: float
+
+    inventory_ttl: float
+    inventory_stale_if_error: float
+    inventory_batch_size: int
+    inventory_max_ids: int
+
+    webhook_signature_key: str
+    webhook_url: str
+    catalog_sync_paths: Tuple[str, ...]
+    catalog_merged_path: str
+    catalog_artifacts_dir: str
+
+    static_root: str
+    static_patterns: Tuple[str, ...]
+    static_cache_control: str
+
+    metrics_token: str
+    bootstrap_cache_control: str
+
+    health: Mapping[bool, Precomputed] = field(default_factory=dict)
+    bootstrap: Mapping[str, Precomputed] = field(default_factory=dict)
+
+    def square_headers(self, env: str) -> Dict[str, str]:
+        c = self.creds[env]
+        return {
+            "Authorization": f"Bearer {c.access_token}",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            # Pin a Square-Version. Update intentionally.
+            "Square-Version": self.square_version,
+        }
+
+
+class _Reader:
+    """Collects parse errors so one ConfigError can report all of them."""
+
+    def __init__(self, environ: Mapping[str, str]):
+        self.environ = environ
+        self.errors: List[str] = []
+
+    def str(self, name: str, default: str = "") -> str:
+        return (self.environ.get(name, "") or "").strip() or default
+
+    def bool(self, name: str, default: bool) -> bool:
+        raw = self.str(name)
+        if not raw:
+            return default
+        if raw in ("1", "true", "yes", "on"):
+            return True
+        if raw in ("0", "false", "no", "off"):
+            return False
+        self.errors.append(f"{name}={raw!r} is not a boolean (use 1 or 0)")
+        return default
+
+    def num(self, name: str, default, cast=int, minimum=None):
+        raw = self.str(name)
+        if not raw:
+            return default
+        try:
+            v = cast(raw)
+        except ValueError:
+            self.errors.append(f"{name}={raw!r} is not a valid {cast.__name__}")
+            return default
+        if minimum is not None and v < minimum:
+            self.errors.append(f"{name}={raw!r} must be >= {minimum}")
+            return default
+        return v
+
+
+def _default_catalog_path() -> str:
+    # Backend deploys usually sit next to the catalog (container) or one level below it (repo).
+    candidates = [
+        os.path.join(BASE_DIR, "square_products_latest.json"),
+        os.path.join(os.path.dirname(BASE_DIR), "square_products_latest.json"),
+    ]
+    return next((c for c in candidates if os.path.exists(c)), candidates[0])
+
+
+def _journal_path(raw: str) -> str:
+    # The journal is on by default (it is what recovers orphaned orders); "off" disables it.
+    if raw.lower() in ("off", "0", "none"):
+        return ""
+    return raw or os.path.join(BASE_DIR, "data", "checkout_journal.db")
+
+
+DEFAULT_STATIC_PATTERNS = "img/*,catalog/*,square_products_*.json"
+
+
+def _static_root(raw: str, catalog_path: str) -> str:
+    # Storefront files usually sit next to the catalog JSON; "off" disables /static.
+    if raw.lower() in ("off", "0", "none"):
+        return ""
+    return raw or os.path.dirname(os.path.abspath(catalog_path))
+
+
+def _derived_path(raw: str, default: str, marker: str = "") -> str:
+    # Derived storefront files are rebuilt where the converter put them: by default only if
+    # they exist next to the catalog. "off" disables.
+    if raw.lower() in ("off", "0", "none"):
+        return ""
+    if raw:
+        return raw
+    return default if os.path.exists(os.path.join(default, marker) if marker else default) else ""
+
+
+def load(environ: Optional[Mapping[str, str]] = None) -> Settings:
+    r = _Reader(os.environ if environ is None else environ)
+
+    square_env = r.str("SQUARE_ENV").lower()
+    # Fail-closed: require an explicit, valid configured env to avoid accidentally
+    # hitting production because of a missing/misspelled variable.
+    if not square_env:
+        r.errors.append("SQUARE_ENV is missing; set SQUARE_ENV=sandbox or SQUARE_ENV=production")
+    elif square_env not in SQUARE_ENVS:
+        r.errors.append(f"Invalid SQUARE_ENV={square_env!r}; expected 'sandbox' or 'production'")
+    allow_override = r.bool("SQUARE_ALLOW_ENV_OVERRIDE", False)
+
+    creds = {
+        "sandbox": SquareCreds(
+            env="sandbox",
+            base=r.str("SQUARE_API_BASE_SANDBOX", "https://connect.squareupsandbox.com").rstrip("/"),
+            access_token=r.str("SQUARE_ACCESS_TOKEN_SANDBOX"),
+            application_id=r.str("SQUARE_APP_ID_SANDBOX"),
+            location_id=r.str("SQUARE_LOCATION_ID_SANDBOX"),
+        ),
+        "production": SquareCreds(
+            env="production",
+            base=r.str("SQUARE_API_BASE", "https://connect.squareup.com").rstrip("/"),
+            access_token=r.str("SQUARE_ACCESS_TOKEN"),
+            application_id=r.str("SQUARE_APP_ID"),
+            location_id=r.str("SQUARE_LOCATION_ID"),
+        ),
+    }
+    if square_env in creds and creds[square_env].missing():
+        r.errors.append(f"Missing Square creds for env={square_env}: {', '.join(creds[square_env].missing())}")
+
+    # Preferred: comma-separated ALLOWED_ORIGINS; ALLOWED_ORIGIN is the older single-origin form.
+    raw_origins = r.str("ALLOWED_ORIGINS") or r.str("ALLOWED_ORIGIN")
+    origins = frozenset(o.strip() for o in raw_origins.split(",") if o.strip())
+    cors = {
+        o: (
+            ("Access-Control-Allow-Origin", o),
+            ("Access-Control-Allow-Headers", "Content-Type, Idempotency-Key"),
+            ("Access-Control-Allow-Methods", "GET,POST,OPTIONS"),
+            ("Access-Control-Expose-Headers", "Retry-After, Idempotent-Replayed"),
+        )
+        for o in origins
+    }
+
+    catalog_path = r.str("CATALOG_PATH") or _default_catalog_path()
+    catalog_dir = os.path.dirname(os.path.abspath(catalog_path))
+    s = dict(
+        square_env=square_env,
+        allow_env_override=allow_override,
+        square_version=r.str("SQUARE_VERSION", "2025-01-16"),
+        creds=MappingProxyType(creds),
+        currency=r.str("CHECKOUT_CURRENCY", "USD").upper(),
+        flat_shipping_cents=r.num("SQUARE_FLAT_SHIPPING_CENTS", 0, int, minimum=0),
+        allowed_origins=origins,
+        cors_headers=MappingProxyType(cors),
+        square_connect_timeout=r.num("SQUARE_CONNECT_TIMEOUT", 5.0, float, minimum=0.1),
+        square_read_timeout=r.num("SQUARE_READ_TIMEOUT", 30.0, float, minimum=0.1),
+        square_max_retries=r.num("SQUARE_MAX_RETRIES", 2, int, minimum=0),
+        square_retry_backoff=r.num("SQUARE_RETRY_BACKOFF", 0.25, float, minimum=0),
+        square_pool_maxsize=r.num("SQUARE_POOL_MAXSIZE", 20, int, minimum=1),
+        catalog_path=catalog_path,
+        catalog_check_interval=r.num("CATALOG_CHECK_INTERVAL", 1.0, float, minimum=0),
+        catalog_cache_control=r.str("CATALOG_CACHE_CONTROL", "public, no-cache"),
+        checkout_validate_catalog=r.bool("CHECKOUT_VALIDATE_CATALOG", True),
+        checkout_max_qty=r.num("CHECKOUT_MAX_QTY", 99, int, minimum=1),
+        idempotency_max=r.num("CHECKOUT_IDEMPOTENCY_MAX", 10000, int, minimum=1),
+        idempotency_ttl=r.num("CHECKOUT_IDEMPOTENCY_TTL", 86400.0, float, minimum=1),
+        idempotency_db=r.str("CHECKOUT_IDEMPOTENCY_DB"),
+        journal_db=_journal_path(r.str("CHECKOUT_JOURNAL_DB")),
+        reconcile_grace=r.num("RECONCILE_GRACE", 120.0, float, minimum=0),
+        reconcile_interval=r.num("RECONCILE_INTERVAL", 30.0, float, minimum=1),
+        reconcile_max_attempts=r.num("RECONCILE_MAX_ATTEMPTS", 5, int, minimum=1),
+        journal_retention_days=r.num("CHECKOUT_JOURNAL_RETENTION_DAYS", 30.0, float, minimum=0),
+        checkout_rate_per_min=r.num("CHECKOUT_RATE_PER_MIN", 10.0, float, minimum=0),
+        checkout_rate_burst=r.num("CHECKOUT_RATE_BURST", 5, int, minimum=1),
+        checkout_client_header=r.str("CHECKOUT_CLIENT_IP_HEADER"),
+        checkout_max_concurrent=r.num("CHECKOUT_MAX_CONCURRENT", 20, int, minimum=0),
+        checkout_queue_timeout=r.num("CHECKOUT_QUEUE_TIMEOUT", 2.0, float, minimum=0),
+        inventory_ttl=r.num("INVENTORY_TTL", 30.0, float, minimum=0),
+        inventory_stale_if_error=r.num("INVENTORY_STALE_IF_ERROR", 300.0, float, minimum=0),
+        inventory_batch_size=r.num("INVENTORY_BATCH_SIZE", 100, int, minimum=1),
+        inventory_max_ids=r.num("INVENTORY_MAX_IDS", 100, int, minimum=1),
+        webhook_signature_key=r.str("SQUARE_WEBHOOK_SIGNATURE_KEY"),
+        webhook_url=r.str("SQUARE_WEBHOOK_URL"),
+        catalog_sync_paths=tuple(p.strip() for p in r.str("CATALOG_SYNC_EXTRA_PATHS").split(",") if p.strip()),
+        catalog_merged_path=_derived_path(
+            r.str("CATALOG_MERGED_PATH"), os.path.join(catalog_dir, "square_products_merged.json")),
+        catalog_artifacts_dir=_derived_path(r.str("CATALOG_ARTIFACTS_DIR"), os.path.join(catalog_dir, "catalog"),
+                                            marker="manifest.json"),
+        static_root=_static_root(r.str("STATIC_ROOT"), catalog_path),
+        static_patterns=tuple(p.strip() for p in r.str("STATIC_PATTERNS", DEFAULT_STATIC_PATTERNS).split(",")
+                              if p.strip()),
+        static_cache_control=r.str("STATIC_CACHE_CONTROL", "public, no-cache"),
+        metrics_token=r.str("METRICS_TOKEN"),
+        bootstrap_cache_control=r.str("BOOTSTRAP_CACHE_CONTROL", "public, max-age=300"),
+    )
+    if r.errors:
+        raise ConfigError("Invalid configuration: " + "; ".join(r.errors))
+
+    # Keep health safe for public probes: no secrets, just runtime signals.
+    s["health"] = MappingProxyType({
+        debug: Precomputed.of({
+            "ok": True,
+            "debug": debug,
+            "squareEnv": square_env,
+            "allowSquareEnvOverride": allow_override,
+        })
+        for debug in (False, True)
+    })
+    s["bootstrap"] = MappingProxyType({
+        env: Precomputed.of({
+            "env": env,
+            "applicationId": c.application_id,
+            "locationId": c.location_id,
+            "currency": s["currency"],
+            "flatShippingCents": s["flat_shipping_cents"],
+        })
+        for env, c in creds.items() if not c.missing()
+    })
+    return Settings(**s)
+
+
+_current: Optional[Settings] = None
+_lock = threading.Lock()
+_listeners: List[Callable[[Settings, Settings], None]] = []
+
+
+def get() -> Settings:
+    s = _current
+    if s is None:
+        with _lock:
+            if _current is None:
+                _set(load())
+            s = _current
+    return s
+
+
+def _set(s: Settings) -> None:
+    global _current
+    _current = s
+
+
+def on_reload(fn: Callable[[Settings, Settings], None]) -> None:
+    """Register `fn(old, new)` to run after a successful reload."""
+    _listeners.append(fn)
+
+
+def reload() -> Settings:
+    """Re-read `.env` + environment; keep the old settings if the new ones are invalid."""
+    load_dotenv(override=True)
+    with _lock:
+        old = _current
+        try:
+            new = load()
+        except ConfigError as e:
+            log.error("Config reload rejected, keeping previous settings: %s", e)
+            return old if old is not None else get()
+        _set(new)
+    for fn in _listeners:
+        try:
+            fn(old, new)
+        except Exception:
+            log.exception("Config reload listener failed")
+    log.info("Config reloaded (SQUARE_ENV=%s)", new.square_env)
+    return new
+
+
+def install_sighup_reload() -> bool:
+    """Reload on SIGHUP in this process. Returns False where signals can't be installed."""
+    if not hasattr(signal, "SIGHUP"):
+        return False
+    try:
+        # Reload off the signal frame so we never block on a lock the interrupted code holds.
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=reload, daemon=True).start())
+    except ValueError:
+        # Not the main thread (e.g. imported under a threaded test runner).
+        return False
+    return True
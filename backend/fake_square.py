@@ -0,0 +1,414 @@
+"""Local stand-in for the Square endpoints the store API calls.
+
+Point the API at it through the normal creds base URL, e.g.:
+
+    python fake_square.py --port 8099 --latency-ms 120 --error-rate 0.01
+    SQUARE_API_BASE_SANDBOX=http://127.0.0.1:8099 SQUARE_ENV=sandbox gunicorn -c gunicorn.conf.py app:app
+
+For high concurrency run it under gevent instead of the dev server:
+
+    FAKE_SQUARE_LATENCY_MS=120 gunicorn -k gevent -w 1 -b 127.0.0.1:8099 fake_square:app
+
+Responses mimic the shape of Square's CreateOrder/CreatePayment/UpdateOrder and
+BatchRetrieveInventoryCounts bodies; ListPayments filters by `location_id`, `total` and
+`begin_time` (one page). Inventory is deterministic per variation id (0-24 in
+stock; ids starting with `UNTRACKED` have no counts, like items without stock tracking) and
+`PUT /_fake/inventory/<id>` sets a count. `GET /_fake/stats` returns calls per endpoint.
+
+SearchCatalogObjects serves whatever `PUT /_fake/catalog/<id>` stored (a CatalogObject body;
+`DELETE` marks it deleted). With `--webhook-url` and `--webhook-key`, catalog and inventory
+changes are followed by a signed `catalog.version.updated` / `inventory.count.updated`
+webhook to the API, like Square's notifications.
+Idempotency keys are honoured like Square does: replaying a key returns the original
+response. The sandbox test nonce `cnon:card-nonce-declined` is rejected with 402.
+Never use this outside local testing; it accepts any bearer token.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+
+CONFIG: Dict[str, float] = {
+    "latency_ms": float(os.getenv("FAKE_SQUARE_LATENCY_MS", "0") or 0),
+    "jitter_ms": float(os.getenv("FAKE_SQUARE_JITTER_MS", "0") or 0),
+    "error_rate": float(os.getenv("FAKE_SQUARE_ERROR_RATE", "0") or 0),
+    "unit_price_cents": int(os.getenv("FAKE_SQUARE_UNIT_PRICE_CENTS", "4600") or 4600),
+}
+WEBHOOK = {
+    "url": os.getenv("FAKE_SQUARE_WEBHOOK_URL", ""),
+    "key": os.getenv("FAKE_SQUARE_WEBHOOK_KEY", ""),
+}
+INVENTORY_PAGE_SIZE = 100
+
+_IDEMPOTENCY_MAX = 50_000
+_idem: "OrderedDict[Tuple[str, str], Tuple[Any, int]]" = OrderedDict()
+_orders: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_payments: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_inventory: Dict[str, int] = {}
+_catalog: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_calls: Counter = Counter()
+_lock = threading.Lock()
+
+
+@app.before_request
+def _count_call():
+    with _lock:
+        _calls[f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"] += 1
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _square_id() -> str:
+    return uuid.uuid4().hex[:24].upper()
+
+
+def _remember(store: "OrderedDict", key, value) -> None:
+    store[key] = value
+    store.move_to_end(key)
+    while len(store) > _IDEMPOTENCY_MAX:
+        store.popitem(last=False)
+
+
+def _simulate_upstream() -> Optional[Any]:
+    """Sleep for the configured latency and maybe return an injected error response."""
+    delay = CONFIG["latency_ms"] + random.uniform(-1, 1) * CONFIG["jitter_ms"]
+    if delay > 0:
+        time.sleep(delay / 1000.0)
+    if CONFIG["error_rate"] > 0 and random.random() < CONFIG["error_rate"]:
+        body = {"errors": [{"category": "API_ERROR", "code": "INTERNAL_SERVER_ERROR",
+                            "detail": "Injected by fake_square"}]}
+        return jsonify(body), 500
+    return None
+
+
+def _idempotent(kind: str, body: Dict[str, Any], build):
+    key = (kind, str(body.get("idempotency_key") or ""))
+    if key[1]:
+        with _lock:
+            hit = _idem.get(key)
+        if hit is not None:
+            return jsonify(hit[0]), hit[1]
+    out, status = build()
+    if key[1] and status < 300:
+        with _lock:
+            _remember(_idem, key, (out, status))
+    return jsonify(out), status
+
+
+def _money(amount: int, currency: str) -> Dict[str, Any]:
+    return {"amount": int(amount), "currency": currency}
+
+
+@app.post("/v2/orders")
+def create_order():
+    err = _simulate_upstream()
+    if err is not None:
+        return err
+    body = request.get_json(force=True, silent=True) or {}
+
+    def build():
+        o = body.get("order") or {}
+        if not o.get("location_id"):
+            return {"errors": [{"category": "INVALID_REQUEST_ERROR", "code": "MISSING_REQUIRED_PARAMETER",
+                                "field": "order.location_id"}]}, 400
+        currency = "USD"
+        line_items, subtotal = [], 0
+        for li in o.get("line_items") or []:
+            qty = int(li.get("quantity") or 1)
+            base = CONFIG["unit_price_cents"]
+            subtotal += base * qty
+            line_items.append({
+                "uid": _square_id()[:22],
+                "catalog_object_id": li.get("catalog_object_id"),
+                "quantity": str(qty),
+                "name": "Fake item",
+                "base_price_money": _money(base, currency),
+                "gross_sales_money": _money(base * qty, currency),
+                "total_money": _money(base * qty, currency),
+            })
+        charges = sum(int((sc.get("amount_money") or {}).get("amount") or 0) for sc in o.get("service_charges") or [])
+        ts = _now()
+        order = {
+            "id": _square_id(),
+            "location_id": o["location_id"],
+            "reference_id": o.get("reference_id"),
+            "line_items": line_items,
+            "fulfillments": o.get("fulfillments") or [],
+            "service_charges": o.get("service_charges") or [],
+            "created_at": ts,
+            "updated_at": ts,
+            "state": "OPEN",
+            "version": 1,
+            "total_money": _money(subtotal + charges, currency),
+            "total_tax_money": _money(0, currency),
+            "total_discount_money": _money(0, currency),
+            "total_service_charge_money": _money(charges, currency),
+            "net_amount_due_money": _money(subtotal + charges, currency),
+        }
+        with _lock:
+            _remember(_orders, order["id"], order)
+        return {"order": order}, 200
+
+    return _idempotent("orders", body, build)
+
+
+@app.get("/v2/orders/<order_id>")
+def retrieve_order(order_id: str):
+    err = _simulate_upstream()
+    if err is not None:
+        return err
+    with _lock:
+        order = _orders.get(order_id)
+    if order is None:
+        return jsonify({"errors": [{"category": "INVALID_REQUEST_ERROR", "code": "NOT_FOUND"}]}), 404
+    return jsonify({"order": order})
+
+
+@app.put("/v2/orders/<order_id>")
+def update_order(order_id: str):
+    err = _simulate_upstream()
+    if err is not None:
+        return err
+    body = request.get_json(force=True, silent=True) or {}
+
+    def build():
+        patch = body.get("order") or {}
+        with _lock:
+            order = _orders.get(order_id)
+            if order is None:
+                return {"errors": [{"category": "INVALID_REQUEST_ERROR", "code": "NOT_FOUND"}]}, 404
+            if patch.get("version") != order.get("version"):
+                return {"errors": [{"category": "INVALID_REQUEST_ERROR", "code": "VERSION_MISMATCH"}]}, 400
+            if patch.get("state"):
+                order["state"] = patch["state"]
+            order["version"] = int(order.get("version") or 1) + 1
+            order["updated_at"] = _now()
+            return {"order": dict(order)}, 200
+
+    return _idempotent("orders", body, build)
+
+
+@app.post("/v2/payments")
+def create_payment():
+    err = _simulate_upstream()
+    if err is not None:
+        return err
+    body = request.get_json(force=True, silent=True) or {}
+
+    def build():
+        amount = body.get("amount_money") or {}
+        if not body.get("source_id") or int(amount.get("amount") or 0) <= 0:
+            return {"errors": [{"category": "INVALID_REQUEST_ERROR", "code": "BAD_REQUEST"}]}, 400
+        if body["source_id"] == "cnon:card-nonce-declined":
+            return {"errors": [{"category": "PAYMENT_METHOD_ERROR", "code": "GENERIC_DECLINE"}]}, 402
+        ts = _now()
+        order_id = body.get("order_id")
+        payment_id = _square_id()
+        with _lock:
+            order = _orders.get(order_id or "")
+            if order is not None:
+                order["state"] = "COMPLETED"
+                order["version"] = int(order.get("version") or 1) + 1
+                order["tenders"] = [{"id": _square_id(), "type": "CARD", "payment_id": payment_id,
+                                     "amount_money": amount}]
+                order["net_amount_due_money"] = _money(0, amount.get("currency") or "USD")
+        payment = {
+            "id": payment_id,
+            "created_at": ts,
+            "updated_at": ts,
+            "amount_money": amount,
+            "total_money": amount,
+            "status": "COMPLETED",
+            "source_type": "CARD",
+            "card_details": {"status": "CAPTURED", "card": {"card_brand": "VISA", "last_4": "1111"}},
+            "location_id": body.get("location_id"),
+            "order_id": order_id,
+            "buyer_email_address": body.get("buyer_email_address"),
+            "receipt_number": _square_id()[:4],
+            "receipt_url": "https://squareupsandbox.com/receipt/preview/fake",
+        }
+        with _lock:
+            _remember(_payments, payment_id, payment)
+        return {"payment": payment}, 200
+
+    return _idempotent("payments", body, build)
+
+
+@app.get("/v2/payments")
+def list_payments():
+    err = _simulate_upstream()
+    if err is not None:
+        return err
+    args = request.args
+    with _lock:
+        payments = [
+            p for p in _payments.values()
+            if (not args.get("location_id") or p.get("location_id") == args["location_id"])
+            and (not args.get("total") or str(p["total_money"].get("amount")) == args["total"])
+            and (not args.get("begin_time") or datetime.fromisoformat(p["created_at"].replace("Z", "+00:00"))
+                 >= datetime.fromisoformat(args["begin_time"].replace("Z", "+00:00")))
+        ]
+    return jsonify({"payments": payments} if payments else {})
+
+
+def _stock(variation_id: str) -> Optional[int]:
+    if variation_id.startswith("UNTRACKED"):
+        return None
+    with _lock:
+        qty = _inventory.get(variation_id)
+    if qty is None:
+        qty = int(hashlib.sha256(variation_id.encode()).hexdigest()[:8], 16) % 25
+    return qty
+
+
+@app.post("/v2/inventory/counts/batch-retrieve")
+def batch_retrieve_inventory_counts():
+    err = _simulate_upstream()
+    if err is not None:
+        return err
+    body = request.get_json(force=True, silent=True) or {}
+    ids = [str(i) for i in body.get("catalog_object_ids") or []]
+    locations = body.get("location_ids") or ["FAKE_LOCATION"]
+    states = body.get("states") or ["IN_STOCK"]
+    counts = []
+    ts = _now()
+    for vid in ids:
+        qty = _stock(vid)
+        if qty is None:
+            continue
+        for loc in locations:
+            if "IN_STOCK" in states:
+                counts.append({"catalog_object_id": vid, "catalog_object_type": "ITEM_VARIATION",
+                               "state": "IN_STOCK", "location_id": loc, "quantity": str(qty),
+                               "calculated_at": ts})
+    start = int(body.get("cursor") or 0)
+    page = counts[start:start + min(int(body.get("limit") or INVENTORY_PAGE_SIZE), INVENTORY_PAGE_SIZE)]
+    out: Dict[str, Any] = {"counts": page}
+    if start + len(page) < len(counts):
+        out["cursor"] = str(start + len(page))
+    return jsonify(out)
+
+
+def _send_webhook(event_type: str, obj: Dict[str, Any]) -> None:
+    """POST a signed notification to the configured webhook URL (in the background)."""
+    if not (WEBHOOK["url"] and WEBHOOK["key"]):
+        return
+    event = {"merchant_id": "FAKE_MERCHANT", "type": event_type, "event_id": str(uuid.uuid4()),
+             "created_at": _now(), "data": {"type": event_type.split(".")[0], "id": "", "object": obj}}
+    body = json.dumps(event).encode("utf-8")
+    sig = base64.b64encode(hmac.new(WEBHOOK["key"].encode(), WEBHOOK["url"].encode() + body, hashlib.sha256).digest())
+
+    def post():
+        try:
+            requests.post(WEBHOOK["url"], data=body, timeout=10, headers={
+                "Content-Type": "application/json", "x-square-hmacsha256-signature": sig.decode()})
+        except requests.RequestException as e:
+            app.logger.warning("Webhook to %s failed: %s", WEBHOOK["url"], e)
+
+    threading.Thread(target=post, daemon=True).start()
+
+
+@app.put("/_fake/inventory/<variation_id>")
+def set_inventory(variation_id: str):
+    qty = int((request.get_json(force=True, silent=True) or {}).get("quantity") or 0)
+    with _lock:
+        _inventory[variation_id] = qty
+    count = {"catalog_object_id": variation_id, "catalog_object_type": "ITEM_VARIATION", "state": "IN_STOCK",
+             "location_id": request.args.get("location_id", "FAKE_LOCATION"), "quantity": str(qty),
+             "calculated_at": _now()}
+    _send_webhook("inventory.count.updated", {"inventory_counts": [count]})
+    return jsonify(count)
+
+
+def _catalog_changed(obj: Dict[str, Any]) -> Dict[str, Any]:
+    with _lock:
+        obj["updated_at"] = _now()
+        obj["version"] = int(obj.get("version") or 0) + 1
+        _catalog[obj["id"]] = obj
+        _catalog.move_to_end(obj["id"])
+    _send_webhook("catalog.version.updated", {"catalog_version": {"updated_at": obj["updated_at"]}})
+    return obj
+
+
+@app.put("/_fake/catalog/<object_id>")
+def put_catalog_object(object_id: str):
+    obj = dict(request.get_json(force=True, silent=True) or {}, id=object_id, is_deleted=False)
+    return jsonify({"catalog_object": _catalog_changed(obj)})
+
+
+@app.delete("/_fake/catalog/<object_id>")
+def delete_catalog_object(object_id: str):
+    with _lock:
+        obj = _catalog.get(object_id)
+    if obj is None:
+        return jsonify({"errors": [{"category": "INVALID_REQUEST_ERROR", "code": "NOT_FOUND"}]}), 404
+    return jsonify({"deleted_object_ids": [_catalog_changed(dict(obj, is_deleted=True))["id"]]})
+
+
+@app.post("/v2/catalog/search")
+def search_catalog_objects():
+    err = _simulate_upstream()
+    if err is not None:
+        return err
+    body = request.get_json(force=True, silent=True) or {}
+    types = set(body.get("object_types") or [])
+    begin = str(body.get("begin_time") or "")
+    with _lock:
+        objects = [o for o in _catalog.values()
+                   if (not types or o.get("type") in types) and o["updated_at"] > begin
+                   and (body.get("include_deleted_objects") or not o.get("is_deleted"))]
+        latest = max((o["updated_at"] for o in _catalog.values()), default="")
+        categories = {o["id"]: o for o in _catalog.values() if o.get("type") == "CATEGORY"}
+    start = int(body.get("cursor") or 0)
+    page = objects[start:start + min(int(body.get("limit") or INVENTORY_PAGE_SIZE), INVENTORY_PAGE_SIZE)]
+    out: Dict[str, Any] = {"objects": page, "latest_time": latest}
+    if body.get("include_related_objects"):
+        ids = {((o.get("item_data") or {}).get("reporting_category") or {}).get("id") for o in page}
+        out["related_objects"] = [categories[i] for i in ids if i in categories]
+    if start + len(page) < len(objects):
+        out["cursor"] = str(start + len(page))
+    return jsonify(out)
+
+
+@app.get("/_fake/stats")
+def stats():
+    with _lock:
+        return jsonify({"calls": dict(_calls)})
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Run a local fake of the Square Orders/Payments/Inventory/Catalog API.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--latency-ms", type=float, default=CONFIG["latency_ms"])
+    ap.add_argument("--jitter-ms", type=float, default=CONFIG["jitter_ms"])
+    ap.add_argument("--error-rate", type=float, default=CONFIG["error_rate"])
+    ap.add_argument("--unit-price-cents", type=int, default=CONFIG["unit_price_cents"])
+    ap.add_argument("--webhook-url", default=WEBHOOK["url"], help="API webhook endpoint to notify")
+    ap.add_argument("--webhook-key", default=WEBHOOK["key"], help="signature key shared with the API")
+    args = ap.parse_args()
+
+    CONFIG.update(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                  error_rate=args.error_rate, unit_price_cents=args.unit_price_cents)
+    WEBHOOK.update(url=args.webhook_url, key=args.webhook_key)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Gunicorn settings for the store API.
+
+Default serving mode is cooperative: `gevent` workers, each multiplexing up to
+`GUNICORN_WORKER_CONNECTIONS` requests on greenlets. A checkout waiting on Square only
+parks its greenlet, so slow upstream calls no longer pin a whole worker process and
+`/api/health` / `/api/square/bootstrap` keep answering.
+
+Set `GUNICORN_WORKER_CLASS=sync` to get the previous one-request-per-process behaviour,
+or `gthread` (with `GUNICORN_THREADS`) if gevent is unavailable on the host.
+"""
+import multiprocessing
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name, "") or "").strip()
+    return int(raw) if raw else default
+
+
+bind = f"{os.getenv('APP_HOST', '0.0.0.0')}:{os.getenv('APP_PORT', '8088')}"
+
+worker_class = (os.getenv("GUNICORN_WORKER_CLASS", "gevent") or "gevent").strip()
+
+# Cooperative workers are I/O bound; one per core is enough. Sync/threaded workers need
+# more processes to cover blocking time.
+_cpus = multiprocessing.cpu_count()
+workers = _env_int("GUNICORN_WORKERS", _cpus if worker_class == "gevent" else _cpus * 2 + 1)
+
+# gevent: max concurrent requests (greenlets) per worker.
+worker_connections = _env_int("GUNICORN_WORKER_CONNECTIONS", 1000)
+if worker_class == "gthread":
+    # Threads per worker; only the gthread class uses them.
+    threads = _env_int("GUNICORN_THREADS", 16)
+
+# Must exceed the worst-case checkout (2 Square calls with connect/read timeouts + retries).
+timeout = _env_int("GUNICORN_TIMEOUT", 120)
+graceful_timeout = _env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+keepalive = _env_int("GUNICORN_KEEPALIVE", 5)
+
+# Never preload: gevent must monkey-patch sockets before `requests`/`square_client`
+# are imported, and each worker should build its own Square connection pool.
+preload_app = False
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+
+
+def on_starting(server):
+    # Fresh metrics directory per master start (see metrics.py).
+    import metrics
+    metrics.reset_dir()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,141 @@
+"""Checkout idempotency: collapse client retries onto one upstream checkout.
+
+`CheckoutDedupe.run(key, fingerprint, fn)` guarantees that, per process, only one call
+of `fn` runs for a given client key:
+- concurrent duplicates wait for the first call and get its result (singleflight);
+- later duplicates get the cached 2xx response from a bounded LRU, or from an optional
+  SQLite store shared by all workers on the host (`CHECKOUT_IDEMPOTENCY_DB`).
+Non-2xx results are handed to waiters but not cached, so a genuine retry can proceed.
+Reusing a key for a different request raises `KeyConflict`.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+# (status, body bytes, mimetype)
+Result = Tuple[int, bytes, str]
+
+
+class KeyConflict(Exception):
+    pass
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "event", "result", "expires")
+
+    def __init__(self, fingerprint: str, expires: float):
+        self.fingerprint = fingerprint
+        self.event = threading.Event()
+        self.result: Optional[Result] = None
+        self.expires = expires
+
+
+class CheckoutDedupe:
+    def __init__(self, max_entries: int = 10_000, ttl: float = 24 * 3600, db_path: str = "",
+                 wait_timeout: float = 120.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.db_path = db_path
+        self._lru: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if db_path:
+            self._db().execute(
+                "CREATE TABLE IF NOT EXISTS checkout_results ("
+                " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status INTEGER NOT NULL,"
+                " body BLOB NOT NULL, mimetype TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    # ---- SQLite (one connection per thread) ----
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _db_get(self, key: str) -> Optional[Tuple[str, Result, float]]:
+        if not self.db_path:
+            return None
+        row = self._db().execute(
+            "SELECT fingerprint, status, body, mimetype, expires FROM checkout_results WHERE key = ? AND expires > ?",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], (int(row[1]), bytes(row[2]), row[3]), float(row[4])
+
+    def _db_put(self, key: str, fingerprint: str, result: Result, expires: float) -> None:
+        if not self.db_path:
+            return
+        db = self._db()
+        db.execute(
+            "INSERT OR REPLACE INTO checkout_results (key, fingerprint, status, body, mimetype, expires)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key, fingerprint, result[0], result[1], result[2], expires),
+        )
+        db.execute("DELETE FROM checkout_results WHERE expires <= ?", (time.time(),))
+
+    # ---- public API ----
+
+    def run(self, key: str, fingerprint: str, fn: Callable[[], Result]) -> Tuple[Result, bool]:
+        """Return (result, replayed). `replayed` is True when `fn` did not run for this call."""
+        now = time.time()
+        with self._lock:
+            e = self._lru.get(key)
+            if e is not None and e.event.is_set() and e.expires <= now:
+                del self._lru[key]
+                e = None
+            if e is not None:
+                if e.fingerprint != fingerprint:
+                    raise KeyConflict(key)
+                self._lru.move_to_end(key)
+                owner = False
+            else:
+                e = _Entry(fingerprint, now + self.ttl)
+                self._lru[key] = e
+                self._evict()
+                owner = True
+
+        if not owner:
+            if not e.event.wait(self.wait_timeout) or e.result is None:
+                return (409, b'{"ok":false,"error":"Checkout with this key is still in progress"}',
+                        "application/json"), True
+            return e.result, True
+
+        result: Optional[Result] = None
+        replayed = False
+        try:
+            stored = self._db_get(key)
+            if stored is not None:
+                if stored[0] != fingerprint:
+                    raise KeyConflict(key)
+                result, replayed, e.expires = stored[1], True, stored[2]
+            else:
+                result = fn()
+                if 200 <= result[0] < 300:
+                    self._db_put(key, fingerprint, result, e.expires)
+            return result, replayed
+        finally:
+            e.result = result
+            e.event.set()
+            if result is None or not (200 <= result[0] < 300):
+                with self._lock:
+                    if self._lru.get(key) is e:
+                        del self._lru[key]
+
+    def _evict(self) -> None:
+        # Only drop finished entries; in-flight ones must stay visible to duplicates.
+        while len(self._lru) > self.max_entries:
+            for k, old in self._lru.items():
+                if old.event.is_set():
+                    del self._lru[k]
+                    break
+            else:
+                return
@@ -0,0 +1,155 @@
+"""Stock levels for the storefront: a TTL cache over Square's batch inventory lookup.
+
+`InventoryCache.get(ids)` returns `{variation_id: quantity}` (variation ids are the
+`catalog_object_id`s checkout sends to Square; `None` = Square does not track stock for it):
+- entries younger than `ttl` are answered from memory;
+- misses are fetched with `fetch(ids)` in chunks of `batch_size` ids, one upstream call per
+  chunk (Square's BatchRetrieveInventoryCounts);
+- ids another request is already fetching are waited on, not fetched again (singleflight
+  per id), so a burst of page views for the same products costs one upstream call.
+If a fetch fails, entries up to `stale_if_error` seconds old are served instead; ids with
+nothing usable raise `InventoryUnavailable`. The cache is a bounded LRU, per process.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# variation_id -> quantity in stock (None = not tracked)
+Counts = Dict[str, Optional[float]]
+
+
+class InventoryUnavailable(Exception):
+    pass
+
+
+class _Flight:
+    __slots__ = ("event", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class InventoryCache:
+    def __init__(
+        self,
+        fetch: Callable[[List[str]], Counts],
+        ttl: float = 30.0,
+        batch_size: int = 100,
+        stale_if_error: float = 300.0,
+        max_entries: int = 50_000,
+        wait_timeout: float = 10.0,
+        on_lookup: Optional[Callable[[str, int], None]] = None,
+    ):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.batch_size = max(1, int(batch_size))
+        self.stale_if_error = max(ttl, stale_if_error)
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.on_lookup = on_lookup
+        # variation_id -> (quantity, fetched at (monotonic))
+        self._entries: "OrderedDict[str, Tuple[Optional[float], float]]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, result: str, n: int) -> None:
+        if n and self.on_lookup is not None:
+            self.on_lookup(result, n)
+
+    def _store(self, counts: Counts, ids: Iterable[str], fetched_at: float) -> None:
+        with self._lock:
+            for vid in ids:
+                self._entries[vid] = (counts.get(vid), fetched_at)
+                self._entries.move_to_end(vid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _fetch_chunks(self, ids: List[str], flight: _Flight) -> None:
+        try:
+            for i in range(0, len(ids), self.batch_size):
+                chunk = ids[i:i + self.batch_size]
+                # Store per chunk: waiters on a later, failing chunk still get the earlier ones.
+                self._store(self.fetch(chunk), chunk, time.monotonic())
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                for vid in ids:
+                    if self._inflight.get(vid) is flight:
+                        del self._inflight[vid]
+            flight.event.set()
+
+    def _settle(self, vid: str, flight: _Flight, out: Counts) -> None:
+        """Read what a finished (or timed-out) flight left for `vid`, falling back to stale data."""
+        with self._lock:
+            e = self._entries.get(vid)
+        age = time.monotonic() - e[1] if e is not None else None
+        if age is not None and age < self.ttl:
+            out[vid] = e[0]
+            return
+        if age is not None and age < self.stale_if_error:
+            self._count("stale", 1)
+            out[vid] = e[0]
+            return
+        raise InventoryUnavailable(str(flight.error or "timed out waiting for inventory lookup"))
+
+    def get(self, ids: Iterable[str]) -> Counts:
+        ids = list(dict.fromkeys(i for i in ids if i))
+        now = time.monotonic()
+        out: Counts = {}
+        waits: Dict[str, _Flight] = {}
+        mine: List[str] = []
+        with self._lock:
+            for vid in ids:
+                e = self._entries.get(vid)
+                if e is not None and now - e[1] < self.ttl:
+                    self._entries.move_to_end(vid)
+                    out[vid] = e[0]
+                elif vid in self._inflight:
+                    waits[vid] = self._inflight[vid]
+                else:
+                    mine.append(vid)
+            flight = _Flight()
+            for vid in mine:
+                self._inflight[vid] = flight
+        self._count("hit", len(out))
+        self._count("coalesced", len(waits))
+        self._count("miss", len(mine))
+
+        if mine:
+            self._fetch_chunks(mine, flight)
+            for vid in mine:
+                self._settle(vid, flight, out)
+        for vid, f in waits.items():
+            f.event.wait(self.wait_timeout)
+            self._settle(vid, f, out)
+        return {vid: out[vid] for vid in ids}
+
+    def put(self, counts: Counts) -> None:
+        """Store counts known to be current (e.g. from an inventory webhook)."""
+        self._store(counts, list(counts), time.monotonic())
+
+    def invalidate(self, ids: Iterable[str] = ()) -> None:
+        """Forget cached counts for `ids` (all of them if empty)."""
+        ids = list(ids)
+        with self._lock:
+            if not ids:
+                self._entries.clear()
+            for vid in ids:
+                self._entries.pop(vid, None)
+
+
+def add_counts(out: Counts, body: dict, state: str = "IN_STOCK") -> Counts:
+    """Add one BatchRetrieveInventoryCounts page to `out` (ids Square omits stay None)."""
+    for c in body.get("counts") or []:
+        vid = c.get("catalog_object_id")
+        if vid not in out or c.get("state", state) != state:
+            continue
+        try:
+            qty = float(c.get("quantity") or 0)
+        except (TypeError, ValueError):
+            continue
+        out[vid] = (out[vid] or 0.0) + qty
+    return out
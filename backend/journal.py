@@ -0,0 +1,316 @@
+"""Durable checkout journal and background reconciliation of orphaned orders.
+
+Every checkout appends its state transitions to a local SQLite table (WAL mode):
+
+    started -> order_failed
+            -> order_created -> paid
+                             -> payment_declined   (Square rejected the card)
+                             -> payment_unknown    (timeout / transport error / 5xx)
+
+Rows are appended, never updated (apart from redacting rows written by older versions); the
+latest row per `checkout_id` is the checkout's state. A same-key retry of a checkout whose
+latest state is open does not append `started`/`order_failed`, so the earlier order stays
+visible to the reconciler. A checkout whose latest state leaves a Square order without a settled payment is picked up
+by `Reconciler` (after a grace period, so the request that owns it has finished):
+- the order is re-read first; if Square already shows it paid or canceled, that is recorded;
+- an unknown payment outcome is looked up at Square (ListPayments by location and amount,
+  matched on the order id). A completed payment marks the checkout paid; a failed or
+  missing one cancels the order. Payments are never re-sent: the journal keeps only
+  `redact_payment` fields, not the card nonce or buyer details;
+- a declined payment cancels the order so it does not linger as an open order;
+- after `max_attempts` failed attempts the checkout is `flagged` for a human.
+
+Only one process per journal file reconciles at a time (an advisory file lock), so all
+gunicorn workers can share one journal.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, every process may reconcile.
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# States whose checkout still needs the reconciler.
+OPEN_STATES = ("order_created", "payment_unknown", "payment_declined", "reconcile_failed")
+# States written before a Square order exists; never recorded over an open state, so a
+# same-key retry cannot hide an earlier order from the reconciler.
+PRE_ORDER_STATES = ("started", "order_failed")
+RECONCILE_NS = uuid.UUID("0b5f7a3c-2f57-4d0e-8d0c-4a3c6f8a9e21")
+# CreatePayment fields the reconciler needs to find the payment again.
+PAYMENT_REF_FIELDS = ("idempotency_key", "amount_money", "location_id", "order_id")
+PAID_STATUSES = ("COMPLETED", "APPROVED")
+# ListPayments window starts this long before the journaled request (clock skew).
+LOOKUP_SKEW = 600.0
+LOOKUP_MAX_PAGES = 5
+
+
+def redact_payment(body: Dict[str, Any]) -> Dict[str, Any]:
+    """The journaled part of a CreatePayment body: no card nonce (`source_id`) or buyer PII."""
+    return {k: body[k] for k in PAYMENT_REF_FIELDS if k in body}
+
+
+class Entry(NamedTuple):
+    seq: int
+    checkout_id: str
+    state: str
+    at: float
+    env: str
+    order_id: str
+    data: Dict[str, Any]
+
+
+class CheckoutJournal:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db().executescript(
+            "CREATE TABLE IF NOT EXISTS checkout_journal ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, checkout_id TEXT NOT NULL, state TEXT NOT NULL,"
+            " at REAL NOT NULL, env TEXT NOT NULL DEFAULT '', order_id TEXT NOT NULL DEFAULT '',"
+            " data TEXT NOT NULL DEFAULT '{}');"
+            "CREATE INDEX IF NOT EXISTS checkout_journal_by_id ON checkout_journal (checkout_id, seq);"
+        )
+        self._redact_stored_payments()
+
+    def _redact_stored_payments(self) -> None:
+        """Strip nonces and buyer details from rows journaled before `redact_payment` existed."""
+        db = self._db()
+        rows = db.execute(
+            "SELECT seq, data FROM checkout_journal WHERE state = 'order_created' AND data LIKE '%\"source_id\"%'"
+        ).fetchall()
+        if not rows:
+            return
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            for seq, data in rows:
+                d = json.loads(data)
+                d["payment"] = redact_payment(d.get("payment") or {})
+                db.execute("UPDATE checkout_journal SET data = ? WHERE seq = ?", (json.dumps(d, separators=(",", ":")), seq))
+        log.info("Redacted %d journaled payment requests", len(rows))
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, checkout_id: str, state: str, env: str = "", order_id: str = "", **data) -> bool:
+        """Append one transition; False if skipped. Never raises: a journal problem must not
+        fail a checkout. PRE_ORDER_STATES are skipped while the checkout's latest state is open."""
+        marks = ",".join("?" for _ in OPEN_STATES)
+        try:
+            cur = self._db().execute(
+                "INSERT INTO checkout_journal (checkout_id, state, at, env, order_id, data)"
+                " SELECT ?, ?, ?, ?, ?, ? WHERE NOT (? AND COALESCE((SELECT state FROM checkout_journal"
+                f" WHERE checkout_id = ? ORDER BY seq DESC LIMIT 1), '') IN ({marks}))",
+                (checkout_id, state, time.time(), env, order_id or "", json.dumps(data, separators=(",", ":")),
+                 state in PRE_ORDER_STATES, checkout_id, *OPEN_STATES),
+            )
+        except sqlite3.Error:
+            log.exception("Checkout journal write failed (%s -> %s)", checkout_id, state)
+            return False
+        return cur.rowcount == 1
+
+    def history(self, checkout_id: str) -> List[Entry]:
+        rows = self._db().execute(
+            "SELECT seq, checkout_id, state, at, env, order_id, data FROM checkout_journal"
+            " WHERE checkout_id = ? ORDER BY seq",
+            (checkout_id,),
+        ).fetchall()
+        return [Entry(r[0], r[1], r[2], r[3], r[4], r[5], json.loads(r[6])) for r in rows]
+
+    def latest(self, checkout_id: str) -> Optional[Entry]:
+        r = self._db().execute(
+            "SELECT seq, checkout_id, state, at, env, order_id, data FROM checkout_journal"
+            " WHERE checkout_id = ? ORDER BY seq DESC LIMIT 1",
+            (checkout_id,),
+        ).fetchone()
+        return Entry(r[0], r[1], r[2], r[3], r[4], r[5], json.loads(r[6])) if r else None
+
+    def pending(self, older_than: float, limit: int = 100) -> List[Entry]:
+        """Checkouts whose latest state is open and at least `older_than` seconds old."""
+        marks = ",".join("?" for _ in OPEN_STATES)
+        rows = self._db().execute(
+            "SELECT j.seq, j.checkout_id, j.state, j.at, j.env, j.order_id, j.data FROM checkout_journal j"
+            " JOIN (SELECT checkout_id, MAX(seq) AS seq FROM checkout_journal GROUP BY checkout_id) last"
+            " ON j.seq = last.seq"
+            f" WHERE j.state IN ({marks}) AND j.at <= ? ORDER BY j.seq LIMIT ?",
+            (*OPEN_STATES, time.time() - older_than, limit),
+        ).fetchall()
+        return [Entry(r[0], r[1], r[2], r[3], r[4], r[5], json.loads(r[6])) for r in rows]
+
+    def payment_ref(self, checkout_id: str) -> Optional[Entry]:
+        """The latest `order_created` entry (its `data["payment"]` is a `redact_payment` dict)."""
+        for e in reversed(self.history(checkout_id)):
+            if e.state == "order_created" and e.data.get("payment"):
+                return e
+        return None
+
+    def prune(self, retention: float) -> int:
+        """Drop checkouts not awaiting reconciliation whose last change is older than `retention` seconds."""
+        marks = ",".join("?" for _ in OPEN_STATES)
+        cur = self._db().execute(
+            "DELETE FROM checkout_journal WHERE checkout_id IN ("
+            " SELECT j.checkout_id FROM checkout_journal j"
+            " JOIN (SELECT checkout_id, MAX(seq) AS seq FROM checkout_journal GROUP BY checkout_id) last"
+            f" ON j.seq = last.seq WHERE j.state NOT IN ({marks}) AND j.at <= ?)",
+            (*OPEN_STATES, time.time() - retention),
+        )
+        return cur.rowcount
+
+
+class Reconciler:
+    """Resolves open checkouts from the journal off the request path.
+
+    `client_for(env)` returns a client with `get/post/put` (see square_client.SquareClient);
+    `on_outcome(state)` is called for every transition the reconciler records.
+    """
+
+    def __init__(self, journal: CheckoutJournal, client_for: Callable[[str], Any], grace: float = 120.0,
+                 interval: float = 30.0, max_attempts: int = 5, retention: float = 30 * 86400,
+                 on_outcome: Optional[Callable[[str], None]] = None):
+        self.journal = journal
+        self.client_for = client_for
+        self.grace = grace
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.on_outcome = on_outcome or (lambda state: None)
+        self._lock_file = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _transition(self, e: Entry, state: str, **data) -> str:
+        self.journal.record(e.checkout_id, state, e.env, e.order_id, **data)
+        self.on_outcome(state)
+        if state == "flagged":
+            log.warning("Checkout %s (order %s) needs manual review: %s", e.checkout_id, e.order_id, data)
+        return state
+
+    @staticmethod
+    def _action(e: Entry) -> str:
+        if e.state == "reconcile_failed":
+            action = e.data.get("action", "lookup")
+            return "lookup" if action == "retry" else action  # rows written before lookups
+        return "cancel" if e.state == "payment_declined" else "lookup"
+
+    def _failed(self, e: Entry, reason: str) -> str:
+        attempts = int(e.data.get("attempts", 0)) + 1 if e.state == "reconcile_failed" else 1
+        if attempts >= self.max_attempts:
+            return self._transition(e, "flagged", reason=reason, attempts=attempts)
+        return self._transition(e, "reconcile_failed", reason=reason, attempts=attempts, action=self._action(e))
+
+    def reconcile(self, e: Entry) -> str:
+        client = self.client_for(e.env)
+        action = self._action(e)
+
+        r = client.get(f"/v2/orders/{e.order_id}")
+        if r.status_code >= 300:
+            return self._failed(e, f"RetrieveOrder HTTP {r.status_code}")
+        order = r.json().get("order") or {}
+        state = order.get("state")
+        due = int((order.get("net_amount_due_money") or {}).get("amount", 1))
+        if state == "CANCELED":
+            return self._transition(e, "canceled", source="square")
+        if state == "COMPLETED" or due == 0:
+            tenders = order.get("tenders") or [{}]
+            return self._transition(e, "paid", source="square", payment_id=tenders[0].get("payment_id"))
+
+        if action == "lookup":
+            ref = self.journal.payment_ref(e.checkout_id)
+            if ref is None:
+                return self._transition(e, "flagged", reason="payment request missing from journal")
+            try:
+                payments = self._order_payments(client, e.order_id, ref)
+            except LookupError as ex:
+                return self._failed(e, str(ex))
+            for status in PAID_STATUSES:
+                paid = [p for p in payments if p.get("status") == status]
+                if paid:
+                    return self._transition(e, "paid", source="square", payment_id=paid[0].get("id"))
+            if any(p.get("status") == "PENDING" for p in payments):
+                return self._failed(e, "payment still pending")
+            # No payment reached Square (or it failed): the order is canceled below.
+
+        rc = client.put(f"/v2/orders/{e.order_id}", {
+            "idempotency_key": str(uuid.uuid5(RECONCILE_NS, f"{e.order_id}:cancel:{order.get('version')}")),
+            "order": {"location_id": order.get("location_id"), "version": order.get("version"), "state": "CANCELED"},
+        })
+        if rc.status_code < 300:
+            return self._transition(e, "canceled", source="reconciler")
+        return self._failed(e, f"UpdateOrder HTTP {rc.status_code}")
+
+    @staticmethod
+    def _order_payments(client: Any, order_id: str, ref: Entry) -> List[Dict[str, Any]]:
+        """Square payments for `order_id` (ListPayments filtered by location and exact total)."""
+        pay = ref.data["payment"]
+        params: Dict[str, Any] = {
+            "begin_time": datetime.fromtimestamp(ref.at - LOOKUP_SKEW, timezone.utc).isoformat(),
+            "location_id": pay.get("location_id") or "",
+            "total": (pay.get("amount_money") or {}).get("amount", ""),
+            "sort_order": "ASC",
+        }
+        found: List[Dict[str, Any]] = []
+        for _ in range(LOOKUP_MAX_PAGES):
+            r = client.get("/v2/payments", params=params)
+            if r.status_code >= 300:
+                raise LookupError(f"ListPayments HTTP {r.status_code}")
+            body = r.json()
+            found += [p for p in body.get("payments") or [] if p.get("order_id") == order_id]
+            if not body.get("cursor"):
+                return found
+            params["cursor"] = body["cursor"]
+        raise LookupError("ListPayments: too many payments in the lookup window")
+
+    def run_once(self) -> Dict[str, int]:
+        outcomes: Dict[str, int] = {}
+        for e in self.journal.pending(self.grace):
+            try:
+                state = self.reconcile(e)
+            except Exception as ex:
+                log.exception("Reconciling checkout %s failed", e.checkout_id)
+                state = self._failed(e, f"{type(ex).__name__}: {ex}")
+            outcomes[state] = outcomes.get(state, 0) + 1
+        if self.retention > 0:
+            self.journal.prune(self.retention)
+        return outcomes
+
+    def _acquire_leader(self) -> bool:
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(self.journal.db_path + ".reconciler.lock", "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self._acquire_leader():
+                    self.run_once()
+            except Exception:
+                log.exception("Checkout reconciler pass failed")
+
+    def start(self) -> None:
+        """Run `run_once` every `interval` seconds in a daemon thread (once per process)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="checkout-reconciler", daemon=True)
+            self._thread.start()
@@ -0,0 +1,247 @@
+"""Lightweight in-process metrics with a Prometheus text exposition.
+
+Each process keeps counters, gauges and fixed-bucket histograms in plain dicts behind one
+lock, so recording a sample is a dict lookup plus a bisect. To stay correct under several
+gunicorn workers, a daemon thread in every process snapshots its values to
+`METRICS_DIR/<pid>.json` each `METRICS_FLUSH_INTERVAL` seconds; a scrape merges the
+snapshots of live processes (values are summed). The gunicorn master clears the directory
+on start and marks the snapshots of workers that exit as dead: their counters and
+histograms still count, their gauges do not (see gunicorn.conf.py). Snapshots of other
+processes that are gone, or that were not refreshed for `STALE_AFTER` seconds, are ignored.
+"""
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+METRICS_DIR = (os.getenv("METRICS_DIR", "") or "").strip() or os.path.join(tempfile.gettempdir(), "av-store-metrics")
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0") or 1.0)
+STALE_AFTER = max(5 * FLUSH_INTERVAL, 5.0)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_HELP: Dict[str, Tuple[str, str]] = {}
+_lock = threading.Lock()
+_counters: Dict[Key, float] = {}
+_gauges: Dict[Key, float] = {}
+# key -> [bucket counts..., +Inf count] , sum
+_hists: Dict[Key, List] = {}
+_flusher_pid = 0
+
+
+def describe(name: str, kind: str, help_text: str) -> None:
+    _HELP[name] = (kind, help_text)
+
+
+def _key(name: str, labels: Dict[str, str]) -> Key:
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0.0) + value
+
+
+def gauge_add(name: str, delta: float, **labels) -> None:
+    k = _key(name, labels)
+    with _lock:
+        _gauges[k] = _gauges.get(k, 0.0) + delta
+
+
+def observe(name: str, value: float, **labels) -> None:
+    k = _key(name, labels)
+    i = bisect.bisect_left(DEFAULT_BUCKETS, value)
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = [[0] * (len(DEFAULT_BUCKETS) + 1), 0.0]
+        h[0][i] += 1
+        h[1] += value
+
+
+@contextmanager
+def timer(name: str, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+# ---- multi-process snapshots ----
+
+def _snapshot() -> Dict:
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "at": time.time(),
+            "counters": [[n, dict(l), v] for (n, l), v in _counters.items()],
+            "gauges": [[n, dict(l), v] for (n, l), v in _gauges.items()],
+            "hists": [[n, dict(l), list(h[0]), h[1]] for (n, l), h in _hists.items()],
+        }
+
+
+def flush() -> None:
+    """Write this process's snapshot (atomically) for other workers' scrapes."""
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_snapshot(), f, separators=(",", ":"))
+        os.replace(tmp, path)
+    except OSError:
+        # Metrics must never break request handling.
+        pass
+
+
+def _start_flusher() -> None:
+    """Start one daemon flusher per process (lazily, so it runs in each forked worker)."""
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+
+    def loop():
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            flush()
+
+    threading.Thread(target=loop, name="metrics-flush", daemon=True).start()
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _iter_snapshots() -> Iterable[Dict]:
+    """This process's live values, workers marked dead, and other live, fresh snapshots."""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        names = []
+    yield _snapshot()
+    own = f"{os.getpid()}.json"
+    cutoff = time.time() - STALE_AFTER
+    for fn in names:
+        if not fn.endswith(".json") or fn == own:
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, fn), "r", encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if snap.get("dead"):
+            yield snap
+        elif snap.get("at", 0) >= cutoff and _pid_alive(int(snap.get("pid") or 0)):
+            yield snap
+
+
+def reset_dir() -> None:
+    """Called by the gunicorn master on start: forget snapshots from earlier runs."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for fn in os.listdir(METRICS_DIR):
+        try:
+            os.remove(os.path.join(METRICS_DIR, fn))
+        except OSError:
+            pass
+
+
+def mark_process_dead(pid: int) -> None:
+    """Keep a dead worker's counters/histograms (they are cumulative) but drop its gauges."""
+    path = os.path.join(METRICS_DIR, f"{pid}.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snap = json.load(f)
+        snap["gauges"] = []
+        snap["dead"] = True
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(snap, f, separators=(",", ":"))
+        os.replace(f"{path}.tmp", path)
+    except (OSError, ValueError):
+        pass
+
+
+# ---- exposition ----
+
+def _fmt_labels(labels: Dict[str, str], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = sorted(labels.items()) + list(extra)
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def render() -> str:
+    flush()
+    counters: Dict[Key, float] = {}
+    gauges: Dict[Key, float] = {}
+    hists: Dict[Key, List] = {}
+    for snap in _iter_snapshots():
+        for n, l, v in snap.get("counters", []):
+            k = _key(n, l)
+            counters[k] = counters.get(k, 0.0) + v
+        for n, l, v in snap.get("gauges", []):
+            k = _key(n, l)
+            gauges[k] = gauges.get(k, 0.0) + v
+        for n, l, buckets, total in snap.get("hists", []):
+            k = _key(n, l)
+            h = hists.setdefault(k, [[0] * len(buckets), 0.0])
+            h[0] = [a + b for a, b in zip(h[0], buckets)]
+            h[1] += total
+
+    lines: List[str] = []
+    seen = set()
+
+    def header(name: str, kind: str) -> None:
+        if name in seen:
+            return
+        seen.add(name)
+        help_text = _HELP.get(name, (kind, name))[1]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (n, l), v in sorted(counters.items()):
+        header(n, "counter")
+        lines.append(f"{n}{_fmt_labels(dict(l))} {_fmt_num(v)}")
+    for (n, l), v in sorted(gauges.items()):
+        header(n, "gauge")
+        lines.append(f"{n}{_fmt_labels(dict(l))} {_fmt_num(v)}")
+    for (n, l), (buckets, total) in sorted(hists.items()):
+        header(n, "histogram")
+        labels = dict(l)
+        cum = 0
+        for bound, c in zip(DEFAULT_BUCKETS, buckets):
+            cum += c
+            lines.append(f"{n}_bucket{_fmt_labels(labels, (('le', _fmt_num(bound)),))} {cum}")
+        cum += buckets[-1]
+        lines.append(f"{n}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {cum}")
+        lines.append(f"{n}_sum{_fmt_labels(labels)} {repr(float(total))}")
+        lines.append(f"{n}_count{_fmt_labels(labels)} {cum}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,165 @@
+"""Inverted index for `/api/search` over one catalog snapshot.
+
+Products are tokenized once (lowercased, accents folded, split on non-alphanumerics) from
+`name`, `category`, `color` (product and variant colors) and `description_text`; each
+field has a weight, so a hit in the name outranks one in the description. A query term
+matches, in decreasing strength:
+- the exact token;
+- any token it is a prefix of (the term being typed), capped at `MAX_EXPANSIONS` tokens;
+- a token one edit away (insert/delete/substitute/transpose) for terms of 4+ characters,
+  found through a precomputed single-deletion map instead of scanning the vocabulary.
+
+Products whose indexed text is identical (e.g. per-size items of one product) share one
+search document, so query cost follows the number of distinct documents, not items. All
+query terms must match (AND). Candidates are intersected starting from the rarest term,
+so the work is bounded by the most selective term, and ranked results are kept in a small
+LRU keyed by the normalized query: typing "hoo", "hood", "hoodie" mostly hits the cache.
+The index is immutable and rebuilt with the snapshot when the catalog file changes.
+"""
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+
+FIELD_WEIGHTS = (("name", 4.0), ("category", 2.0), ("color", 2.0), ("description_text", 1.0))
+PREFIX_FACTOR = 0.6
+TYPO_FACTOR = 0.4
+TYPO_MIN_LEN = 4
+MAX_EXPANSIONS = 64
+MAX_QUERY_TERMS = 8
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    return _TOKEN_RE.findall("".join(c for c in text if not unicodedata.combining(c)))
+
+
+def _deletes(term: str) -> Set[str]:
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Damerau-Levenshtein distance <= 1 (the deletion map over-generates candidates)."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diff = [i for i in range(la) if a[i] != b[i]]
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1
+                                  and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if la > lb:
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    def __init__(self, products: Sequence[Dict[str, Any]], max_cached: int = 512):
+        self.size = len(products)
+        postings: Dict[str, Dict[int, float]] = {}
+        names: List[str] = []
+        # Search document -> product positions, in catalog order.
+        self._members: List[List[int]] = []
+        doc_of: Dict[Tuple, int] = {}
+        tokens_of: Dict[str, Tuple[str, ...]] = {}  # items repeat descriptions; tokenize each once
+        for pos, p in enumerate(products):
+            fields = []
+            for field, _ in FIELD_WEIGHTS:
+                value = p.get(field)
+                if field == "color":
+                    value = " ".join([str(value or "")] + [str((v or {}).get("color") or "") for v in p.get("variants") or []])
+                value = str(value or "")
+                toks = tokens_of.get(value)
+                if toks is None:
+                    # A field counts once per token: no keyword stuffing.
+                    toks = tokens_of[value] = tuple(dict.fromkeys(tokenize(value)))
+                fields.append(toks)
+            key = tuple(fields)
+            doc = doc_of.get(key)
+            if doc is not None:
+                self._members[doc].append(pos)
+                continue
+            doc = doc_of[key] = len(self._members)
+            self._members.append([pos])
+            names.append(str(p.get("name") or "").lower())
+            for toks, (_, weight) in zip(fields, FIELD_WEIGHTS):
+                for tok in toks:
+                    bucket = postings.setdefault(tok, {})
+                    bucket[doc] = bucket.get(doc, 0.0) + weight
+        self._postings = postings
+        self._vocab = sorted(postings)
+        self._names = names
+        self._deletion_map: Dict[str, List[str]] = {}
+        for term in self._vocab:
+            if len(term) >= TYPO_MIN_LEN:
+                for d in _deletes(term) | {term}:
+                    self._deletion_map.setdefault(d, []).append(term)
+        self._cache: "OrderedDict[Tuple[str, ...], List[int]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._max_cached = max_cached
+
+    def _expand(self, term: str, is_last: bool) -> Dict[str, float]:
+        """Index tokens a query term matches, with their strength factor."""
+        out: Dict[str, float] = {}
+        if term in self._postings:
+            out[term] = 1.0
+        # Prefix matches: every term may be partially typed, the last one most likely.
+        if is_last or len(term) >= 3:
+            i = bisect_left(self._vocab, term)
+            n = 0
+            while i < len(self._vocab) and n < MAX_EXPANSIONS and self._vocab[i].startswith(term):
+                out.setdefault(self._vocab[i], PREFIX_FACTOR)
+                i += 1
+                n += 1
+        if len(term) >= TYPO_MIN_LEN and not out:
+            for cand in {term, *_deletes(term)}:
+                for t in self._deletion_map.get(cand, ()):
+                    if t not in out and _within_one_edit(term, t):
+                        out[t] = TYPO_FACTOR
+        return out
+
+    def _rank(self, terms: Tuple[str, ...]) -> List[int]:
+        per_term: List[Dict[int, float]] = []
+        for n, term in enumerate(terms):
+            scores: Dict[int, float] = {}
+            for tok, factor in self._expand(term, n == len(terms) - 1).items():
+                for doc, w in self._postings[tok].items():
+                    s = w * factor
+                    if s > scores.get(doc, 0.0):
+                        scores[doc] = s
+            if not scores:
+                return []
+            per_term.append(scores)
+        per_term.sort(key=len)
+        docs: Iterable[int] = per_term[0]
+        for scores in per_term[1:]:
+            docs = [d for d in docs if d in scores]
+        ranked = [(-sum(s[d] for s in per_term), self._names[d], d) for d in docs]
+        ranked.sort()
+        members = self._members
+        return [pos for _, _, d in ranked for pos in members[d]]
+
+    def search(self, query: str) -> List[int]:
+        """Product positions matching every query term, best first (ties by name)."""
+        terms = tuple(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        with self._cache_lock:
+            hit = self._cache.get(terms)
+            if hit is not None:
+                self._cache.move_to_end(terms)
+                return hit
+        ranked = self._rank(terms)
+        with self._cache_lock:
+            self._cache[terms] = ranked
+            while len(self._cache) > self._max_cached:
+                self._cache.popitem(last=False)
+        return ranked
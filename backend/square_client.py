@@ -0,0 +1,118 @@
+"""Pooled, keep-alive HTTP client for the Square API.
+
+One `SquareClient` is kept per Square env (sandbox/production) per process. It owns a
+`requests.Session` so TLS connections are reused across checkouts, builds the auth
+headers once, and applies split connect/read timeouts plus bounded retries.
+
+Retries only happen for requests that are safe to replay: GET/PUT/DELETE, a POST whose
+JSON body carries a Square `idempotency_key` (Square dedupes those server-side), or a
+read-only POST the caller marks `replayable=True` (e.g. batch inventory lookups).
+"""
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+
+class SquareClient:
+    def __init__(
+        self,
+        base: str,
+        headers: Dict[str, str],
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 2,
+        backoff: float = 0.25,
+        pool_maxsize: int = 20,
+    ):
+        self.base = base.rstrip("/")
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.max_retries = max(0, int(max_retries))
+        self.backoff = max(0.0, float(backoff))
+
+        s = requests.Session()
+        s.headers.update(headers)
+        # Retries are handled in `request` so we can gate them on idempotency.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        self.session = s
+
+    def _retry_delay(self, attempt: int, resp: Optional[requests.Response]) -> float:
+        if resp is not None:
+            ra = (resp.headers.get("Retry-After") or "").strip()
+            if ra.isdigit():
+                return min(float(ra), self.timeout[1])
+        # Exponential backoff with jitter: 0.25, 0.5, 1.0, ...
+        return self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    def request(self, method: str, path: str, json: Any = None, replayable: bool = False,
+                **kwargs) -> requests.Response:
+        method = method.upper()
+        url = f"{self.base}{path}"
+        replayable = replayable or method in IDEMPOTENT_METHODS or (
+            isinstance(json, dict) and bool(json.get("idempotency_key"))
+        )
+        attempts = 1 + (self.max_retries if replayable else 0)
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                resp = self.session.request(method, url, json=json, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    raise
+                time.sleep(self._retry_delay(attempt, None))
+                continue
+            if resp.status_code in RETRY_STATUSES and not last:
+                time.sleep(self._retry_delay(attempt, resp))
+                continue
+            return resp
+        raise AssertionError("unreachable")
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, json: Any = None, replayable: bool = False, **kwargs) -> requests.Response:
+        return self.request("POST", path, json=json, replayable=replayable, **kwargs)
+
+    def put(self, path: str, json: Any = None, **kwargs) -> requests.Response:
+        return self.request("PUT", path, json=json, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_clients: Dict[str, SquareClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(env: str, factory: Callable[[], SquareClient]) -> SquareClient:
+    """Return the process-wide client for `env`, building it with `factory` on first use.
+
+    Clients are created lazily so each gunicorn worker gets its own pool after fork.
+    """
+    c = _clients.get(env)
+    if c is not None:
+        return c
+    with _clients_lock:
+        c = _clients.get(env)
+        if c is None:
+            c = factory()
+            _clients[env] = c
+        return c
+
+
+def reset_clients() -> None:
+    """Drop cached clients (e.g. after credentials change)."""
+    with _clients_lock:
+        for c in _clients.values():
+            c.close()
+        _clients.clear()
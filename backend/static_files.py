@@ -0,0 +1,148 @@
+"""Cache-friendly serving of storefront assets: product images and catalog JSON.
+
+`StaticFiles(root, patterns)` maps a URL path to a file under `root` when it matches one of
+the glob `patterns` (dotfiles and `..` are never served). Each file gets a `StaticEntry`
+that is built once and rebuilt only when the file or a compressed sibling changes
+(mtime/size/inode, re-checked at most every `check_interval` seconds). The entry holds:
+- a strong ETag (SHA-256 of the content) and the mtime for `Last-Modified`;
+- the MIME type;
+- precompressed `.br`/`.gz` siblings that are at least as new as the file.
+`warm()` hashes every matching file, so a worker can do it at startup instead of on the
+first request.
+
+Names carrying a content hash (`<name>.<12 hex>.<ext>`, as written by convert_catalog.py
+and image_derivatives.py) are marked `immutable`.
+"""
+import fnmatch
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterator, NamedTuple, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+mimetypes.add_type("image/avif", ".avif")
+mimetypes.add_type("image/webp", ".webp")
+
+IMMUTABLE_NAME = re.compile(r"\.[0-9a-f]{12}\.[A-Za-z0-9]+$")
+SIBLINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# (mtime_ns, size, inode) per file: the source, then each sibling (None if absent)
+Sig = Tuple[Optional[Tuple[int, int, int]], ...]
+
+
+class Encoded(NamedTuple):
+    path: str
+    etag: str
+
+
+class StaticEntry(NamedTuple):
+    path: str
+    sig: Sig
+    etag: str
+    mtime: float
+    mimetype: str
+    immutable: bool
+    encoded: Dict[str, Encoded]  # "br"/"gzip" -> precompressed sibling
+
+
+def _stat(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StaticFiles:
+    def __init__(self, root: str, patterns: Sequence[str], check_interval: float = 1.0):
+        self.root = os.path.realpath(root)
+        self.patterns = tuple(patterns)
+        self.check_interval = check_interval
+        # relative path -> (entry, last checked (monotonic))
+        self._entries: Dict[str, Tuple[StaticEntry, float]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, rel: str) -> Optional[str]:
+        parts = rel.split("/")
+        if any(p in ("", ".", "..") or p.startswith(".") for p in parts):
+            return None
+        if not any(fnmatch.fnmatchcase(rel, pat) for pat in self.patterns):
+            return None
+        path = os.path.realpath(os.path.join(self.root, *parts))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def _sig(self, path: str) -> Sig:
+        return (_stat(path),) + tuple(_stat(path + ext) for _, ext in SIBLINGS)
+
+    def _build(self, path: str, sig: Sig) -> StaticEntry:
+        etag = file_sha256(path)[:32]
+        encoded = {}
+        for (enc, ext), st in zip(SIBLINGS, sig[1:]):
+            # A sibling older than the file was compressed from a previous version.
+            if st is not None and st[0] >= sig[0][0]:
+                encoded[enc] = Encoded(path + ext, f"{etag}-{enc}")
+        return StaticEntry(
+            path=path,
+            sig=sig,
+            etag=etag,
+            mtime=sig[0][0] / 1e9,
+            mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream",
+            immutable=bool(IMMUTABLE_NAME.search(os.path.basename(path))),
+            encoded=encoded,
+        )
+
+    def entry(self, rel: str) -> Optional[StaticEntry]:
+        now = time.monotonic()
+        hit = self._entries.get(rel)
+        if hit is not None and now - hit[1] < self.check_interval:
+            return hit[0]
+        path = self.resolve(rel)
+        sig = self._sig(path) if path is not None else None
+        if sig is None or sig[0] is None:
+            with self._lock:
+                self._entries.pop(rel, None)
+            return None
+        if hit is not None and hit[0].path == path and hit[0].sig == sig:
+            e = hit[0]
+        else:
+            e = self._build(path, sig)
+        with self._lock:
+            self._entries[rel] = (e, now)
+        return e
+
+    def _walk(self) -> Iterator[str]:
+        # Only descend into directories a pattern can reach (its text before the first "*").
+        fixed = [pat.split("*")[0] for pat in self.patterns]
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            base = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            base = "" if base == "." else base + "/"
+            dirnames[:] = [d for d in dirnames if not d.startswith(".") and any(
+                f.startswith(base + d + "/") or (base + d + "/").startswith(f) for f in fixed)]
+            for name in filenames:
+                if name.endswith((".br", ".gz", ".tmp")):
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+                if any(fnmatch.fnmatchcase(rel, pat) for pat in self.patterns):
+                    yield rel
+
+    def warm(self) -> int:
+        """Hash every servable file now; returns how many were indexed."""
+        t0 = time.perf_counter()
+        n = sum(1 for rel in self._walk() if self.entry(rel) is not None)
+        log.info("Indexed %d static files under %s in %.2fs", n, self.root, time.perf_counter() - t0)
+        return n
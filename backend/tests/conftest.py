@@ -0,0 +1,69 @@
+"""Shared fixtures: backend modules on sys.path, and the Flask app over a small fixture catalog."""
+import json
+import os
+import sys
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+# Enough of a converted catalog to exercise lookups, search ranking and checkout validation.
+FIXTURE_CATALOG = {
+    "source": "fixture",
+    "generated_at": "2026-01-01T00:00:00Z",
+    "count": 5,
+    "products": [
+        {"id": "apex-hoodie", "name": "AeroVista Apex Pullover Hoodie", "category": "Hoodies", "price": 46.0,
+         "color": "Black", "description_text": "Heavyweight fleece with a kangaroo pocket.",
+         "variants": [{"variation_id": "V-HOODIE-M", "size": "M", "price": 46.0},
+                      {"variation_id": "V-HOODIE-XL", "size": "XL", "price": 48.0}]},
+        {"id": "apex-tee", "name": "AeroVista Apex Tee", "category": "Tees", "price": 24.0, "color": "White",
+         "description_text": "Soft cotton tee; pairs with the Apex hoodie.",
+         "variants": [{"variation_id": "V-TEE-M", "size": "M", "price": 24.0}]},
+        {"id": "trucker-cap", "name": "Apex Mesh Trucker Cap", "category": "Hats", "price": 28.0, "color": "Navy",
+         "description_text": "Snapback mesh cap.",
+         "variants": [{"variation_id": "V-CAP", "size": "One Size", "price": 28.0}]},
+        {"id": "sticker-pack", "name": "Holographic Sticker Pack", "category": "Stickers", "price": 6.0,
+         "description_text": "Three holographic stickers.",
+         "variants": [{"variation_id": "V-STICKERS", "size": "", "price": 6.0}]},
+        {"id": "crewneck", "name": "Golden Eye Crewneck Sweatshirt", "category": "Crewnecks", "price": 42.0,
+         "color": "Heather Grey", "description_text": "Crewneck sweatshirt, premium print.",
+         "variants": [{"variation_id": "V-CREW-L", "size": "L", "price": 42.0}]},
+    ],
+}
+
+APP_ENV = {
+    "SQUARE_ENV": "sandbox",
+    "SQUARE_ACCESS_TOKEN_SANDBOX": "test-token",
+    "SQUARE_APP_ID_SANDBOX": "test-app",
+    "SQUARE_LOCATION_ID_SANDBOX": "TEST_LOCATION",
+    "SQUARE_API_BASE_SANDBOX": "http://127.0.0.1:9",  # nothing listens: tests stub every Square call
+    "CHECKOUT_JOURNAL_DB": "off",
+    "CHECKOUT_IDEMPOTENCY_DB": "",
+    "CHECKOUT_CLIENT_IP_HEADER": "",
+    "SQUARE_WEBHOOK_SIGNATURE_KEY": "",
+    "STATIC_ROOT": "off",
+    "CATALOG_MERGED_PATH": "off",
+    "CATALOG_ARTIFACTS_DIR": "off",
+    "CATALOG_CHECK_INTERVAL": "0",
+}
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """The `app` module, imported once with APP_ENV and the fixture catalog."""
+    root = tmp_path_factory.mktemp("store")
+    catalog = root / "square_products_latest.json"
+    catalog.write_text(json.dumps(FIXTURE_CATALOG), encoding="utf-8")
+    mp = pytest.MonkeyPatch()
+    for name, value in dict(APP_ENV, CATALOG_PATH=str(catalog), METRICS_DIR=str(root / "metrics")).items():
+        mp.setenv(name, value)
+    import app
+    yield app
+    mp.undo()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
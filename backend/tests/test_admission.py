@@ -0,0 +1,139 @@
+"""Checkout admission control: token buckets, the concurrency cap, and their 429/503 answers."""
+import dataclasses
+import threading
+
+import pytest
+from flask import jsonify
+
+import admission
+import config
+from admission import ConcurrencyLimiter, RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", c)
+    return c
+
+
+def test_bucket_allows_burst_then_refills(clock):
+    limiter = RateLimiter(rate=0.5, burst=2)
+    assert limiter.acquire("a") == (True, 0)
+    assert limiter.acquire("a") == (True, 0)
+    assert limiter.acquire("a") == (False, 2)  # one token at 0.5/s
+    clock.now += 1
+    assert limiter.acquire("a") == (False, 1)
+    clock.now += 1
+    assert limiter.acquire("a") == (True, 0)
+    # Refill is capped at the burst.
+    clock.now += 60
+    assert [limiter.acquire("a")[0] for _ in range(3)] == [True, True, False]
+
+
+def test_buckets_are_per_client_and_bounded(clock):
+    limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+    assert limiter.acquire("a")[0] and limiter.acquire("b")[0]
+    assert not limiter.acquire("a")[0]
+    limiter.acquire("c")  # evicts the least recently used bucket ("b")
+    assert list(limiter._buckets) == ["a", "c"]
+
+
+def test_zero_rate_disables_limiter():
+    limiter = RateLimiter(rate=0, burst=1)
+    assert not limiter.enabled
+    assert all(limiter.acquire("a") == (True, 0) for _ in range(100))
+
+
+def test_concurrency_cap_turns_away_after_queue_timeout():
+    limiter = ConcurrencyLimiter(1, queue_timeout=0.01)
+    with limiter.slot() as first:
+        assert first
+        with limiter.slot() as second:
+            assert not second
+    with limiter.slot() as again:
+        assert again
+    assert limiter.retry_after == 1
+    assert ConcurrencyLimiter(1, queue_timeout=2.5).retry_after == 3
+
+
+def test_zero_limit_is_uncapped():
+    limiter = ConcurrencyLimiter(0)
+    with limiter.slot() as a, limiter.slot() as b:
+        assert a and b
+
+
+CHECKOUT = {"cart": [{"variation_id": "V-TEE-M", "quantity": 1}], "source_id": "cnon:ok"}
+
+
+@pytest.fixture
+def checkout_app(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "run_checkout", lambda payload, key: jsonify({"ok": True}))
+    return app_module
+
+
+def use_settings(monkeypatch, app_module, **changes):
+    settings = dataclasses.replace(config.get(), **changes)
+    monkeypatch.setattr(config, "_current", settings)
+    rate, slots = app_module._build_limiters(settings)
+    monkeypatch.setattr(app_module, "checkout_rate", rate)
+    monkeypatch.setattr(app_module, "checkout_slots", slots)
+
+
+def test_saturated_checkout_gets_503_with_retry_after(checkout_app, client, monkeypatch):
+    use_settings(monkeypatch, checkout_app, checkout_max_concurrent=1, checkout_queue_timeout=0.01)
+    held, done = threading.Event(), threading.Event()
+
+    def hold():
+        with checkout_app.checkout_slots.slot():
+            held.set()
+            done.wait(5)
+
+    t = threading.Thread(target=hold)
+    t.start()
+    held.wait(5)
+    try:
+        r = client.post("/api/square/checkout", json=CHECKOUT)
+    finally:
+        done.set()
+        t.join(5)
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+    assert r.get_json()["retry_after"] == 1
+    assert client.post("/api/square/checkout", json=CHECKOUT).status_code == 200
+
+
+def test_rate_limit_only_with_client_ip_header(checkout_app, client, monkeypatch):
+    # Without CHECKOUT_CLIENT_IP_HEADER every shopper shares the proxy's address: no limit.
+    use_settings(monkeypatch, checkout_app, checkout_client_header="", checkout_rate_burst=1)
+    assert not checkout_app.checkout_rate.enabled
+    assert [client.post("/api/square/checkout", json=CHECKOUT).status_code for _ in range(3)] == [200] * 3
+
+    use_settings(monkeypatch, checkout_app, checkout_client_header="CF-Connecting-IP", checkout_rate_burst=1,
+                 checkout_rate_per_min=6)
+    shopper = {"CF-Connecting-IP": "203.0.113.7, 10.0.0.1"}
+    assert client.post("/api/square/checkout", json=CHECKOUT, headers=shopper).status_code == 200
+    limited = client.post("/api/square/checkout", json=CHECKOUT, headers=shopper)
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == str(limited.get_json()["retry_after"])
+    assert 1 <= limited.get_json()["retry_after"] <= 10
+    other = {"CF-Connecting-IP": "198.51.100.2"}
+    assert client.post("/api/square/checkout", json=CHECKOUT, headers=other).status_code == 200
+
+
+def test_keyed_checkout_keeps_retry_after(checkout_app, client, monkeypatch):
+    use_settings(monkeypatch, checkout_app, checkout_client_header="CF-Connecting-IP", checkout_rate_burst=1,
+                 checkout_rate_per_min=6)
+    shopper = {"CF-Connecting-IP": "203.0.113.8"}
+    client.post("/api/square/checkout", json=CHECKOUT, headers=shopper)
+    r = client.post("/api/square/checkout", json=dict(CHECKOUT, checkout_key="k-429"), headers=shopper)
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) >= 1
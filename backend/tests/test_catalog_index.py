@@ -0,0 +1,101 @@
+"""CatalogIndex snapshots and the /api/catalog endpoint (filters, ETag/304, br/gzip)."""
+import gzip
+import json
+import os
+
+import brotli
+import pytest
+
+from catalog_index import CatalogIndex, CatalogSnapshot, accepted_encodings, pick_encoding
+from conftest import FIXTURE_CATALOG
+
+
+def product_ids(doc):
+    return [p["id"] for p in doc["products"]]
+
+
+def test_snapshot_lookups():
+    snap = CatalogSnapshot(FIXTURE_CATALOG, 0, 0)
+    assert snap.product("apex-tee")["name"] == "AeroVista Apex Tee"
+    v = snap.variation("V-HOODIE-XL")
+    assert (v.product_id, v.size, v.price_cents, v.orderable) == ("apex-hoodie", "XL", 4800, True)
+    assert snap.variation("nope") is None
+    assert snap.select("HOODIES") == [0]
+    assert snap.select(ids=["crewneck", "apex-tee", "missing"]) == [1, 4]
+    assert snap.select("tees", ["crewneck", "apex-tee"]) == [1]
+
+
+def test_body_is_the_document_and_cached():
+    snap = CatalogSnapshot(FIXTURE_CATALOG, 0, 0)
+    body = snap.body()
+    assert json.loads(body.raw) == FIXTURE_CATALOG
+    assert snap.body() is body
+    assert json.loads(snap.body("hats").raw)["count"] == 1
+    assert snap.body(ids=["b", "a"]) is snap.body(ids=["a", "b"])
+
+
+def test_index_reloads_on_change_and_keeps_snapshot_on_bad_file(tmp_path):
+    path = tmp_path / "catalog.json"
+    path.write_text(json.dumps(FIXTURE_CATALOG), encoding="utf-8")
+    index = CatalogIndex(str(path), check_interval=0)
+    first = index.snapshot()
+    assert index.snapshot() is first
+
+    doc = dict(FIXTURE_CATALOG, products=FIXTURE_CATALOG["products"][:2], count=2)
+    path.write_text(json.dumps(doc), encoding="utf-8")
+    assert len(index.snapshot().products) == 2
+
+    good = index.snapshot()
+    path.write_text("{not json", encoding="utf-8")
+    assert index.snapshot() is good
+
+
+def test_apply_patch_reuses_unchanged_fragments(tmp_path):
+    path = tmp_path / "catalog.json"
+    path.write_text(json.dumps(FIXTURE_CATALOG), encoding="utf-8")
+    index = CatalogIndex(str(path), check_interval=3600)
+    before = index.snapshot()
+    doc = json.loads(json.dumps(FIXTURE_CATALOG))
+    doc["products"][1]["price"] = 25.0
+    path.write_text(json.dumps(doc), encoding="utf-8")
+    st = os.stat(path)
+    index.apply_patch(doc, {"apex-tee"}, (before.mtime_ns, before.size), (st.st_mtime_ns, st.st_size))
+    after = index.snapshot()
+    assert after.product("apex-tee")["price"] == 25.0
+    assert after._fragments[0] is before._fragments[0]
+    assert after._fragments[1] is not before._fragments[1]
+
+
+def test_encoding_choice():
+    assert accepted_encodings("gzip;q=0.5, br , identity;q=0") == {"gzip": 0.5, "br": 1.0, "identity": 0.0}
+    assert pick_encoding("gzip, br") == "br"
+    assert pick_encoding("br;q=0, gzip") == "gzip"
+    assert pick_encoding("deflate") == pick_encoding("") == "identity"
+
+
+def test_catalog_endpoint_filters(client):
+    assert product_ids(client.get("/api/catalog").get_json()) == product_ids(FIXTURE_CATALOG)
+    assert product_ids(client.get("/api/catalog?category=Hats").get_json()) == ["trucker-cap"]
+    assert product_ids(client.get("/api/catalog?id=crewneck,apex-tee").get_json()) == ["apex-tee", "crewneck"]
+
+
+def test_catalog_etag_and_304(client):
+    r = client.get("/api/catalog?category=tees")
+    etag = r.headers["ETag"]
+    assert r.status_code == 200 and r.headers["Cache-Control"]
+    not_modified = client.get("/api/catalog?category=tees", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.data == b""
+    assert client.get("/api/catalog?category=hats", headers={"If-None-Match": etag}).status_code == 200
+
+
+@pytest.mark.parametrize("coding,decode", [("br", brotli.decompress), ("gzip", gzip.decompress)])
+def test_catalog_compression_negotiation(client, coding, decode):
+    plain = client.get("/api/catalog")
+    assert "Content-Encoding" not in plain.headers
+    r = client.get("/api/catalog", headers={"Accept-Encoding": f"{coding}, identity;q=0.5"})
+    assert r.headers["Content-Encoding"] == coding
+    assert "Accept-Encoding" in r.headers["Vary"]
+    assert decode(r.data) == plain.data
+    assert r.headers["ETag"] == plain.headers["ETag"][:-1] + f'-{coding}"'
+    assert client.get("/api/catalog", headers={"Accept-Encoding": coding,
+                                                "If-None-Match": r.headers["ETag"]}).status_code == 304
@@ -0,0 +1,180 @@
+"""Webhook signatures and incremental catalog patching (catalog_sync.py)."""
+import base64
+import copy
+import hashlib
+import hmac
+import json
+import logging
+
+from catalog_sync import CatalogChanges, CatalogSync, DerivedOutputs, patch_products, verify_signature
+
+KEY = "webhook-signature-key"
+URL = "https://store.example.com/api/square/webhook"
+BODY = b'{"type":"catalog.version.updated","event_id":"e1"}'
+
+PRODUCTS = [
+    {"id": "apex-hoodie", "name": "Apex Hoodie", "color": "Black", "category": "Hoodies", "price": 46.0,
+     "visibility": "visible", "description_text": "", "description_html": "",
+     "variants": [{"size": "M", "sku": "H-M", "price": 46.0, "variation_id": "V-M"},
+                  {"size": "XL", "sku": "H-XL", "price": 48.0, "variation_id": "V-XL"}]},
+    {"id": "cap", "name": "Trucker Cap", "color": "", "category": "Hats", "price": 28.0, "visibility": "visible",
+     "description_text": "", "description_html": "",
+     "variants": [{"size": "One Size", "sku": "CAP", "price": 28.0, "variation_id": "V-CAP"}]},
+]
+
+
+def sign(key, url, body):
+    return base64.b64encode(hmac.new(key.encode(), url.encode() + body, hashlib.sha256).digest()).decode()
+
+
+def variation(vid, item_id, name, cents, **extra):
+    return {"type": "ITEM_VARIATION", "id": vid, "updated_at": "2026-02-01T00:00:00Z", **extra,
+            "item_variation_data": {"item_id": item_id, "name": name, "sku": f"SKU-{vid}",
+                                    "price_money": {"amount": cents, "currency": "USD"}}}
+
+
+def test_good_signature_verifies():
+    assert verify_signature(KEY, URL, BODY, sign(KEY, URL, BODY))
+    assert verify_signature(KEY, URL, BODY, " " + sign(KEY, URL, BODY) + "\n")
+
+
+def test_bad_signature_rejected():
+    assert not verify_signature(KEY, URL, BODY, sign("other-key", URL, BODY))
+    assert not verify_signature(KEY, URL, BODY + b" ", sign(KEY, URL, BODY))
+    assert not verify_signature(KEY, URL, BODY, "")
+    assert not verify_signature(KEY, URL, BODY, "not base64 ✓")
+
+
+def test_wrong_notification_url_rejected():
+    # Square signs the URL as registered; a proxy-rewritten request URL must not verify.
+    assert not verify_signature(KEY, "http://127.0.0.1:5000/api/square/webhook", BODY, sign(KEY, URL, BODY))
+
+
+def test_patch_price_and_sku_for_known_variation():
+    products = copy.deepcopy(PRODUCTS)
+    ch = CatalogChanges.from_objects([variation("V-M", "ITEM-H", "Medium", 5000)])
+    out, changed = patch_products(products, ch)
+    assert changed == {"apex-hoodie"}
+    hoodie = out[0]
+    assert hoodie["variants"][0] == {"size": "Medium", "sku": "SKU-V-M", "price": 50.0, "variation_id": "V-M"}
+    assert hoodie["variants"][1] == PRODUCTS[0]["variants"][1]
+    assert hoodie["price"] == 50.0  # first non-zero variant price, as the converter sets it
+    assert out[1] == PRODUCTS[1]
+
+
+def test_unchanged_values_report_no_change():
+    ch = CatalogChanges.from_objects([variation("V-CAP", "ITEM-C", "One Size", 2800)])
+    products = copy.deepcopy(PRODUCTS)
+    products[1]["variants"][0]["sku"] = "SKU-V-CAP"
+    assert patch_products(products, ch)[1] == set()
+
+
+def test_unknown_object_id_is_skipped():
+    products = copy.deepcopy(PRODUCTS)
+    ch = CatalogChanges.from_objects([variation("V-NEW", "ITEM-UNKNOWN", "S", 1000),
+                                      {"type": "ITEM_VARIATION", "id": "V-GONE", "is_deleted": True}])
+    out, changed = patch_products(products, ch)
+    assert (out, changed) == (PRODUCTS, set())
+
+
+def test_deleted_variation_drops_product_without_variants():
+    products = copy.deepcopy(PRODUCTS)
+    out, changed = patch_products(products, CatalogChanges.from_objects(
+        [{"type": "ITEM_VARIATION", "id": "V-CAP", "is_deleted": True}]))
+    assert changed == {"cap"}
+    assert [p["id"] for p in out] == ["apex-hoodie"]
+
+
+class Response:
+    def __init__(self, body, status_code=200):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class StubSquare:
+    """SearchCatalogObjects returning `pages` in order; records each request body."""
+
+    def __init__(self, *pages):
+        self.pages = list(pages)
+        self.searches = []
+
+    def post(self, path, json=None, replayable=False):
+        assert path == "/v2/catalog/search" and replayable
+        self.searches.append(dict(json))
+        return Response(self.pages.pop(0) if self.pages else {"latest_time": json.get("begin_time", "")})
+
+
+def write_catalog(path, **meta):
+    doc = dict({"generated_at": "2026-01-01T00:00:00Z", "count": len(PRODUCTS), "products": PRODUCTS}, **meta)
+    path.write_text(json.dumps(doc), encoding="utf-8")
+    return str(path)
+
+
+def test_sync_starts_from_oldest_sync_point_and_advances(tmp_path):
+    a = write_catalog(tmp_path / "a.json", square_synced_at="2026-01-20T00:00:00Z")
+    b = write_catalog(tmp_path / "b.json")  # never synced: its generated_at is the sync point
+    square = StubSquare({"objects": [variation("V-M", "ITEM-H", "M", 5000)], "latest_time": "2026-02-01T00:00:00Z"})
+    patched = []
+    sync = CatalogSync(lambda: square, lambda: [a, b], on_patched=lambda path, doc, *rest: patched.append(path))
+
+    assert sync.sync_catalog() == {a: 1, b: 1}
+    assert square.searches[0]["begin_time"] == "2026-01-01T00:00:00Z"
+    assert patched == [a, b]
+    for path in (a, b):
+        with open(path, encoding="utf-8") as f:
+            doc = json.load(f)
+        assert doc["square_synced_at"] == "2026-02-01T00:00:00Z"
+        assert doc["products"][0]["variants"][0]["price"] == 50.0
+
+    sync.sync_catalog()
+    assert square.searches[1]["begin_time"] == "2026-02-01T00:00:00Z"
+
+
+def test_sync_point_never_moves_backwards(tmp_path):
+    # A file rewritten by an older full conversion must not rewind past what this process synced.
+    path = write_catalog(tmp_path / "a.json", square_synced_at="2026-01-20T00:00:00Z")
+    square = StubSquare({"objects": [], "latest_time": "2026-02-01T00:00:00Z"})
+    sync = CatalogSync(lambda: square, lambda: [path])
+    sync.sync_catalog()
+    write_catalog(tmp_path / "a.json", square_synced_at="2026-01-10T00:00:00Z")
+    sync.sync_catalog()
+    assert [s["begin_time"] for s in square.searches] == ["2026-01-20T00:00:00Z", "2026-02-01T00:00:00Z"]
+
+
+def test_derived_rebuild_skipped_without_converter(tmp_path, caplog):
+    derived = DerivedOutputs(str(tmp_path / "square_products_merged.json"), "", [str(tmp_path)])
+    with caplog.at_level(logging.WARNING, logger="catalog_sync"):
+        assert derived.rebuild({"products": PRODUCTS}) is False
+    assert "convert_catalog.py not found" in caplog.text
+    assert not (tmp_path / "square_products_merged.json").exists()
+    assert DerivedOutputs("", "", [str(tmp_path)]).rebuild({"products": PRODUCTS}) is False
+
+
+def inventory_event(event_id, *counts):
+    return {"type": "inventory.count.updated", "event_id": event_id, "data": {"object": {"inventory_counts": [
+        {"catalog_object_id": vid, "location_id": loc, "state": state, "quantity": qty} for vid, loc, state, qty in counts]}}}
+
+
+def test_inventory_events_go_to_on_counts_without_a_search():
+    square, received = StubSquare(), []
+    sync = CatalogSync(lambda: square, lambda: [], on_counts=received.extend)
+    sync.process([inventory_event("i1", ("V-M", "L1", "IN_STOCK", "3")),
+                  inventory_event("i2", ("V-XL", "L1", "IN_STOCK", "0"))])
+    assert [c["catalog_object_id"] for c in received] == ["V-M", "V-XL"]
+    assert square.searches == []
+    assert sync.submit(inventory_event("i1")) == "queued"
+    assert sync.submit(inventory_event("i1")) == "duplicate"
+    assert sync.submit({"type": "payment.updated"}) == "ignored"
+
+
+def test_webhook_counts_update_the_inventory_cache(app_module, client):
+    # Only IN_STOCK counts at the configured location count; Square is never asked (no server).
+    app_module.catalog_sync.process([inventory_event(
+        "i3", ("V-TEE-M", "TEST_LOCATION", "IN_STOCK", "7"), ("V-TEE-M", "OTHER", "IN_STOCK", "50"),
+        ("V-CAP", "TEST_LOCATION", "IN_STOCK", "2"), ("V-CAP", "TEST_LOCATION", "SOLD", "9"))])
+    r = client.get("/api/inventory?ids=V-TEE-M,V-CAP")
+    assert r.status_code == 200
+    assert r.get_json()["counts"] == {"V-TEE-M": 7, "V-CAP": 2}
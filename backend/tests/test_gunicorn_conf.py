@@ -0,0 +1,57 @@
+"""Smoke checks for gunicorn.conf.py: the settings gunicorn ends up with per worker mode."""
+import multiprocessing
+import os
+import runpy
+
+import pytest
+from gunicorn.config import Config
+
+CONF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn.conf.py")
+CPUS = multiprocessing.cpu_count()
+
+
+def load(monkeypatch, **env):
+    for name in list(os.environ):
+        if name.startswith("GUNICORN_"):
+            monkeypatch.delenv(name)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    ns = runpy.run_path(CONF)
+    # Feed the module through gunicorn's own validators, as `gunicorn -c` does.
+    cfg = Config()
+    for name, value in ns.items():
+        if name in cfg.settings:
+            cfg.set(name, value)
+    return ns, cfg
+
+
+def test_default_is_gevent_one_worker_per_cpu(monkeypatch):
+    ns, cfg = load(monkeypatch)
+    assert cfg.worker_class_str == "gevent"
+    assert cfg.worker_class.__name__ == "GeventWorker"
+    assert cfg.workers == CPUS
+    assert cfg.worker_connections == 1000
+    assert "threads" not in ns
+    assert cfg.preload_app is False
+    assert cfg.timeout == 120
+
+
+@pytest.mark.parametrize("worker_class", ["sync", "gthread"])
+def test_blocking_workers_scale_with_cpus(monkeypatch, worker_class):
+    _, cfg = load(monkeypatch, GUNICORN_WORKER_CLASS=worker_class)
+    assert cfg.worker_class_str == worker_class
+    assert cfg.workers == CPUS * 2 + 1
+
+
+def test_threads_only_for_gthread(monkeypatch):
+    ns, cfg = load(monkeypatch, GUNICORN_WORKER_CLASS="gthread", GUNICORN_THREADS="4")
+    assert cfg.threads == 4
+    ns, _ = load(monkeypatch, GUNICORN_WORKER_CLASS="gevent", GUNICORN_THREADS="4")
+    assert "threads" not in ns
+
+
+def test_env_overrides(monkeypatch):
+    _, cfg = load(monkeypatch, GUNICORN_WORKERS="3", GUNICORN_WORKER_CONNECTIONS="250", GUNICORN_TIMEOUT="45",
+                  APP_PORT="9000")
+    assert (cfg.workers, cfg.worker_connections, cfg.timeout) == (3, 250, 45)
+    assert cfg.bind == ["0.0.0.0:9000"]
@@ -0,0 +1,117 @@
+"""CheckoutDedupe and the Idempotency-Key handling in /api/square/checkout."""
+import json
+import threading
+import time
+
+import pytest
+from flask import jsonify
+
+from idempotency import CheckoutDedupe, KeyConflict
+
+OK = (200, b'{"ok":true}', "application/json")
+
+
+def run_concurrently(dedupe, n, fn, key="k1", fingerprint="fp"):
+    results = [None] * n
+
+    def call(i):
+        results[i] = dedupe.run(key, fingerprint, fn)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def test_concurrent_callers_share_one_result():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return OK
+
+    dedupe = CheckoutDedupe()
+    threads, results = run_concurrently(dedupe, 8, fn)
+    started.wait(5)
+    time.sleep(0.05)  # let the duplicates reach the wait
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert [r for r, _ in results] == [OK] * 8
+    assert sorted(replayed for _, replayed in results) == [False] + [True] * 7
+    # Later duplicates come from the LRU.
+    assert dedupe.run("k1", "fp", fn) == (OK, True)
+    assert len(calls) == 1
+
+
+def test_waiter_timeout_gets_409():
+    started, release = threading.Event(), threading.Event()
+    dedupe = CheckoutDedupe(wait_timeout=0.05)
+    threads, _ = run_concurrently(dedupe, 1, lambda: started.set() or release.wait(5) and OK)
+    started.wait(5)
+    (status, body, _), replayed = dedupe.run("k1", "fp", lambda: OK)
+    release.set()
+    threads[0].join(5)
+    assert (status, replayed) == (409, True)
+    assert json.loads(body)["ok"] is False
+
+
+def test_errors_are_not_cached():
+    dedupe = CheckoutDedupe()
+    assert dedupe.run("k1", "fp", lambda: (502, b"{}", "application/json")) == ((502, b"{}", "application/json"), False)
+    assert dedupe.run("k1", "fp", lambda: OK) == (OK, False)
+
+
+def test_key_reuse_for_other_request_conflicts():
+    dedupe = CheckoutDedupe()
+    dedupe.run("k1", "fp", lambda: OK)
+    with pytest.raises(KeyConflict):
+        dedupe.run("k1", "other", lambda: OK)
+
+
+def test_sqlite_store_replays_across_restarts(tmp_path):
+    db = str(tmp_path / "idempotency.db")
+    assert CheckoutDedupe(db_path=db).run("k1", "fp", lambda: OK) == (OK, False)
+    # A fresh instance (restart, or another worker) has an empty LRU but shares the store.
+    restarted = CheckoutDedupe(db_path=db)
+    assert restarted.run("k1", "fp", lambda: pytest.fail("checkout ran twice")) == (OK, True)
+    with pytest.raises(KeyConflict):
+        CheckoutDedupe(db_path=db).run("k1", "other", lambda: OK)
+
+
+CHECKOUT = {"checkout_key": "cart-123", "cart": [{"variation_id": "V-TEE-M", "quantity": 1}], "source_id": "cnon:ok"}
+
+
+@pytest.fixture
+def checkout_calls(app_module, monkeypatch):
+    """Replace the Square round trips with a counting stub that answers 200."""
+    calls = []
+
+    def run_checkout(payload, checkout_key):
+        calls.append(checkout_key)
+        return jsonify({"ok": True, "order_id": f"order-{len(calls)}"})
+
+    monkeypatch.setattr(app_module, "run_checkout", run_checkout)
+    return calls
+
+
+def test_checkout_replays_stored_result_after_restart(app_module, client, checkout_calls, monkeypatch, tmp_path):
+    db = str(tmp_path / "idempotency.db")
+    monkeypatch.setattr(app_module, "checkout_dedupe", CheckoutDedupe(db_path=db))
+    first = client.post("/api/square/checkout", json=CHECKOUT)
+    assert first.status_code == 200 and "Idempotent-Replayed" not in first.headers
+
+    monkeypatch.setattr(app_module, "checkout_dedupe", CheckoutDedupe(db_path=db))
+    again = client.post("/api/square/checkout", json=CHECKOUT, headers={"Idempotency-Key": "cart-123"})
+    assert again.status_code == 200
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert again.get_json() == first.get_json()
+    assert checkout_calls == ["cart-123"]
+
+    conflict = client.post("/api/square/checkout", json=dict(CHECKOUT, cart=[{"variation_id": "V-CAP", "quantity": 1}]))
+    assert conflict.status_code == 409
+    assert checkout_calls == ["cart-123"]
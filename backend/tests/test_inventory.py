@@ -0,0 +1,162 @@
+"""InventoryCache: TTL, stale-if-error, and coalescing of concurrent lookups into one Square call."""
+import threading
+import time
+
+import pytest
+
+import inventory
+from inventory import InventoryCache, InventoryUnavailable, add_counts
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(inventory.time, "monotonic", c)
+    return c
+
+
+class CountingFetch:
+    """Stands in for fetch_inventory: one call per batch, stock = `stock[vid]`."""
+
+    def __init__(self, stock=None, gate=None):
+        self.stock = stock or {}
+        self.gate = gate
+        self.calls = []
+        self.fail = False
+
+    def __call__(self, ids):
+        self.calls.append(list(ids))
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            raise RuntimeError("Square HTTP 503")
+        return {vid: self.stock.get(vid) for vid in ids}
+
+
+def test_entries_expire_after_ttl(clock):
+    fetch = CountingFetch({"a": 3.0})
+    cache = InventoryCache(fetch, ttl=30)
+    assert cache.get(["a", "b"]) == {"a": 3.0, "b": None}
+    clock.now += 29
+    fetch.stock["a"] = 1.0
+    assert cache.get(["b", "a"]) == {"b": None, "a": 3.0}
+    assert len(fetch.calls) == 1
+    clock.now += 1
+    assert cache.get(["a"]) == {"a": 1.0}
+    assert fetch.calls == [["a", "b"], ["a"]]
+
+
+def test_stale_entries_served_only_while_fetch_fails(clock):
+    fetch = CountingFetch({"a": 3.0})
+    cache = InventoryCache(fetch, ttl=30, stale_if_error=300)
+    cache.get(["a"])
+    fetch.fail = True
+    clock.now += 100
+    assert cache.get(["a"]) == {"a": 3.0}
+    clock.now += 200
+    with pytest.raises(InventoryUnavailable, match="503"):
+        cache.get(["a"])
+    with pytest.raises(InventoryUnavailable):
+        cache.get(["never-fetched"])
+
+
+def test_misses_fetched_in_batches(clock):
+    fetch = CountingFetch()
+    cache = InventoryCache(fetch, batch_size=2)
+    cache.get(["a", "b", "c", "a", "", "d", "e"])
+    assert fetch.calls == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def test_put_and_invalidate(clock):
+    fetch = CountingFetch({"a": 5.0})
+    cache = InventoryCache(fetch)
+    cache.put({"a": 2.0})
+    assert cache.get(["a"]) == {"a": 2.0} and fetch.calls == []
+    cache.invalidate(["a"])
+    assert cache.get(["a"]) == {"a": 5.0} and len(fetch.calls) == 1
+
+
+def test_concurrent_lookups_coalesce_into_one_call():
+    gate = threading.Event()
+    fetch = CountingFetch({"a": 1.0, "b": 2.0}, gate=gate)
+    lookups = []
+    cache = InventoryCache(fetch, on_lookup=lambda result, n: lookups.append((result, n)))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(["a", "b"]))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    while not fetch.calls:
+        time.sleep(0.001)
+    time.sleep(0.05)  # let the other lookups find the flight in progress
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert fetch.calls == [["a", "b"]]
+    assert results == [{"a": 1.0, "b": 2.0}] * 8
+    assert ("miss", 2) in lookups
+
+
+def test_add_counts_sums_in_stock_only():
+    body = {"counts": [{"catalog_object_id": "a", "state": "IN_STOCK", "quantity": "2"},
+                       {"catalog_object_id": "a", "state": "IN_STOCK", "quantity": "1.5"},
+                       {"catalog_object_id": "a", "state": "SOLD", "quantity": "9"},
+                       {"catalog_object_id": "x", "state": "IN_STOCK", "quantity": "4"}]}
+    assert add_counts({"a": None, "b": None}, body) == {"a": 3.5, "b": None}
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, body):
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class CountingSquare:
+    """A Square client stub: every BatchRetrieveInventoryCounts call is counted and held at `gate`."""
+
+    def __init__(self, gate):
+        self.gate = gate
+        self.calls = []
+
+    def post(self, path, json=None, replayable=False):
+        self.calls.append((path, list(json["catalog_object_ids"])))
+        self.gate.wait(5)
+        return Response({"counts": [{"catalog_object_id": vid, "location_id": "TEST_LOCATION", "state": "IN_STOCK",
+                                     "quantity": "4"} for vid in json["catalog_object_ids"]]})
+
+
+def test_concurrent_inventory_requests_make_one_square_call(app_module, client, monkeypatch):
+    gate = threading.Event()
+    square = CountingSquare(gate)
+    monkeypatch.setattr(app_module, "square_client", lambda env: square)
+    monkeypatch.setattr(app_module, "inventory_caches", app_module._build_inventory(app_module.config.get()))
+    results = []
+
+    def request():
+        results.append(app_module.app.test_client().get("/api/inventory?ids=V-HOODIE-M,V-HOODIE-XL"))
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for t in threads:
+        t.start()
+    while not square.calls:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert square.calls == [("/v2/inventory/counts/batch-retrieve", ["V-HOODIE-M", "V-HOODIE-XL"])]
+    assert [r.get_json()["counts"] for r in results] == [{"V-HOODIE-M": 4, "V-HOODIE-XL": 4}] * 6
+    # Fresh for the TTL: no further call.
+    assert client.get("/api/inventory?ids=V-HOODIE-XL").get_json()["counts"] == {"V-HOODIE-XL": 4}
+    assert len(square.calls) == 1
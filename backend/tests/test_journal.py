@@ -0,0 +1,73 @@
+"""CheckoutJournal + Reconciler: a same-key retry must not hide an open checkout from the reconciler."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import CheckoutJournal, Reconciler, redact_payment  # noqa: E402
+
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class StubSquare:
+    """An OPEN order with nothing paid against it; records every request."""
+
+    def __init__(self):
+        self.calls = []
+
+    def get(self, path, params=None):
+        self.calls.append(("GET", path))
+        if path == "/v2/payments":
+            return Response(200, {"payments": []})
+        return Response(200, {"order": {"id": "o1", "state": "OPEN", "version": 1, "location_id": "L",
+                                        "net_amount_due_money": {"amount": 4600, "currency": "USD"}}})
+
+    def put(self, path, body):
+        self.calls.append(("PUT", path))
+        return Response(200, {"order": {"id": "o1", "state": "CANCELED"}})
+
+
+def open_checkout(tmp_path):
+    j = CheckoutJournal(str(tmp_path / "journal.db"))
+    payment = {"idempotency_key": "k1", "source_id": "cnon:ok", "order_id": "o1", "location_id": "L",
+               "amount_money": {"amount": 4600, "currency": "USD"}}
+    assert j.record("c1", "started", "sandbox")
+    assert j.record("c1", "order_created", "sandbox", "o1", payment=redact_payment(payment))
+    assert j.record("c1", "payment_unknown", "sandbox", "o1")
+    return j
+
+
+def test_retry_does_not_downgrade_open_checkout(tmp_path):
+    j = open_checkout(tmp_path)
+    # The retry with the same checkout key then fails at CreateOrder.
+    assert not j.record("c1", "started", "sandbox")
+    assert not j.record("c1", "order_failed", "sandbox", error="CreateOrder HTTP 500")
+    assert j.latest("c1").state == "payment_unknown"
+    assert [e.checkout_id for e in j.pending(0)] == ["c1"]
+
+
+def test_pre_order_states_recorded_for_new_and_closed_checkouts(tmp_path):
+    j = CheckoutJournal(str(tmp_path / "journal.db"))
+    assert j.record("c2", "started", "sandbox")
+    assert j.record("c2", "order_failed", "sandbox")
+    assert j.record("c2", "started", "sandbox")
+    assert j.latest("c2").state == "started"
+    assert j.pending(0) == []
+
+
+def test_reconciler_resolves_checkout_after_failed_retry(tmp_path):
+    j = open_checkout(tmp_path)
+    j.record("c1", "started", "sandbox")
+    j.record("c1", "order_failed", "sandbox")
+    square = StubSquare()
+    assert Reconciler(j, lambda env: square, grace=0, retention=0).run_once() == {"canceled": 1}
+    assert ("PUT", "/v2/orders/o1") in square.calls
+    assert j.latest("c1").state == "canceled"
+    assert j.pending(0) == []
@@ -0,0 +1,82 @@
+"""Search ranking and tokenization (search_index.py) and the /api/search endpoint."""
+import gzip
+
+import brotli
+import pytest
+
+from conftest import FIXTURE_CATALOG
+from search_index import SearchIndex, tokenize
+
+PRODUCTS = FIXTURE_CATALOG["products"]
+
+
+def ids(query):
+    return [PRODUCTS[i]["id"] for i in SearchIndex(PRODUCTS).search(query)]
+
+
+def test_tokenize_lowercases_folds_accents_and_splits():
+    assert tokenize("Crème Brûlée T-Shirt (2XL)") == ["creme", "brulee", "t", "shirt", "2xl"]
+    assert tokenize("“Golden Eye Sigil”") == ["golden", "eye", "sigil"]
+    assert tokenize(None) == [] and tokenize("  --  ") == []
+
+
+def test_name_outranks_description_and_ties_sort_by_name():
+    # apex-tee: name + description; the hoodie and cap: name only, ordered by name.
+    assert ids("apex") == ["apex-tee", "apex-hoodie", "trucker-cap"]
+    assert ids("hoodie") == ["apex-hoodie", "apex-tee"]
+
+
+def test_prefix_typo_and_field_matches():
+    assert ids("hood") == ["apex-hoodie", "apex-tee"]
+    assert ids("hodoie") == ["apex-hoodie", "apex-tee"]
+    assert ids("heather") == ["crewneck"]  # color
+    assert ids("stickers") == ["sticker-pack"]  # category
+    assert ids("kangaroo") == ["apex-hoodie"]  # description
+
+
+def test_every_term_must_match():
+    assert ids("apex cap") == ["trucker-cap"]
+    assert ids("apex sticker") == []
+    assert ids("") == [] and ids("???") == []
+
+
+def test_identical_items_share_a_document():
+    sizes = [dict(PRODUCTS[0], id=f"hoodie-{s}") for s in ("m", "l", "xl")]
+    index = SearchIndex(sizes + PRODUCTS[1:])
+    assert len(index._members) == len(PRODUCTS)
+    assert index.search("pullover") == [0, 1, 2]
+
+
+def search(client, query, **headers):
+    return client.get(f"/api/search?{query}", headers=headers)
+
+
+def test_search_endpoint_pages_and_filters(client):
+    body = search(client, "q=apex&limit=2").get_json()
+    assert (body["total"], body["count"], body["limit"]) == (3, 2, 2)
+    assert [p["id"] for p in body["products"]] == ["apex-tee", "apex-hoodie"]
+    body = search(client, "q=apex&offset=2").get_json()
+    assert [p["id"] for p in body["products"]] == ["trucker-cap"]
+    body = search(client, "q=apex&category=hats").get_json()
+    assert [p["id"] for p in body["products"]] == ["trucker-cap"]
+    assert search(client, "q=apex&limit=x").status_code == 400
+
+
+def test_search_etag_and_304(client):
+    first = search(client, "q=hoodie")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and etag
+    assert search(client, "q=hoodie", **{"If-None-Match": etag}).status_code == 304
+    assert search(client, "q=hood", **{"If-None-Match": etag}).status_code == 200
+
+
+@pytest.mark.parametrize("coding,decode", [("br", brotli.decompress), ("gzip", gzip.decompress)])
+def test_search_compression_negotiation(client, coding, decode):
+    plain = search(client, "q=apex")
+    r = search(client, "q=apex", **{"Accept-Encoding": f"{coding}, identity;q=0.5"})
+    assert r.headers["Content-Encoding"] == coding
+    assert "Accept-Encoding" in r.headers["Vary"]
+    assert decode(r.data) == plain.data
+    assert r.headers["ETag"] != plain.headers["ETag"]
+    # A cached identity copy still revalidates against the compressed variant.
+    assert search(client, "q=apex", **{"Accept-Encoding": coding, "If-None-Match": plain.headers["ETag"]}).status_code == 304
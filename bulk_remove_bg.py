@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 import argparse
+import hashlib
 import io
 import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
-from PIL import Image, ImageFilter
-from rembg import remove
+from PIL import Image, ImageFilter, ImageOps
+from rembg import new_session, remove
 from tqdm import tqdm
 
+import image_derivatives
+
 IMG_EXTS = {".png", ".jpg", ".jpeg", ".webp"}
+DEFAULT_MODEL = "u2net"
+# Options that only change the PIL steps after the mask; changing them never re-runs rembg.
+POST_OPTIONS = ("square", "size", "trim", "matte")
+MANIFEST_VERSION = 1
+PROGRESS_LOG = "progress.jsonl"
+# Statuses that --resume treats as finished (errors are retried).
+DONE_STATUSES = ("ok", "skipped_exists", "skipped_cached")
+
+# (input, output, input sha256) handed to a worker.
+Job = Tuple[Path, Path, str]
 
 def iter_images(in_dir: Path) -> List[Path]:
     return sorted([p for p in in_dir.iterdir() if p.is_file() and p.suffix.lower() in IMG_EXTS])
@@ -38,9 +53,220 @@ def matte_expand_alpha(img: Image.Image, px: int) -> Image.Image:
     a2 = a.filter(ImageFilter.MaxFilter(size=px * 2 + 1))
     return Image.merge("RGBA", (r, g, b, a2))
 
-def remove_bg_bytes(data: bytes) -> Image.Image:
-    out = remove(data)  # bytes for PNG with alpha
-    return Image.open(io.BytesIO(out)).convert("RGBA")
+_sessions: Dict[str, Any] = {}
+
+def get_session(model: str):
+    # Loaded on first inference, then kept for the life of the process (one per worker).
+    s = _sessions.get(model)
+    if s is None:
+        s = _sessions[model] = new_session(model)
+    return s
+
+def load_image(data: bytes) -> Image.Image:
+    # Same orientation fix rembg applies, so cached masks line up with the pixels.
+    return ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+
+def compute_mask(img: Image.Image, model: str, max_side: int = 0) -> Image.Image:
+    if max_side <= 0 or max(img.size) <= max_side:
+        return remove(img, session=get_session(model), only_mask=True).convert("L")
+    # Infer on a bounded copy (rembg models run at ~320-1024px anyway) and scale the mask
+    # back up, so memory per worker depends on max_side rather than the photo size.
+    small = img.copy()
+    small.thumbnail((max_side, max_side), resample=Image.LANCZOS)
+    mask = remove(small, session=get_session(model), only_mask=True).convert("L")
+    return mask.resize(img.size, resample=Image.LANCZOS)
+
+def mask_variant(model: str, max_side: int) -> str:
+    # Cache namespace: masks inferred at a capped resolution differ from full-size ones.
+    return f"{model}-max{max_side}" if max_side > 0 else model
+
+def apply_mask(img: Image.Image, mask: Image.Image) -> Image.Image:
+    # rembg's default cutout: source pixels where the mask is set, transparent black elsewhere.
+    return Image.composite(img.convert("RGBA"), Image.new("RGBA", img.size, 0), mask)
+
+class MaskCache:
+    """Raw rembg masks stored as grayscale PNGs, keyed by source content hash and model."""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path(self, src_hash: str, model: str) -> Path:
+        return self.root / model / f"{src_hash}.png"
+
+    def load(self, src_hash: str, model: str) -> Optional[Image.Image]:
+        p = self.path(src_hash, model)
+        try:
+            with Image.open(p) as m:
+                return m.convert("L")
+        except (OSError, ValueError):
+            return None
+
+    def store(self, src_hash: str, model: str, mask: Image.Image) -> None:
+        p = self.path(src_hash, model)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+        mask.save(tmp, format="PNG")
+        os.replace(tmp, p)
+
+def postprocess(img: Image.Image, opts: Dict[str, Any]) -> Image.Image:
+    if opts["matte"] > 0:
+        img = matte_expand_alpha(img, opts["matte"])
+    if opts["trim"]:
+        img = trim_transparent(img)
+    if opts["square"]:
+        img = pad_to_square(img)
+    if opts["size"] and opts["size"] > 0:
+        img = img.resize((opts["size"], opts["size"]), resample=Image.LANCZOS)
+    return img
+
+def process_file(job: Job, opts: Dict[str, Any]) -> Dict[str, Any]:
+    src, out_path, src_hash = job
+    item: Dict[str, Any] = {"input": str(src), "output": str(out_path), "source_sha256": src_hash}
+    try:
+        img = load_image(src.read_bytes())
+        cache = MaskCache(Path(opts["cache_dir"])) if opts["cache_dir"] else None
+        variant = mask_variant(opts["model"], opts["max_side"])
+        mask = cache.load(src_hash, variant) if cache and not opts["overwrite"] else None
+        item["mask"] = "cached" if mask is not None else "computed"
+        if mask is None:
+            mask = compute_mask(img, opts["model"], opts["max_side"])
+            if cache:
+                cache.store(src_hash, variant, mask)
+        img = postprocess(apply_mask(img, mask), opts)
+        img.save(out_path, format="PNG", optimize=True)
+        if opts["derivatives"]:
+            # Encode the responsive sizes from the image already in memory (no re-decode).
+            entry = image_derivatives.write_derivatives(img, out_path.stem, Path(opts["derivatives"]),
+                                                        formats=opts["derivative_formats"])
+            entry.update(source_sha256=file_sha256(out_path), settings=opts["derivative_settings"])
+            item["derivatives"] = entry
+        item.update(status="ok", out_size=img.size)
+    except Exception as e:
+        item.update(status="error", error=repr(e))
+    return item
+
+def ensure_derivatives(out_path: Path, derived: Dict[str, Any], out_dir: Path, opts: Dict[str, Any]) -> bool:
+    """Encode derivatives of an existing output unless its manifest entry is current (same
+    output hash and settings, files present). Returns True if it encoded."""
+    src_hash = file_sha256(out_path)
+    if image_derivatives.entry_is_current(derived.get(out_path.name), src_hash, opts["derivative_settings"], out_dir):
+        return False
+    with Image.open(out_path) as img:
+        img.load()
+        entry = image_derivatives.write_derivatives(img, out_path.stem, out_dir, formats=opts["derivative_formats"])
+    entry.update(source_sha256=src_hash, settings=opts["derivative_settings"])
+    derived[out_path.name] = entry
+    return True
+
+def run_serial(jobs: List[Job], opts: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    for job in jobs:
+        yield process_file(job, opts)
+
+# Per-process options for --workers; each worker keeps its own rembg session (get_session).
+_worker_opts: Optional[Dict[str, Any]] = None
+
+def _worker_init(opts: Dict[str, Any], threads: int) -> None:
+    global _worker_opts
+    # rembg sizes the ONNX Runtime thread pools from OMP_NUM_THREADS; split the cores
+    # between workers instead of letting every worker grab all of them.
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    _worker_opts = opts
+
+def _worker_run(job: Job) -> Dict[str, Any]:
+    return process_file(job, _worker_opts)
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ProgressLog:
+    """Append-only JSONL of finished files, flushed per record so a crash loses at most the
+    files in flight. The first line records the run settings; `--resume` reuses the finished
+    records of a run with the same settings instead of redoing those files."""
+
+    def __init__(self, path: Path, settings: Dict[str, Any], resume: bool):
+        self.path = path
+        self.done: Dict[str, Dict[str, Any]] = {}
+        if resume and path.exists():
+            header = None
+            for rec in read_jsonl(path):
+                if rec.get("type") == "run":
+                    header = rec
+                elif rec.get("status") in DONE_STATUSES:
+                    self.done[rec["input"]] = rec
+                else:
+                    self.done.pop(rec.get("input"), None)
+            if header is not None and header.get("settings") != settings:
+                raise SystemExit(f"--resume: {path} was written with different settings {header.get('settings')}; "
+                                 "rerun without --resume")
+            self._f = path.open("a", encoding="utf-8")
+        else:
+            self._f = path.open("w", encoding="utf-8")
+            self.write({"type": "run", "settings": settings})
+
+    def write(self, rec: Dict[str, Any]) -> None:
+        self._f.write(json.dumps(rec) + "\n")
+        self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+def read_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # torn last line from a crash
+
+def write_report(path: Path, header: Dict[str, Any], log_path: Path) -> None:
+    # Last record per input wins (a resumed run may retry an earlier error); input order.
+    items: Dict[str, Dict[str, Any]] = {}
+    for rec in read_jsonl(log_path):
+        if rec.get("type") != "run":
+            rec.pop("derivatives", None)
+            items[rec["input"]] = rec
+    report = {**header, "items": [items[k] for k in sorted(items)]}
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+def load_manifest(path: Path) -> Dict[str, Any]:
+    try:
+        doc = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return doc.get("items", {}) if doc.get("version") == MANIFEST_VERSION else {}
+
+def write_manifest(path: Path, items: Dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({"version": MANIFEST_VERSION, "items": items}, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+def run_parallel(jobs: List[Job], opts: Dict[str, Any], workers: int) -> Iterator[Dict[str, Any]]:
+    """Yield results as workers finish. At most 2 jobs per worker are queued, so reading,
+    decoding and PNG encoding in one worker overlap inference in the others without
+    piling every file into the pool's queue."""
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    pending_jobs = iter(jobs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init, initargs=(opts, threads)) as pool:
+        inflight = set()
+        def fill() -> None:
+            while len(inflight) < workers * 2:
+                job = next(pending_jobs, None)
+                if job is None:
+                    return
+                inflight.add(pool.submit(_worker_run, job))
+        fill()
+        while inflight:
+            done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+            fill()
 
 def main():
     ap = argparse.ArgumentParser(description="Bulk remove image backgrounds using rembg and write transparent PNGs.")
@@ -51,6 +277,17 @@ def main():
     ap.add_argument("--trim", action="store_true")
     ap.add_argument("--matte", type=int, default=0)
     ap.add_argument("--overwrite", action="store_true")
+    ap.add_argument("--model", default=DEFAULT_MODEL, help="rembg model name (u2net, isnet-general-use, ...)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="worker processes, each with its own rembg session (default: 1, in-process)")
+    ap.add_argument("--max-side", type=int, default=0,
+                    help="run inference on a copy no larger than this many px; the mask is scaled back up")
+    ap.add_argument("--resume", action="store_true",
+                    help=f"continue an interrupted run from <out>/{PROGRESS_LOG} (same settings only)")
+    ap.add_argument("--derivatives", default="",
+                    help="also write AVIF/WebP/PNG size variants + manifest.json here (see image_derivatives.py)")
+    ap.add_argument("--cache-dir", default="",
+                    help="mask cache + manifest directory (default: <out>/.rembg-cache, 'off' to disable)")
     args = ap.parse_args()
 
     in_dir = Path(args.in_dir).resolve()
@@ -61,35 +298,93 @@ def main():
     if not files:
         raise SystemExit(f"No images found in {in_dir} (supported: {', '.join(sorted(IMG_EXTS))})")
 
-    report: Dict[str, Any] = {
+    header: Dict[str, Any] = {
         "in_dir": str(in_dir),
         "out_dir": str(out_dir),
         "count": len(files),
         "options": vars(args),
-        "items": []
     }
 
-    for p in tqdm(files, desc="Removing background"):
-        out_path = out_dir / (p.stem + ".png")
-        if out_path.exists() and not args.overwrite:
-            report["items"].append({"input": str(p), "output": str(out_path), "status": "skipped_exists"})
-            continue
-        try:
-            img = remove_bg_bytes(p.read_bytes())
-            if args.matte > 0:
-                img = matte_expand_alpha(img, args.matte)
-            if args.trim:
-                img = trim_transparent(img)
-            if args.square:
-                img = pad_to_square(img)
-            if args.size and args.size > 0:
-                img = img.resize((args.size, args.size), resample=Image.LANCZOS)
-            img.save(out_path, format="PNG", optimize=True)
-            report["items"].append({"input": str(p), "output": str(out_path), "status": "ok", "out_size": img.size})
-        except Exception as e:
-            report["items"].append({"input": str(p), "output": str(out_path), "status": "error", "error": repr(e)})
-
-    (out_dir / "report.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    cache_dir = None if args.cache_dir.lower() == "off" else Path(args.cache_dir or out_dir / ".rembg-cache").resolve()
+    manifest_path = cache_dir / "manifest.json" if cache_dir else None
+    manifest = load_manifest(manifest_path) if manifest_path else {}
+    post = {k: getattr(args, k) for k in POST_OPTIONS}
+    derivatives_dir = Path(args.derivatives).resolve() if args.derivatives else None
+    opts = {**post, "model": args.model, "max_side": args.max_side, "overwrite": args.overwrite,
+            "cache_dir": str(cache_dir or ""),
+            "derivatives": str(derivatives_dir or ""),
+            "derivative_formats": image_derivatives.supported_formats(image_derivatives.DEFAULT_FORMATS)}
+    opts["derivative_settings"] = image_derivatives.settings_key(
+        image_derivatives.DEFAULT_WIDTHS, opts["derivative_formats"], image_derivatives.FALLBACK_WIDTH)
+    derived = image_derivatives.load_manifest(derivatives_dir / "manifest.json") if derivatives_dir else {}
+
+    def record(item: Dict[str, Any]) -> None:
+        if "derivatives" in item:
+            derived[Path(item["output"]).name] = item["derivatives"]
+        if manifest_path and item["status"] == "ok" and "out_size" in item:
+            manifest[Path(item["input"]).name] = {
+                "source_sha256": item["source_sha256"], "model": args.model, "max_side": args.max_side,
+                "options": post, "output": Path(item["output"]).name, "out_size": list(item["out_size"]),
+            }
+
+    log_path = out_dir / PROGRESS_LOG
+    log = ProgressLog(log_path, {**post, "model": args.model, "max_side": args.max_side}, args.resume)
+    jobs: List[Job] = []
+    # Outputs not re-processed this run; their derivatives are checked after the batch.
+    kept: List[Path] = []
+    try:
+        with tqdm(total=len(files), desc="Removing background") as bar:
+            for p in files:
+                out_path = out_dir / (p.stem + ".png")
+                done = log.done.get(str(p))
+                if done is not None and out_path.exists():
+                    record(done)  # finished before the interruption; its record is already logged
+                    kept.append(out_path)
+                    bar.update(1)
+                    continue
+                if not manifest_path:
+                    # No manifest to compare against: the old "output exists" rule.
+                    if out_path.exists() and not args.overwrite:
+                        log.write({"input": str(p), "output": str(out_path), "status": "skipped_exists"})
+                        kept.append(out_path)
+                        bar.update(1)
+                    else:
+                        jobs.append((p, out_path, ""))
+                    continue
+                src_hash = file_sha256(p)
+                prev = manifest.get(p.name) or {}
+                if (not args.overwrite and out_path.exists() and prev.get("source_sha256") == src_hash
+                        and prev.get("model") == args.model and prev.get("max_side", 0) == args.max_side
+                        and prev.get("options") == post):
+                    log.write({"input": str(p), "output": str(out_path), "status": "skipped_cached"})
+                    kept.append(out_path)
+                    bar.update(1)
+                else:
+                    jobs.append((p, out_path, src_hash))
+
+            workers = max(1, min(args.workers, len(jobs)))
+            results = run_parallel(jobs, opts, workers) if workers > 1 else run_serial(jobs, opts)
+            for item in results:
+                log.write(item)
+                record(item)
+                bar.update(1)
+
+        if derivatives_dir and kept:
+            for out_path in tqdm(kept, desc="Derivatives"):
+                try:
+                    ensure_derivatives(out_path, derived, derivatives_dir, opts)
+                except (OSError, ValueError) as e:
+                    tqdm.write(f"⚠️  {out_path.name}: derivatives failed ({e!r})")
+    finally:
+        log.close()
+        # Keep what finished even if the run was interrupted.
+        if manifest_path:
+            write_manifest(manifest_path, manifest)
+        if derivatives_dir:
+            derivatives_dir.mkdir(parents=True, exist_ok=True)
+            image_derivatives.write_manifest(derivatives_dir, derived)
+
+    write_report(out_dir / "report.json", header, log_path)
     print(f"✅ Done. Outputs in: {out_dir}")
     print(f"🧾 Report: {out_dir / 'report.json'}")
 
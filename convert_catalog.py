@@ -1,11 +1,21 @@
+import argparse
+import csv
+import gzip
+import hashlib
+import io
 import json
 import os
 import re
 import sys
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
 
-from openpyxl import load_workbook
+from scripts.normalize_categories import CategoryClassifier
+
+try:
+    import brotli  # optional: adds .br siblings next to the .gz artifacts
+except ImportError:
+    brotli = None
 
 
 def _cell_str(v: Any) -> str:
@@ -42,39 +52,115 @@ def _extract_date_from_filename(path: str) -> Optional[str]:
     return m.group(1) if m else None
 
 
-def _find_header_row(ws) -> Tuple[int, List[str]]:
+# Columns the converter reads; everything else in the export is ignored while streaming.
+ITEM_COLUMNS = (
+    "Reference Handle",
+    "Token",
+    "SKU",
+    "Variation Name",
+    "Option Value 1",
+    "Item Name",
+    "Description",
+    "Reporting Category",
+    "Categories",
+    "Square Online Item Visibility",
+    "Shipping Enabled",
+    "Price",
+    "Online Sale Price",
+)
+HEADER_SCAN_ROWS = 24
+
+
+class ItemRow(NamedTuple):
+    reference_handle: Any
+    token: Any
+    sku: Any
+    variation_name: Any
+    option_value_1: Any
+    item_name: Any
+    description: Any
+    reporting_category: Any
+    categories: Any
+    visibility: Any
+    shipping_enabled: Any
+    price: Any
+    online_sale_price: Any
+
+
+def _is_header(values: Sequence[Any]) -> bool:
+    return any(_cell_str(v).lower() == "reference handle" for v in values)
+
+
+def _column_index(headers: Sequence[Any]) -> List[Optional[int]]:
+    """Map ITEM_COLUMNS to positions in the header row (last duplicate wins, None if absent)."""
+    pos: Dict[str, int] = {}
+    for i, h in enumerate(headers):
+        h = _cell_str(h)
+        if h:
+            pos[h] = i
+    return [pos.get(name) for name in ITEM_COLUMNS]
+
+
+def _iter_item_rows(rows: Iterable[Sequence[Any]]) -> Iterator[ItemRow]:
     """
-    Square export files often have a blank first row. Find the first row that contains
-    'Reference Handle' and use it as the header row.
+    Single pass over raw sheet rows. Square export files often have a blank first row, so
+    the header is the first row (within HEADER_SCAN_ROWS) containing 'Reference Handle'.
+    Data rows are projected onto ITEM_COLUMNS; rows without a handle are dropped.
     """
-    for r in range(1, 25):
-        values = [c.value for c in next(ws.iter_rows(min_row=r, max_row=r))]
-        if any(_cell_str(v).lower() == "reference handle" for v in values):
-            headers = [_cell_str(v) for v in values]
-            return r, headers
-    raise RuntimeError("Unable to locate header row (expected 'Reference Handle').")
+    it = iter(rows)
+    index: Optional[List[Optional[int]]] = None
+    for _, values in zip(range(HEADER_SCAN_ROWS), it):
+        if values and _is_header(values):
+            index = _column_index(values)
+            break
+    if index is None:
+        raise RuntimeError("Unable to locate header row (expected 'Reference Handle').")
+
+    handle_at = index[0]
+    for row in it:
+        if not row or handle_at is None or handle_at >= len(row):
+            continue
+        if not _cell_str(row[handle_at]):
+            continue
+        n = len(row)
+        yield ItemRow._make(row[i] if i is not None and i < n else None for i in index)
 
 
-def _parse_items_sheet(xlsx_path: str) -> List[Dict[str, Any]]:
+def _iter_xlsx_rows(xlsx_path: str) -> Iterator[ItemRow]:
+    # Imported here so the API can reuse the merge/artifact code without openpyxl installed.
+    from openpyxl import load_workbook
+
     wb = load_workbook(xlsx_path, read_only=True, data_only=True)
-    ws = wb["Items"] if "Items" in wb.sheetnames else wb[wb.sheetnames[0]]
+    try:
+        ws = wb["Items"] if "Items" in wb.sheetnames else wb[wb.sheetnames[0]]
+        yield from _iter_item_rows(ws.iter_rows(values_only=True))
+    finally:
+        wb.close()
 
-    header_row, headers = _find_header_row(ws)
-    rows = ws.iter_rows(min_row=header_row + 1, values_only=True)
 
-    out_rows: List[Dict[str, Any]] = []
-    for row in rows:
-        if not row or all(v is None for v in row):
-            continue
-        d = {}
-        for i, h in enumerate(headers):
-            if not h:
-                continue
-            if i < len(row):
-                d[h] = row[i]
-        if _cell_str(d.get("Reference Handle")):
-            out_rows.append(d)
-    return out_rows
+def _sniff_delimiter(first_line: str, path: str) -> str:
+    if path.lower().endswith(".tsv"):
+        return "\t"
+    return "\t" if first_line.count("\t") > first_line.count(",") else ","
+
+
+def _iter_csv_rows(csv_path: str) -> Iterator[ItemRow]:
+    # Square CSV exports are UTF-8 with a BOM; empty cells come through as "".
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        # The first non-blank line (normally the header) decides comma vs tab.
+        first = next((line for line in f.read(65536).splitlines() if line.strip()), "")
+        f.seek(0)
+        yield from _iter_item_rows(csv.reader(f, delimiter=_sniff_delimiter(first, csv_path)))
+
+
+def export_format(path: str) -> str:
+    """'xlsx' for Excel workbooks (zip container), otherwise 'csv' (comma or tab separated)."""
+    with open(path, "rb") as f:
+        return "xlsx" if f.read(4) == b"PK\x03\x04" else "csv"
+
+
+def iter_export_rows(path: str) -> Iterator[ItemRow]:
+    return _iter_xlsx_rows(path) if export_format(path) == "xlsx" else _iter_csv_rows(path)
 
 
 def _name_and_color(item_name: str) -> Tuple[str, str]:
@@ -87,46 +173,47 @@ def _name_and_color(item_name: str) -> Tuple[str, str]:
     return base, color
 
 
-def build_catalog(xlsx_path: str) -> Dict[str, Any]:
-    rows = _parse_items_sheet(xlsx_path)
+class CatalogBuilder:
+    """Folds item rows into products incrementally; memory grows with products, not rows."""
 
-    products_by_id: Dict[str, Dict[str, Any]] = {}
+    def __init__(self) -> None:
+        self.products_by_id: Dict[str, Dict[str, Any]] = {}
 
-    for r in rows:
-        ref_handle = _cell_str(r.get("Reference Handle"))
+    def add(self, r: ItemRow) -> None:
+        ref_handle = _cell_str(r.reference_handle)
         if not ref_handle.startswith("#"):
             # Skip non-handle rows (defensive).
-            continue
+            return
         handle = ref_handle.lstrip("#").strip()
         if not handle:
-            continue
+            return
 
         # Variation rows end with `--<option>` (e.g. `--s`).
         base_id = handle.split("--")[0].strip()
         if not base_id:
-            continue
+            return
 
-        token = _cell_str(r.get("Token"))
-        sku = _cell_str(r.get("SKU"))
-        variation_name = _cell_str(r.get("Variation Name"))
-        opt1 = _cell_str(r.get("Option Value 1"))
+        token = _cell_str(r.token)
+        sku = _cell_str(r.sku)
+        variation_name = _cell_str(r.variation_name)
+        opt1 = _cell_str(r.option_value_1)
         size = variation_name or opt1 or "One Size"
 
-        item_name = _cell_str(r.get("Item Name"))
+        item_name = _cell_str(r.item_name)
         base_name, color = _name_and_color(item_name)
 
-        desc = _cell_str(r.get("Description"))
+        desc = _cell_str(r.description)
         desc_html = desc if ("<" in desc and ">" in desc) else (f"<p>{desc}</p>" if desc else "")
         desc_text = _strip_html(desc_html) if desc_html else _strip_html(desc)
 
-        category = _cell_str(r.get("Reporting Category")) or _cell_str(r.get("Categories")) or ""
-        visibility = _cell_str(r.get("Square Online Item Visibility")) or ""
-        shipping_enabled = _cell_str(r.get("Shipping Enabled")) or ""
+        category = _cell_str(r.reporting_category) or _cell_str(r.categories) or ""
+        visibility = _cell_str(r.visibility) or ""
+        shipping_enabled = _cell_str(r.shipping_enabled) or ""
 
-        price = _to_float(r.get("Price"))
-        variant_price = price if price else _to_float(r.get("Online Sale Price"))
+        price = _to_float(r.price)
+        variant_price = price if price else _to_float(r.online_sale_price)
 
-        p = products_by_id.get(base_id)
+        p = self.products_by_id.get(base_id)
         if not p:
             p = {
                 "id": base_id,
@@ -140,7 +227,7 @@ def build_catalog(xlsx_path: str) -> Dict[str, Any]:
                 "description_html": desc_html,
                 "variants": [],
             }
-            products_by_id[base_id] = p
+            self.products_by_id[base_id] = p
 
         # Prefer first non-empty metadata across rows.
         if not p.get("color") and color:
@@ -168,57 +255,406 @@ def build_catalog(xlsx_path: str) -> Dict[str, Any]:
             variant["variation_id"] = token
         p["variants"].append(variant)
 
-    products = sorted(products_by_id.values(), key=lambda x: x.get("id", ""))
+    def finish(self, source: str) -> Dict[str, Any]:
+        products = sorted(self.products_by_id.values(), key=lambda x: x.get("id", ""))
+        return {
+            "generated_from": source,
+            "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
+            "count": len(products),
+            "products": products,
+        }
+
+
+def build_catalog(export_path: str) -> Dict[str, Any]:
+    """Convert a Square catalog export (.xlsx, or .csv/.tsv) into the storefront JSON."""
+    fmt = export_format(export_path)
+    builder = CatalogBuilder()
+    for row in iter_export_rows(export_path):
+        builder.add(row)
+    kind = "Excel" if fmt == "xlsx" else "CSV"
+    return builder.finish(f"Square catalog export {kind} ({os.path.basename(export_path)})")
+
+
+# ---- Variant merge: one product per item name (what the storefront shows as one card) ----
+SIZE_ORDER = ("XXS", "XS", "S", "M", "L", "XL", "2XL", "3XL", "4XL", "5XL")
+_SIZE_RANK = {s: i for i, s in enumerate(SIZE_ORDER)}
+_SIZE_RANK["XXL"] = _SIZE_RANK["2XL"]
+_QUOTES = str.maketrans({"\u201c": '"', "\u201d": '"', "\u201e": '"', "\u2018": "'", "\u2019": "'"})
+MERGE_REPORT_COLUMNS = ("name", "category", "original_items", "original_variants_total", "merged_variants", "winner_id")
+
+
+def merge_key(name: str) -> str:
+    """Grouping key: lowercase, straight quotes, collapsed whitespace (same as the storefront)."""
+    return re.sub(r"\s+", " ", (name or "").translate(_QUOTES).lower()).strip()
+
+
+def _size_rank(size: str) -> int:
+    return _SIZE_RANK.get(size.strip().upper(), len(SIZE_ORDER))
+
+
+def _variant_color_size(product_color: str, size: str) -> Tuple[str, str]:
+    # Items without a "(Color)" name suffix encode it in the variation instead: "Black, 2XL".
+    if not product_color and "," in size:
+        color, _, sz = size.rpartition(",")
+        return color.strip(), sz.strip() or "One Size"
+    return product_color, size
+
+
+def _winner_rank(p: Dict[str, Any]) -> Tuple[Any, ...]:
+    # Most complete metadata wins; then the smallest size, then id for a stable pick.
+    variants = p.get("variants") or [{}]
+    size = _variant_color_size(p.get("color", ""), variants[0].get("size", ""))[1]
+    return (not p.get("description_html"), not p.get("price"), not p.get("category"), _size_rank(size), p.get("id", ""))
+
+
+def _merged_id(winner: Dict[str, Any]) -> str:
+    # Per-size items are exported as `<item>-<size>`; drop that suffix for the merged id.
+    pid = winner.get("id", "")
+    variants = winner.get("variants") or []
+    if len(variants) == 1:
+        size = _variant_color_size(winner.get("color", ""), variants[0].get("size", ""))[1]
+        suffix = "-" + size.strip().lower()
+        if size.strip().upper() in _SIZE_RANK and pid.lower().endswith(suffix) and len(pid) > len(suffix):
+            return pid[: -len(suffix)]
+    return pid
+
+
+def merge_variants(
+    products: List[Dict[str, Any]],
+    classify: Optional[Callable[[Iterable[Dict[str, Any]]], Iterable[Dict[str, Any]]]] = None,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Group products by `merge_key(name)` in one pass, pick a winner per group for the
+    product-level fields, and fold every variant in (tagged with its color) ordered by
+    color then size. Variants repeating a (color, size) pair are dropped, the winner's
+    first. `classify` (e.g. `CategoryClassifier().classify_batch`) streams the merged
+    products through to set their storefront category. Returns (merged products sorted
+    by id, report rows).
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for p in products:
+        groups.setdefault(merge_key(p.get("name", "")) or p.get("id", ""), []).append(p)
+
+    merged: List[Dict[str, Any]] = []
+    report: List[Dict[str, Any]] = []
+    for group in groups.values():
+        winner = min(group, key=_winner_rank)
+        rows = []
+        for p in group:
+            for seq, v in enumerate(p.get("variants") or []):
+                color, size = _variant_color_size(p.get("color", ""), v.get("size", ""))
+                out_v: Dict[str, Any] = {"color": color, "size": size, "sku": v.get("sku", ""), "price": v.get("price", 0.0)}
+                if v.get("variation_id"):
+                    out_v["variation_id"] = v["variation_id"]
+                rows.append(((color.lower(), _size_rank(size), p is not winner, seq), out_v))
+        rows.sort(key=lambda r: r[0])
+
+        seen = set()
+        variants = []
+        for _, v in rows:
+            key = (v["color"].lower(), v["size"].lower())
+            if key not in seen:
+                seen.add(key)
+                variants.append(v)
+
+        def first(field: str) -> Any:
+            return winner.get(field) or next((p[field] for p in group if p.get(field)), winner.get(field))
+
+        colors = {v["color"] for v in variants}
+        merged.append({
+            "id": _merged_id(winner),
+            "name": winner.get("name", ""),
+            "color": colors.pop() if len(colors) == 1 else "",
+            "category": first("category"),
+            "price": first("price"),
+            "visibility": winner.get("visibility", ""),
+            "shipping_enabled": first("shipping_enabled"),
+            "description_text": first("description_text"),
+            "description_html": first("description_html"),
+            "variants": variants,
+        })
+        report.append({
+            "name": winner.get("name", ""),
+            "category": first("category"),
+            "original_items": len(group),
+            "original_variants_total": sum(len(p.get("variants") or []) for p in group),
+            "merged_variants": len(variants),
+            "winner_id": winner.get("id", ""),
+        })
+
+    if classify is not None:
+        for p, row in zip(classify(merged), report):
+            row["category"] = p["category"]
+    merged.sort(key=lambda p: p["id"])
+    report.sort(key=lambda r: (-r["original_items"], r["name"]))
+    return merged, report
+
+
+def merge_report_csv(report: List[Dict[str, Any]]) -> str:
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=MERGE_REPORT_COLUMNS, lineterminator="\n")
+    w.writeheader()
+    w.writerows(report)
+    return buf.getvalue()
+
+
+# ---- Storefront artifacts: hashed list index + per-product detail shards, precompressed ----
+# Fields the grid needs; descriptions move to the per-product shards.
+INDEX_FIELDS = ("id", "name", "color", "category", "price", "visibility", "shipping_enabled", "variants")
+
+
+def short_blurb(text: str) -> str:
+    """Same cut as the storefront's shortBlurb(): <= 180 chars, preferring a sentence end."""
+    t = (text or "").strip()
+    if len(t) <= 180:
+        return t
+    dot = t.find(".")
+    if 80 < dot < 180:
+        return t[: dot + 1]
+    return t[:177] + "\u2026"
+
+
+def _minified(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _hashed_name(stem: str, body: bytes) -> str:
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}.json"
+
+
+def _write_bytes_atomic(path: str, body: bytes) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, path)
+
+
+def _write_precompressed(path: str, body: bytes) -> List[str]:
+    """Write `path` plus .gz (and .br if brotli is installed). Returns the files written.
+
+    `path` carries the content hash, so files already on disk are left alone: a rebuild
+    only compresses products that changed.
+    """
+    written = [path, f"{path}.gz"]
+    if not os.path.exists(path):
+        _write_bytes_atomic(path, body)
+    if not os.path.exists(f"{path}.gz"):
+        _write_bytes_atomic(f"{path}.gz", gzip.compress(body, compresslevel=9, mtime=0))
+    if brotli is not None:
+        if not os.path.exists(f"{path}.br"):
+            _write_bytes_atomic(f"{path}.br", brotli.compress(body, quality=11))
+        written.append(f"{path}.br")
+    return written
+
+
+# Only names this module generates are ever pruned (the directory may be shared, e.g. ".").
+_INDEX_FILE = re.compile(r"^index\.[0-9a-f]{12}\.json(\.gz|\.br)?$")
+_SHARD_FILE = re.compile(r"^[A-Za-z0-9_.-]+\.[0-9a-f]{12}\.json(\.gz|\.br)?$")
+
+
+def _rel(path: str, root: str) -> str:
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def write_catalog_artifacts(products: List[Dict[str, Any]], out_dir: str, content_hash: str,
+                            generated_at: str) -> Dict[str, Any]:
+    """
+    Emit `<out_dir>/index.<hash>.json` (grid fields + blurb + detail shard path per product),
+    `<out_dir>/products/<id>.<hash>.json` (full product) and `<out_dir>/manifest.json`
+    (the only unhashed file: points at the current index). Hashed files never change, so
+    they can be served `immutable`; generated files from older runs not referenced by the
+    current or previous manifest are removed. Nothing else in `out_dir` is touched.
+    """
+    os.makedirs(os.path.join(out_dir, "products"), exist_ok=True)
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    keep = set()
+    prev = _load_json(manifest_path)
+    if prev:
+        keep.update(prev.get("files") or [])
+
+    files: List[str] = []
+    entries = []
+    for p in products:
+        body = _minified(p)
+        stem = re.sub(r"[^A-Za-z0-9_.-]", "_", p.get("id", "")) or "product"
+        detail = f"products/{_hashed_name(stem, body)}"
+        files += [_rel(f, out_dir) for f in _write_precompressed(os.path.join(out_dir, detail), body)]
+        entry = {k: p[k] for k in INDEX_FIELDS if k in p}
+        entry["blurb"] = short_blurb(p.get("description_text", ""))
+        entry["detail"] = detail
+        entries.append(entry)
+
+    index_body = _minified({"generated_at": generated_at, "content_hash": content_hash,
+                            "count_merged": len(entries), "products": entries})
+    index_name = _hashed_name("index", index_body)
+    files += [_rel(f, out_dir) for f in _write_precompressed(os.path.join(out_dir, index_name), index_body)]
+
+    manifest = {"generated_at": generated_at, "content_hash": content_hash, "count": len(entries),
+                "index": index_name, "files": sorted(files)}
+    _write_bytes_atomic(manifest_path, _minified(manifest) + b"\n")
+
+    keep.update(files)
+    for sub, pattern in (("", _INDEX_FILE), ("products", _SHARD_FILE)):
+        folder = os.path.join(out_dir, sub)
+        for name in os.listdir(folder):
+            rel = f"{sub}/{name}" if sub else name
+            if pattern.match(name) and rel not in keep and os.path.isfile(os.path.join(folder, name)):
+                os.remove(os.path.join(folder, name))
+    return manifest
+
+
+def merged_document(out: Dict[str, Any], merged: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """square_products_merged.json for the raw catalog `out` and its merged products."""
+    doc = {
+        "generated_from": out.get("generated_from", ""),
+        "generated_at": out.get("generated_at", ""),
+        "count_original": len(out.get("products") or []),
+        "count_merged": len(merged),
+        "content_hash": out.get("content_hash", ""),
+        "products": merged,
+    }
+    if out.get("square_synced_at"):
+        doc["square_synced_at"] = out["square_synced_at"]
+    return doc
+
+
+def rebuild_derived(out: Dict[str, Any], merged_path: str = "", artifacts_dir: str = "",
+                    classify: Optional[Callable[[Iterable[Dict[str, Any]]], Iterable[Dict[str, Any]]]] = None
+                    ) -> List[Dict[str, Any]]:
+    """
+    Re-derive the merged catalog (`merged_path`) and the storefront artifacts
+    (`artifacts_dir`) from a raw catalog document, e.g. after the API patched
+    square_products_latest.json from a Square webhook. Returns the merged products.
+    """
+    merged, _ = merge_variants(out.get("products") or [], classify or CategoryClassifier().classify_batch)
+    if merged_path:
+        _write_atomic(merged_path, json.dumps(merged_document(out, merged), indent=2, ensure_ascii=False) + "\n")
+    if artifacts_dir:
+        write_catalog_artifacts(merged, artifacts_dir, out.get("content_hash", ""), out.get("generated_at", ""))
+    return merged
+
+
+def product_hash(p: Dict[str, Any]) -> str:
+    """Content hash of one product (canonical JSON), stable across runs and input formats."""
+    body = json.dumps(p, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]
+
+
+def catalog_hash(hashes: Dict[str, str]) -> str:
+    body = "\n".join(f"{pid}:{h}" for pid, h in sorted(hashes.items()))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]
+
+
+def diff_catalog(prev_products: List[Dict[str, Any]], products: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Added/removed/changed products between two catalogs, keyed by product id."""
+    prev = {p.get("id", ""): product_hash(p) for p in prev_products}
+    cur = {p.get("id", ""): product_hash(p) for p in products}
     return {
-        "generated_from": f"Square catalog export Excel ({os.path.basename(xlsx_path)})",
-        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
-        "count": len(products),
-        "products": products,
+        "from_hash": catalog_hash(prev),
+        "to_hash": catalog_hash(cur),
+        "added": [p for p in products if p.get("id", "") not in prev],
+        "removed": sorted(pid for pid in prev if pid not in cur),
+        "changed": [p for p in products if p.get("id", "") in prev and prev[p.get("id", "")] != cur[p.get("id", "")]],
     }
 
 
+def _load_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return doc if isinstance(doc, dict) else None
+
+
+def _load_previous(path: str) -> Optional[Dict[str, Any]]:
+    doc = _load_json(path)
+    return doc if doc is not None and isinstance(doc.get("products"), list) else None
+
+
+def _write_atomic(path: str, text: str) -> None:
+    # Write atomically to prevent corrupting outputs on a partial write.
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    finally:
+        # Best-effort cleanup if something failed mid-write.
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+
+
 def main(argv: List[str]) -> int:
-    xlsx_path = argv[1] if len(argv) > 1 else "1149XBNG8C8ZE_catalog-2026-02-11-0606.xlsx"
-    if not os.path.exists(xlsx_path):
-        print(f"ERROR: xlsx not found: {xlsx_path}", file=sys.stderr)
+    ap = argparse.ArgumentParser(description="Convert a Square catalog export into square_products_latest.json.")
+    # Square export: .xlsx, or the faster-to-parse .csv/.tsv download of the same catalog.
+    ap.add_argument("export", nargs="?", default="1149XBNG8C8ZE_catalog-2026-02-11-0606.xlsx")
+    ap.add_argument("--force", action="store_true", help="rewrite outputs even if no product changed")
+    ap.add_argument("--artifacts-dir", default="catalog",
+                    help="directory for the hashed storefront index/shards ('' to skip)")
+    ap.add_argument("--no-classify", action="store_true",
+                    help="keep Square's category on merged products instead of the storefront rules")
+    args = ap.parse_args(argv[1:])
+
+    export_path = args.export
+    if not os.path.exists(export_path):
+        print(f"ERROR: export not found: {export_path}", file=sys.stderr)
         return 2
 
-    out = build_catalog(xlsx_path)
+    out = build_catalog(export_path)
     if int(out.get("count") or 0) <= 0:
         print("ERROR: conversion produced 0 products; refusing to write outputs.", file=sys.stderr)
         return 3
 
     out_latest = "square_products_latest.json"
-    date = _extract_date_from_filename(xlsx_path)
+    out_delta = "square_products_delta.json"
+    out_merged = "square_products_merged.json"
+    out_report = "square_products_merge_report.csv"
+    date = _extract_date_from_filename(export_path)
     out_dated = f"square_products_{date}.json" if date else None
 
-    payload = json.dumps(out, indent=2, ensure_ascii=False)
-
-    # Write atomically to prevent corrupting "latest" on a partial write.
-    out_latest_tmp = "square_products_latest.tmp.json"
-    out_dated_tmp = f"{out_dated}.tmp" if out_dated else None
-
-    try:
-        with open(out_latest_tmp, "w", encoding="utf-8") as f:
-            f.write(payload + "\n")
-        os.replace(out_latest_tmp, out_latest)
-
-        if out_dated and out_dated_tmp:
-            with open(out_dated_tmp, "w", encoding="utf-8") as f:
-                f.write(payload + "\n")
-            os.replace(out_dated_tmp, out_dated)
-    finally:
-        # Best-effort cleanup if something failed mid-write.
-        for p in (out_latest_tmp, out_dated_tmp):
-            if p and os.path.exists(p):
-                try:
-                    os.remove(p)
-                except Exception:
-                    pass
-
-    print(f"Wrote {out_latest} (products={out['count']})")
-    if out_dated:
+    out["content_hash"] = catalog_hash({p["id"]: product_hash(p) for p in out["products"]})
+    prev = _load_previous(out_latest)
+    delta = diff_catalog(prev["products"], out["products"]) if prev is not None else None
+    changed = args.force or delta is None or bool(delta["added"] or delta["removed"] or delta["changed"])
+    payload = json.dumps(out, indent=2, ensure_ascii=False) + "\n"
+    if changed:
+        _write_atomic(out_latest, payload)
+        print(f"Wrote {out_latest} (products={out['count']})")
+    else:
+        # Leave the files (and their mtime/ETag) alone so downstream caches stay valid.
+        print(f"No product changes; {out_latest} left untouched (content_hash={out['content_hash']})")
+    # A new export date still gets its snapshot, even when its products match the previous one.
+    if out_dated and (changed or not os.path.exists(out_dated)):
+        _write_atomic(out_dated, payload)
         print(f"Wrote {out_dated}")
+
+    # Merge stage: one product per item name, variants tagged with color and categorized by
+    # scripts/normalize_categories.py rules (derived outputs are regenerated whenever the
+    # catalog changed, or if they are missing).
+    classify = None if args.no_classify else CategoryClassifier().classify_batch
+    merged = None
+    if changed or not (os.path.exists(out_merged) and os.path.exists(out_report)):
+        merged, report = merge_variants(out["products"], classify)
+        _write_atomic(out_merged, json.dumps(merged_document(out, merged), indent=2, ensure_ascii=False) + "\n")
+        _write_atomic(out_report, merge_report_csv(report))
+        print(f"Wrote {out_merged} (products={len(merged)}) and {out_report}")
+
+    # Storefront artifacts from the merged products (grid index + lazy detail shards).
+    if args.artifacts_dir and (changed or not os.path.exists(os.path.join(args.artifacts_dir, "manifest.json"))):
+        if merged is None:
+            merged, _ = merge_variants(out["products"], classify)
+        manifest = write_catalog_artifacts(merged, args.artifacts_dir, out["content_hash"], out["generated_at"])
+        print(f"Wrote {args.artifacts_dir}/{manifest['index']} + {manifest['count']} product shards")
+
+    if changed and delta is not None:
+        delta = {"generated_at": out["generated_at"], **delta}
+        _write_atomic(out_delta, json.dumps(delta, ensure_ascii=False, separators=(",", ":")) + "\n")
+        print(f"Wrote {out_delta} (added={len(delta['added'])} removed={len(delta['removed'])} "
+              f"changed={len(delta['changed'])})")
     return 0
 
 
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Responsive storefront images: AVIF/WebP at several widths plus a PNG fallback.
+
+Each source is decoded once; every width and format is encoded from that copy and named by
+content hash (`<stem>-<width>.<hash>.<ext>`), so the files can be cached forever. The
+manifest maps each source file name (what the storefront's image resolver picks) to its
+srcset entries; sources whose hash and settings are unchanged are not re-encoded.
+
+    python image_derivatives.py --in img --out img/responsive
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from PIL import Image
+
+try:
+    import pillow_avif  # noqa: F401  (registers AVIF on Pillow builds without it)
+except ImportError:
+    pass
+
+IMG_EXTS = {".png", ".jpg", ".jpeg", ".webp"}
+DEFAULT_WIDTHS = (320, 640, 960, 1280)
+DEFAULT_FORMATS = ("avif", "webp")
+FALLBACK_WIDTH = 800
+MANIFEST_VERSION = 1
+MIME = {"avif": "image/avif", "webp": "image/webp", "png": "image/png"}
+SAVE_ARGS: Dict[str, Dict[str, Any]] = {
+    "avif": {"format": "AVIF", "quality": 55, "speed": 6},
+    "webp": {"format": "WEBP", "quality": 80, "method": 6},
+    "png": {"format": "PNG", "optimize": True},
+}
+
+def supported_formats(formats: Sequence[str]) -> List[str]:
+    Image.init()
+    return [f for f in formats if SAVE_ARGS[f]["format"] in Image.SAVE]
+
+def target_widths(src_width: int, widths: Sequence[int]) -> List[int]:
+    # Never upscale; a source narrower than every width still gets one entry at its own size.
+    out = sorted({w for w in widths if w < src_width})
+    if not out or src_width <= max(widths):
+        out.append(src_width)
+    return sorted(set(out))
+
+def _resized(img: Image.Image, width: int) -> Image.Image:
+    if width >= img.width:
+        return img
+    return img.resize((width, max(1, round(img.height * width / img.width))), resample=Image.LANCZOS)
+
+def _write_hashed(out_dir: Path, stem: str, width: int, ext: str, img: Image.Image) -> str:
+    buf = io.BytesIO()
+    img.save(buf, **SAVE_ARGS[ext])
+    data = buf.getvalue()
+    name = f"{stem}-{width}.{hashlib.sha256(data).hexdigest()[:12]}.{ext}"
+    path = out_dir / name
+    if not path.exists():
+        tmp = path.with_name(f"{name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    return name
+
+def write_derivatives(img: Image.Image, stem: str, out_dir: Path, widths: Sequence[int] = DEFAULT_WIDTHS,
+                      formats: Sequence[str] = DEFAULT_FORMATS, fallback_width: int = FALLBACK_WIDTH) -> Dict[str, Any]:
+    """Encode every width/format of an already-decoded image; returns its manifest entry."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    slug = "".join(c if c.isalnum() or c in "-_" else "-" for c in stem).strip("-").lower() or "image"
+    sources: Dict[str, List[Dict[str, Any]]] = {MIME[f]: [] for f in formats}
+    # Largest first so each width is resampled from the full-resolution decode only once.
+    for w in sorted(target_widths(img.width, widths), reverse=True):
+        sized = _resized(img, w)
+        for f in formats:
+            sources[MIME[f]].insert(0, {"src": _write_hashed(out_dir, slug, w, f, sized), "w": w})
+    fw = min(fallback_width, img.width)
+    return {
+        "width": img.width,
+        "height": img.height,
+        "sources": sources,
+        "fallback": {"src": _write_hashed(out_dir, slug, fw, "png", _resized(img, fw)), "w": fw},
+    }
+
+def settings_key(widths: Sequence[int], formats: Sequence[str], fallback_width: int) -> Dict[str, Any]:
+    return {"widths": sorted(widths), "formats": list(formats), "fallback_width": fallback_width}
+
+def load_manifest(path: Path) -> Dict[str, Any]:
+    try:
+        doc = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return doc.get("images", {}) if doc.get("version") == MANIFEST_VERSION else {}
+
+def _referenced(entry: Dict[str, Any]) -> List[str]:
+    return [s["src"] for srcs in entry.get("sources", {}).values() for s in srcs] + [entry["fallback"]["src"]]
+
+def entry_is_current(entry: Optional[Dict[str, Any]], src_hash: str, settings: Dict[str, Any], out_dir: Path) -> bool:
+    return bool(entry) and entry.get("source_sha256") == src_hash and entry.get("settings") == settings \
+        and all((out_dir / name).exists() for name in _referenced(entry))
+
+def write_manifest(out_dir: Path, images: Dict[str, Any], prune: bool = True) -> Path:
+    """Write manifest.json and drop derivative files no entry references any more."""
+    path = out_dir / "manifest.json"
+    tmp = path.with_name("manifest.json.tmp")
+    tmp.write_text(json.dumps({"version": MANIFEST_VERSION, "images": images}, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+    if prune:
+        keep = {name for e in images.values() for name in _referenced(e)} | {"manifest.json"}
+        for f in out_dir.iterdir():
+            if f.is_file() and f.name not in keep and f.suffix in (".avif", ".webp", ".png"):
+                f.unlink()
+    return path
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def parse_widths(text: str) -> List[int]:
+    return sorted({int(w) for w in text.split(",") if w.strip()})
+
+def main():
+    ap = argparse.ArgumentParser(description="Build responsive AVIF/WebP/PNG derivatives and an image manifest.")
+    ap.add_argument("--in", dest="in_dir", default="img")
+    ap.add_argument("--out", dest="out_dir", default="img/responsive")
+    ap.add_argument("--widths", default=",".join(map(str, DEFAULT_WIDTHS)))
+    ap.add_argument("--formats", default=",".join(DEFAULT_FORMATS), help="subset of avif,webp")
+    ap.add_argument("--fallback-width", type=int, default=FALLBACK_WIDTH)
+    ap.add_argument("--force", action="store_true", help="re-encode even if the source is unchanged")
+    args = ap.parse_args()
+
+    in_dir = Path(args.in_dir).resolve()
+    out_dir = Path(args.out_dir).resolve()
+    if out_dir == in_dir:
+        raise SystemExit("--out must differ from --in (stale derivatives in --out are deleted)")
+    widths = parse_widths(args.widths)
+    wanted = [f.strip().lower() for f in args.formats.split(",") if f.strip()]
+    formats = supported_formats([f for f in wanted if f in ("avif", "webp")])
+    for f in set(wanted) - set(formats):
+        print(f"⚠️  {f}: not supported by this Pillow build, skipped (pip install pillow-avif-plugin for AVIF)")
+    settings = settings_key(widths, formats, args.fallback_width)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    previous = load_manifest(out_dir / "manifest.json")
+    images: Dict[str, Any] = {}
+    built = 0
+    for p in sorted(q for q in in_dir.iterdir() if q.is_file() and q.suffix.lower() in IMG_EXTS):
+        src_hash = file_sha256(p)
+        entry = previous.get(p.name)
+        if args.force or not entry_is_current(entry, src_hash, settings, out_dir):
+            with Image.open(p) as img:
+                img.load()
+                entry = write_derivatives(img, p.stem, out_dir, widths, formats, args.fallback_width)
+            entry.update(source_sha256=src_hash, settings=settings)
+            built += 1
+        images[p.name] = entry
+
+    path = write_manifest(out_dir, images)
+    print(f"✅ {built} of {len(images)} images encoded ({', '.join(formats + ['png'])}). Manifest: {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""Benchmark the catalog conversion pipeline on synthetic Square exports.
+
+Generates an export of `--products` items x `--variants` sizes with `--desc-chars` of HTML
+description per item, written as .xlsx and .csv (Square's two download formats) plus the
+converted .json, then times each stage of a catalog refresh and records its peak Python
+memory (tracemalloc):
+
+    python scripts/bench_catalog.py --products 2000 --variants 4 --desc-chars 800
+    python scripts/bench_catalog.py --export 1149XBNG8C8ZE_catalog-2026-02-11-0606.xlsx
+    python scripts/bench_catalog.py --generate /tmp/synthetic   # only write the files
+
+Each stage runs `--repeat` times untraced (median and min reported), then once more under
+tracemalloc for its peak. `--profile DIR` writes `<stage>.prof` per stage
+(`python -m pstats DIR/build_xlsx.prof`). `--save-baseline FILE` stores the results;
+`--baseline FILE` compares against them and exits non-zero when a stage's median time or
+peak memory regresses past `--max-regression`. Compare runs of the same workload on the
+same machine only.
+"""
+import argparse
+import cProfile
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.insert(0, ROOT)
+
+import convert_catalog as cc  # noqa: E402
+from scripts.normalize_categories import CategoryClassifier, normalize_category, synthetic_products  # noqa: E402
+
+# Header as Square exports it: the converter's columns plus ones it ignores.
+EXPORT_HEADER = ("Token", "Item Name", "Variation Name", "SKU", "Description", "Categories",
+                 "Reporting Category", "Price", "Online Sale Price", "Square Online Item Visibility",
+                 "Shipping Enabled", "Option Name 1", "Option Value 1", "Reference Handle",
+                 "Stock Alert Enabled", "Tax - Sales Tax")
+SIZES = ("XS", "S", "M", "L", "XL", "2XL", "3XL", "4XL", "5XL", "One Size")
+COLORS = ("Black", "White", "Heather Grey", "Navy", "Forest Green", "Maroon", "Sand")
+CATEGORIES = ("Apparel", "Hoodies", "Tees", "Hats", "Stickers", "Utility", "")
+WORDS = ("premium", "heavyweight", "cotton", "garment-dyed", "relaxed", "fit", "screen", "printed",
+         "artwork", "signal", "orbit", "limited", "run", "soft", "hand", "ribbed", "cuffs", "unisex")
+STAGES = ("parse_xlsx", "parse_csv", "build_xlsx", "build_csv", "strip_html", "to_float",
+          "normalize_category", "merge", "hash", "json_dump", "json_load", "artifacts")
+
+
+def _description(rng: random.Random, chars: int) -> str:
+    """Roughly `chars` of Square-style description HTML (paragraphs, emphasis, a list)."""
+    if chars <= 0:
+        return ""
+    parts: List[str] = []
+    size = 0
+    while size < chars:
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18)))
+        block = rng.choice((f"<p>{words}.</p>", f"<p><strong>{words}</strong></p>",
+                            f"<ul><li>{words}</li><li>{rng.choice(WORDS)}</li></ul>",
+                            f"<p>{words}&nbsp;<em>{rng.choice(WORDS)}</em><br></p>"))
+        parts.append(block)
+        size += len(block)
+    return "".join(parts)
+
+
+def _price_cell(rng: random.Random, price: float, as_text: bool) -> Any:
+    # Mostly numbers; some exports carry text like "$1,299.00" (the _to_float fallback path).
+    if rng.random() < 0.1:
+        return f"${price:,.2f}"
+    return f"{price:.2f}" if as_text else price
+
+
+def synthetic_rows(products: int, variants: int, desc_chars: int, seed: int = 7) -> List[List[Any]]:
+    """Export rows (without header) for `products` items of `variants` sizes each."""
+    rng = random.Random(seed)
+    names = [p["name"] for p in synthetic_products(max(1, products), seed)]
+    sizes = SIZES[:max(1, min(variants, len(SIZES)))]
+    rows: List[List[Any]] = []
+    for i in range(products):
+        # About a third of the items are another color of an earlier item (merge groups).
+        if i and rng.random() < 0.35:
+            base = names[rng.randrange(i)]
+        else:
+            base = names[i]
+        color = rng.choice(COLORS) if rng.random() < 0.8 else ""
+        item_name = f"{base} ({color})" if color else base
+        handle = f"#item-{i:06d}"
+        price = rng.choice((12.0, 18.5, 28.0, 34.0, 46.0, 58.0))
+        description = _description(rng, desc_chars)
+        category = rng.choice(CATEGORIES)
+        visibility = "hidden" if rng.random() < 0.05 else "visible"
+        for j in range(variants):
+            size = sizes[j % len(sizes)] if j < len(sizes) else f"{sizes[-1]} {j}"
+            rows.append([
+                f"TOK{i:06d}{j:03d}", item_name, size, f"SKU-{i:06d}-{j}",
+                description if j == 0 else "", category, "",
+                price + (2.0 if size in ("2XL", "3XL", "4XL", "5XL") else 0.0), "",
+                visibility, "Y", "Size", size, f"{handle}--{size.lower().replace(' ', '-')}", "N", "Y",
+            ])
+    return rows
+
+
+def write_xlsx(path: str, rows: List[List[Any]], rng: random.Random) -> None:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Items")
+    ws.append([])  # Square exports start with a blank row
+    ws.append(list(EXPORT_HEADER))
+    for row in rows:
+        row = list(row)
+        row[7] = _price_cell(rng, row[7], as_text=False)
+        ws.append(row)
+    wb.save(path)
+
+
+def write_csv(path: str, rows: List[List[Any]], rng: random.Random) -> None:
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(EXPORT_HEADER)
+        for row in rows:
+            row = list(row)
+            row[7] = _price_cell(rng, row[7], as_text=True)
+            w.writerow(row)
+
+
+def generate(out_dir: str, products: int, variants: int, desc_chars: int, seed: int = 7) -> Dict[str, str]:
+    """Write synthetic-<date>.xlsx/.csv and the converted .json into `out_dir`."""
+    os.makedirs(out_dir, exist_ok=True)
+    rows = synthetic_rows(products, variants, desc_chars, seed)
+    stem = os.path.join(out_dir, "synthetic-2026-01-01")
+    paths = {"xlsx": stem + ".xlsx", "csv": stem + ".csv", "json": stem + ".json"}
+    write_xlsx(paths["xlsx"], rows, random.Random(seed))
+    write_csv(paths["csv"], rows, random.Random(seed))
+    doc = cc.build_catalog(paths["csv"])
+    doc["content_hash"] = cc.catalog_hash({p["id"]: cc.product_hash(p) for p in doc["products"]})
+    with open(paths["json"], "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2, ensure_ascii=False)
+    return paths
+
+
+class Stage(NamedTuple):
+    name: str
+    items: int  # units of work per run (rows, products, cells) for the per-item figure
+    run: Callable[[], Any]
+
+
+def _stages(paths: Dict[str, str], work_dir: str) -> List[Stage]:
+    rows = list(cc.iter_export_rows(paths.get("csv") or paths["xlsx"]))
+    with open(paths["json"], "r", encoding="utf-8") as f:
+        text = f.read()
+    doc = json.loads(text)
+    products = doc["products"]
+    descriptions = [cc._cell_str(r.description) for r in rows]
+    prices = [r.price for r in rows] + [r.online_sale_price for r in rows]
+    classifier = CategoryClassifier()
+    merged, _ = cc.merge_variants(products, classifier.classify_batch)
+    artifacts_dir = os.path.join(work_dir, "catalog")
+
+    def consume(it) -> int:
+        return sum(1 for _ in it)
+
+    def artifacts():
+        shutil.rmtree(artifacts_dir, ignore_errors=True)
+        return cc.write_catalog_artifacts(merged, artifacts_dir, doc["content_hash"], doc["generated_at"])
+
+    out = []
+    for fmt in ("xlsx", "csv"):
+        if paths.get(fmt):
+            out.append(Stage(f"parse_{fmt}", len(rows), lambda p=paths[fmt]: consume(cc.iter_export_rows(p))))
+            out.append(Stage(f"build_{fmt}", len(rows), lambda p=paths[fmt]: cc.build_catalog(p)))
+    out += [
+        Stage("strip_html", len(descriptions), lambda: [cc._strip_html(d) for d in descriptions]),
+        Stage("to_float", len(prices), lambda: [cc._to_float(v) for v in prices]),
+        Stage("normalize_category", len(products), lambda: [normalize_category(p) for p in products]),
+        Stage("merge", len(products), lambda: cc.merge_variants(products, classifier.classify_batch)),
+        Stage("hash", len(products), lambda: cc.catalog_hash({p["id"]: cc.product_hash(p) for p in products})),
+        Stage("json_dump", len(products), lambda: json.dumps(doc, indent=2, ensure_ascii=False)),
+        Stage("json_load", len(products), lambda: json.loads(text)),
+        Stage("artifacts", len(merged), artifacts),
+    ]
+    return out
+
+
+def run_stage(stage: Stage, repeat: int, profile_dir: str = "") -> Dict[str, Any]:
+    times = []
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        stage.run()
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    try:
+        stage.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        prof = cProfile.Profile()
+        prof.runcall(stage.run)
+        prof.dump_stats(os.path.join(profile_dir, f"{stage.name}.prof"))
+
+    median = statistics.median(times)
+    return {
+        "stage": stage.name,
+        "items": stage.items,
+        "median_ms": round(median * 1000, 2),
+        "min_ms": round(min(times) * 1000, 2),
+        "us_per_item": round(median * 1e6 / stage.items, 3) if stage.items else 0.0,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], max_regression: float,
+            min_ms: float = 1.0) -> List[str]:
+    problems = []
+    base_by_stage = {r["stage"]: r for r in baseline.get("results", [])}
+    for r in results:
+        b = base_by_stage.get(r["stage"])
+        if not b:
+            continue
+        # Sub-millisecond differences are timer noise, not regressions.
+        slower = r["median_ms"] - b.get("median_ms", 0)
+        if b.get("median_ms") and r["median_ms"] > b["median_ms"] * (1 + max_regression) and slower > min_ms:
+            problems.append(f"{r['stage']}: {r['median_ms']}ms vs baseline {b['median_ms']}ms")
+        if b.get("peak_kib") and r["peak_kib"] > b["peak_kib"] * (1 + max_regression):
+            problems.append(f"{r['stage']}: peak {r['peak_kib']}KiB vs baseline {b['peak_kib']}KiB")
+    return problems
+
+
+def _print_table(results: List[Dict[str, Any]]) -> None:
+    cols = ("stage", "items", "median_ms", "min_ms", "us_per_item", "peak_kib")
+    print("  ".join(f"{c:>18}" for c in cols))
+    for r in results:
+        print("  ".join(f"{r[c]:>18}" for c in cols))
+
+
+def _workload(args, paths: Dict[str, str]) -> Dict[str, Any]:
+    if args.export:
+        return {"export": os.path.basename(args.export)}
+    return {"products": args.products, "variants": args.variants, "desc_chars": args.desc_chars,
+            "seed": args.seed, "bytes": {k: os.path.getsize(p) for k, p in paths.items() if p}}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark catalog conversion stages on synthetic Square exports.")
+    ap.add_argument("--products", type=int, default=2000, help="items in the synthetic export")
+    ap.add_argument("--variants", type=int, default=4, help="size variations per item")
+    ap.add_argument("--desc-chars", type=int, default=600, help="description HTML length per item")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--export", default="", help="benchmark this .xlsx/.csv export instead of a synthetic one")
+    ap.add_argument("--generate", metavar="DIR", default="", help="only write the synthetic files to DIR")
+    ap.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated, from: {', '.join(STAGES)}")
+    ap.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    ap.add_argument("--profile", metavar="DIR", default="", help="write a cProfile <stage>.prof per stage to DIR")
+    ap.add_argument("--json", dest="json_out", default="", help="write results to this file")
+    ap.add_argument("--baseline", default="", help="compare against a previous --json/--save-baseline file")
+    ap.add_argument("--save-baseline", default="", help="write results as the new baseline")
+    ap.add_argument("--max-regression", type=float, default=0.2, help="allowed fractional regression")
+    args = ap.parse_args(argv)
+
+    if args.generate:
+        t0 = time.perf_counter()
+        paths = generate(args.generate, args.products, args.variants, args.desc_chars, args.seed)
+        for p in paths.values():
+            print(f"Wrote {p} ({os.path.getsize(p):,} bytes)")
+        print(f"Generated in {time.perf_counter() - t0:.1f}s")
+        return 0
+
+    names = [n.strip() for n in args.stages.split(",") if n.strip()]
+    unknown = sorted(set(names) - set(STAGES))
+    if unknown:
+        print(f"ERROR: unknown stages: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    work_dir = tempfile.mkdtemp(prefix="bench_catalog-")
+    try:
+        if args.export:
+            if not os.path.exists(args.export):
+                print(f"ERROR: export not found: {args.export}", file=sys.stderr)
+                return 2
+            fmt = cc.export_format(args.export)
+            paths = {"xlsx": "", "csv": "", fmt: args.export, "json": os.path.join(work_dir, "catalog.json")}
+            doc = cc.build_catalog(args.export)
+            doc["content_hash"] = cc.catalog_hash({p["id"]: cc.product_hash(p) for p in doc["products"]})
+            with open(paths["json"], "w", encoding="utf-8") as f:
+                json.dump(doc, f, indent=2, ensure_ascii=False)
+        else:
+            t0 = time.perf_counter()
+            paths = generate(work_dir, args.products, args.variants, args.desc_chars, args.seed)
+            print(f"Generated {args.products} products x {args.variants} variants "
+                  f"in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+        results = [run_stage(s, args.repeat, args.profile) for s in _stages(paths, work_dir) if s.name in names]
+        workload = _workload(args, paths)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    _print_table(results)
+
+    doc = {"workload": workload, "python": platform.python_version(), "results": results}
+    for path in (args.json_out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(doc, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if {k: v for k, v in baseline.get("workload", {}).items() if k != "bytes"} != \
+                {k: v for k, v in workload.items() if k != "bytes"}:
+            print(f"WARNING: baseline workload differs: {baseline.get('workload')}", file=sys.stderr)
+        problems = compare(results, baseline, args.max_regression)
+        if problems:
+            print("REGRESSION:", file=sys.stderr)
+            for p in problems:
+                print(f"  {p}", file=sys.stderr)
+            return 1
+        print(f"No regressions beyond {args.max_regression:.0%} vs {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,44 +1,151 @@
 #!/usr/bin/env python3
 """Set canonical category on each product in square_products_merged.json.
 Categories: Hoodies, Crewnecks, Hats, Tees, Stickers, Apparel (fallback).
+
+The rules are an ordered table (first match wins); CategoryClassifier scans them in order
+with substring tests over one lowercase name + id per product. convert_catalog.py streams the merged products
+through it, so a normal conversion already classifies; this script re-applies it to an
+existing file. The expected categories are pinned in tests/test_normalize_categories.py.
+
+    python scripts/normalize_categories.py            # rewrite square_products_merged.json
+    python scripts/normalize_categories.py --bench 100000
 """
+import argparse
 import json
+import os
+import random
 import re
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
 
-import os
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT = os.path.dirname(SCRIPT_DIR)
 PATH = os.path.join(ROOT, "square_products_merged.json")
 
-def normalize_category(product):
-    name = (product.get("name") or "").lower()
-    pid = (product.get("id") or "").lower()
-    hay = name + " " + pid
-
-    if "sticker" in hay:
-        return "Stickers"
-    if "hoodie" in hay or ("pullover" in hay and "hood" in hay) or "zip" in hay and "hood" in hay:
-        return "Hoodies"
-    if "pullover" in hay:
-        return "Hoodies"
-    if "crewneck" in hay or "sweatshirt" in hay or "crew" in hay:
-        return "Crewnecks"
-    if "cap" in hay or "hat" in hay or "trucker" in hay or "snapback" in hay or "beanie" in hay:
-        return "Hats"
-    if "tee" in hay or "t-shirt" in hay or "long sleeve" in hay or "long-sleeve" in hay:
-        return "Tees"
-    if "shirt" in hay and "hood" not in hay:
-        return "Tees"
-    return "Apparel"
-
-def main():
-    with open(PATH, "r", encoding="utf-8") as f:
+
+class Rule(NamedTuple):
+    category: str
+    all_of: Tuple[str, ...]
+    none_of: Tuple[str, ...] = ()
+
+
+# Ordered: the first rule whose keywords all occur (and none of `none_of`) wins.
+CATEGORY_RULES: Tuple[Rule, ...] = (
+    Rule("Stickers", ("sticker",)),
+    Rule("Hoodies", ("hoodie",)),
+    Rule("Hoodies", ("zip", "hood")),
+    Rule("Hoodies", ("pullover",)),
+    Rule("Crewnecks", ("crewneck",)),
+    Rule("Crewnecks", ("sweatshirt",)),
+    Rule("Crewnecks", ("crew",)),
+    Rule("Hats", ("cap",)),
+    Rule("Hats", ("hat",)),
+    Rule("Hats", ("trucker",)),
+    Rule("Hats", ("snapback",)),
+    Rule("Hats", ("beanie",)),
+    Rule("Tees", ("tee",)),
+    Rule("Tees", ("t-shirt",)),
+    Rule("Tees", ("long sleeve",)),
+    Rule("Tees", ("long-sleeve",)),
+    Rule("Tees", ("shirt",), none_of=("hood",)),
+)
+DEFAULT_CATEGORY = "Apparel"
+# Square categories kept as-is: the storefront hides Utility (non-merch) items.
+PRESERVED_CATEGORIES = ("Utility",)
+
+
+class CategoryClassifier:
+    """
+    Ordered substring scan over one lowercase haystack (name + id). Each rule becomes a step
+    keyed on its first keyword, tried in table order; only steps whose keyword is present and
+    that carry more keywords or exclusions look further.
+    """
+
+    def __init__(self, rules: Sequence[Rule] = CATEGORY_RULES, default: str = DEFAULT_CATEGORY):
+        self.default = default
+        self.rules = tuple(rules)
+        # (first keyword, category, None | (other keywords, excluded keywords))
+        self._steps: Tuple[Tuple[str, str, Optional[Tuple[Tuple[str, ...], Tuple[str, ...]]]], ...] = tuple(
+            (r.all_of[0].lower(), r.category,
+             None if len(r.all_of) == 1 and not r.none_of
+             else (tuple(k.lower() for k in r.all_of[1:]), tuple(k.lower() for k in r.none_of)))
+            for r in self.rules
+        )
+
+    def classify_text(self, hay: str) -> str:
+        """Category for already-lowercased text."""
+        for first, category, extra in self._steps:
+            if first in hay:
+                if extra is None:
+                    return category
+                if all(k in hay for k in extra[0]) and not any(k in hay for k in extra[1]):
+                    return category
+        return self.default
+
+    def classify(self, product: Dict[str, Any]) -> str:
+        return self.classify_text((product.get("name") or "").lower() + " " + (product.get("id") or "").lower())
+
+    def classify_batch(self, products: Iterable[Dict[str, Any]],
+                       preserve: Sequence[str] = PRESERVED_CATEGORIES) -> Iterator[Dict[str, Any]]:
+        """Stream products through, setting `category` in place (except preserved ones)."""
+        keep = {c.lower() for c in preserve}
+        classify = self.classify
+        for p in products:
+            if (p.get("category") or "").lower() not in keep:
+                p["category"] = classify(p)
+            yield p
+
+
+_default = CategoryClassifier()
+normalize_category = _default.classify
+
+
+def synthetic_products(n: int, seed: int = 7) -> List[Dict[str, str]]:
+    """Random names mixing every rule keyword with filler (incl. overlaps like 'chatee')."""
+    rng = random.Random(seed)
+    words = sorted({k for r in CATEGORY_RULES for k in r.all_of + r.none_of})
+    words += ["premium", "print", "black", "oversized", "heavyweight", "edition", "chat", "steel",
+              "capture", "hood", "v2", "—", "“signal”", "unisex", "zipper", "crewmate", "shirtless"]
+    out = []
+    for i in range(n):
+        name = " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+        if rng.random() < 0.2:
+            name = name.replace(" ", "")
+        out.append({"id": re.sub(r"\W+", "-", name.lower()) + f"-{i}", "name": name.title()})
+    return out
+
+
+def bench(n: int) -> None:
+    products = synthetic_products(n)
+    t0 = time.perf_counter()
+    for p in products:
+        normalize_category(p)
+    dt = time.perf_counter() - t0
+    print(f"{'classify':>8}: {dt * 1000:8.1f} ms for {n} products ({n / dt:,.0f}/s)")
+    t0 = time.perf_counter()
+    for _ in _default.classify_batch(products, preserve=()):
+        pass
+    dt = time.perf_counter() - t0
+    print(f"{'batch':>8}: {dt * 1000:8.1f} ms for {n} products ({n / dt:,.0f}/s)")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("path", nargs="?", default=PATH)
+    ap.add_argument("--bench", type=int, metavar="N", help="time the classifier on N synthetic products")
+    args = ap.parse_args(argv)
+    if args.bench:
+        bench(args.bench)
+        return 0
+
+    with open(args.path, "r", encoding="utf-8") as f:
         data = json.load(f)
-    for p in data.get("products", []):
-        p["category"] = normalize_category(p)
-    with open(PATH, "w", encoding="utf-8") as f:
+    data["products"] = list(_default.classify_batch(data.get("products", [])))
+    with open(args.path, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
-    print(f"Updated categories in {PATH}")
+    print(f"Updated categories in {args.path}")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
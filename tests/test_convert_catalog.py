@@ -0,0 +1,72 @@
+"""convert_catalog.py end to end on a small synthetic export (scripts/bench_catalog.py generator)."""
+import csv
+import os
+import random
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import convert_catalog  # noqa: E402
+from scripts import bench_catalog  # noqa: E402
+
+
+def write_export(path, products=12, variants=3):
+    bench_catalog.write_csv(path, bench_catalog.synthetic_rows(products, variants, 80), random.Random(7))
+
+
+def test_unchanged_export_still_gets_dated_snapshot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_export("export-2026-01-01.csv")
+    assert convert_catalog.main(["convert_catalog.py", "export-2026-01-01.csv", "--artifacts-dir", ""]) == 0
+    assert os.path.exists("square_products_2026-01-01.json")
+    latest_mtime = os.stat("square_products_latest.json").st_mtime_ns
+
+    # The next day's export has the same products: latest is left alone, the dated file is new.
+    shutil.copy("export-2026-01-01.csv", "export-2026-01-02.csv")
+    assert convert_catalog.main(["convert_catalog.py", "export-2026-01-02.csv", "--artifacts-dir", ""]) == 0
+    assert os.stat("square_products_latest.json").st_mtime_ns == latest_mtime
+    assert os.path.exists("square_products_2026-01-02.json")
+
+
+def write_tsv(path, rows, rng):
+    # Square's "tab separated" download: same cells as the CSV, prices as text.
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f, delimiter="\t")
+        w.writerow(bench_catalog.EXPORT_HEADER)
+        for row in rows:
+            row = list(row)
+            row[7] = bench_catalog._price_cell(rng, row[7], as_text=True)
+            w.writerow(row)
+
+
+@pytest.fixture(scope="module")
+def export_trio(tmp_path_factory):
+    rows = bench_catalog.synthetic_rows(60, 4, 200)
+    # Cells that need quoting in CSV/TSV: separators, quotes, line breaks, non-ASCII.
+    rows[0][1] = 'Golden Eye "Sigil", Tab\tEdition (Black)'
+    rows[0][4] = "<p>Line one,\nline two\t\u2014 \u201cquoted\u201d</p>"
+    out = tmp_path_factory.mktemp("exports")
+    paths = {ext: str(out / f"export-2026-01-01.{ext}") for ext in ("xlsx", "csv", "tsv")}
+    bench_catalog.write_xlsx(paths["xlsx"], rows, random.Random(7))
+    bench_catalog.write_csv(paths["csv"], rows, random.Random(7))
+    write_tsv(paths["tsv"], rows, random.Random(7))
+    return paths
+
+
+def test_export_formats_read_the_same_rows(export_trio):
+    rows = {fmt: list(convert_catalog.iter_export_rows(path)) for fmt, path in export_trio.items()}
+    assert len(rows["xlsx"]) == 240
+    assert [convert_catalog.export_format(p) for p in export_trio.values()] == ["xlsx", "csv", "csv"]
+    assert rows["csv"] == rows["tsv"]
+
+
+def test_export_formats_build_identical_products(export_trio):
+    docs = {fmt: convert_catalog.build_catalog(path) for fmt, path in export_trio.items()}
+    assert docs["xlsx"]["count"] == 60
+    assert docs["csv"]["products"] == docs["xlsx"]["products"]
+    assert docs["tsv"]["products"] == docs["xlsx"]["products"]
+    assert docs["xlsx"]["products"][0]["name"] == 'Golden Eye "Sigil", Tab\tEdition'
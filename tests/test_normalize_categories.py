@@ -0,0 +1,128 @@
+"""Fixture cases for scripts/normalize_categories.py: product name/id -> storefront category."""
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import convert_catalog  # noqa: E402
+from scripts.normalize_categories import CategoryClassifier, Rule, normalize_category, synthetic_products  # noqa: E402
+
+CASES = [
+    # Names and ids as they come out of the Square export.
+    ("“Golden Eye Sigil” Premium Sweatshirt", "-golden-eye-sigil-premium-sweatshirt-2xl", "Crewnecks"),
+    ("AeroVista “Apex Draft” Pullover Hoodie", "aerovista-apex-draft-pullover-hoodie-black", "Hoodies"),
+    ("AeroVista “Apex Draft” Zip Hoodie", "aerovista-apex-draft-zip-hoodie-black", "Hoodies"),
+    ("AeroVista “Apex Mesh” Trucker Cap", "aerovista-apex-mesh-trucker-cap-", "Hats"),
+    ("Bonsaid bubble-free stickers", "bonsaid-bubble-free-stickers-1-3-3-", "Stickers"),
+    ("BONSAID “Rooted Resilience” Hoodie – Premium Print",
+     "bonsaid-rooted-resilience-hoodie-premium-print-black-2xl", "Hoodies"),
+    ("CDA Pool League Circuit Long Sleeve Tee — Vintage Comic Print",
+     "cda-pool-league-circuit-long-sleeve-tee-vintage-comic-print-2xl", "Tees"),
+    ("Holographic stickers", "holographic-stickers-3-3-", "Stickers"),
+    ("A", "a-", "Apparel"),
+    # Table order: earlier rules win.
+    ("Sticker Pack: Hoodie Edition", "", "Stickers"),
+    ("Zip Hood Jacket", "", "Hoodies"),
+    ("Zipper Pouch", "", "Apparel"),
+    ("Pullover Crew", "", "Hoodies"),
+    ("Crewneck Sweatshirt", "", "Crewnecks"),
+    ("Crew Beanie", "", "Crewnecks"),
+    ("Snapback", "", "Hats"),
+    ("Heavyweight T-Shirt", "", "Tees"),
+    ("Long-Sleeve Raglan", "", "Tees"),
+    ("Oxford Shirt", "", "Tees"),
+    ("Hooded Shirt", "", "Apparel"),
+    # Substrings count, wherever they fall (same as the original `in` checks).
+    ("Capture Print", "", "Hats"),
+    ("Shirtless Club", "", "Tees"),
+    ("Chatee", "", "Hats"),
+    ("Steel Print", "", "Tees"),
+    ("Plain Print", "plain-sweatshirt-xl", "Crewnecks"),
+    ("", "", "Apparel"),
+]
+
+
+def original_category(product):
+    """The hand-chained checks the rule table replaced, pinned as the golden reference."""
+    name = (product.get("name") or "").lower()
+    pid = (product.get("id") or "").lower()
+    hay = name + " " + pid
+
+    if "sticker" in hay:
+        return "Stickers"
+    if "hoodie" in hay or ("pullover" in hay and "hood" in hay) or "zip" in hay and "hood" in hay:
+        return "Hoodies"
+    if "pullover" in hay:
+        return "Hoodies"
+    if "crewneck" in hay or "sweatshirt" in hay or "crew" in hay:
+        return "Crewnecks"
+    if "cap" in hay or "hat" in hay or "trucker" in hay or "snapback" in hay or "beanie" in hay:
+        return "Hats"
+    if "tee" in hay or "t-shirt" in hay or "long sleeve" in hay or "long-sleeve" in hay:
+        return "Tees"
+    if "shirt" in hay and "hood" not in hay:
+        return "Tees"
+    return "Apparel"
+
+
+@pytest.mark.parametrize("name,pid,expected", CASES)
+def test_fixture_category(name, pid, expected):
+    assert normalize_category({"name": name, "id": pid}) == expected
+
+
+def test_matches_original_rules_on_synthetic_products():
+    products = synthetic_products(50_000)
+    mismatches = [(p["name"], p["id"]) for p in products if normalize_category(p) != original_category(p)]
+    assert mismatches == []
+
+
+def test_matches_original_rules_on_catalog():
+    products = []
+    for name in ("square_products_latest.json", "square_products_merged.json"):
+        with open(os.path.join(ROOT, name), "r", encoding="utf-8") as f:
+            products += json.load(f)["products"]
+    assert [normalize_category(p) for p in products] == [original_category(p) for p in products]
+
+
+def test_missing_fields_fall_back():
+    assert normalize_category({}) == "Apparel"
+    assert normalize_category({"name": None, "id": None}) == "Apparel"
+
+
+def test_batch_overwrites_square_category():
+    products = [{"name": name, "id": pid, "category": "Apparel"} for name, pid, _ in CASES]
+    out = list(CategoryClassifier().classify_batch(products))
+    assert [p["category"] for p in out] == [expected for _, _, expected in CASES]
+
+
+def test_batch_keeps_utility():
+    products = [{"name": "Neck Gaiter", "id": "neck-gaiter-", "category": "Utility"},
+                {"name": "Neck Gaiter Tee", "id": "neck-gaiter-tee", "category": "Apparel"}]
+    assert [p["category"] for p in CategoryClassifier().classify_batch(products)] == ["Utility", "Tees"]
+    assert [p["category"] for p in CategoryClassifier().classify_batch(products, preserve=())] == ["Apparel", "Tees"]
+
+
+def test_utility_items_stay_utility_after_conversion():
+    # The storefront hides `category: Utility` items; the merged file must keep them that way.
+    with open(os.path.join(ROOT, "square_products_latest.json"), "r", encoding="utf-8") as f:
+        products = json.load(f)["products"]
+    utility = {convert_catalog.merge_key(p["name"]) for p in products if p.get("category") == "Utility"}
+    assert utility
+    merged, report = convert_catalog.merge_variants(products, CategoryClassifier().classify_batch)
+    assert {convert_catalog.merge_key(p["name"]) for p in merged if p["category"] == "Utility"} == utility
+    assert {convert_catalog.merge_key(r["name"]) for r in report if r["category"] == "Utility"} == utility
+
+
+def test_custom_rules_first_match_wins():
+    classifier = CategoryClassifier(
+        (Rule("Bundles", ("Hoodie", "Cap")), Rule("Hats", ("cap",)), Rule("Tops", ("hoodie",), none_of=("zip",))),
+        default="Other",
+    )
+    assert classifier.classify({"name": "Hoodie + Cap Bundle"}) == "Bundles"
+    assert classifier.classify({"name": "Trucker Cap"}) == "Hats"
+    assert classifier.classify({"name": "Pullover Hoodie"}) == "Tops"
+    assert classifier.classify({"name": "Zip Hoodie"}) == "Other"